@@ -1,39 +1,72 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.exc import SQLAlchemyError
 
-from db import create_db_and_tables, delete_db_and_tables, engine
-from routers import author, book, checkout, copy, member
-from setup import (
-    create_authors_and_books,
-    create_checkouts,
-    create_copies,
-    create_members,
+from db import (
+    db_settings,
+    engine,
+    ping_db,
+    replica_engines,
+    run_migrations,
+    warmup_pool,
 )
-from utils import get_token
+from instrumentation import ProfilingMiddleware
+from routers import author, book, checkout, copy, export, member, metrics
+from suggest import get_suggest_index
 
 # Installer flake8 et mypy
 load_dotenv()
-app = FastAPI(title="Shadow library API")
-get_token()
-
-
-app.include_router(author.router, tags=["Author"])
-app.include_router(book.router, tags=["Book"])
-app.include_router(book.unsecure_router, tags=["Book"])
-app.include_router(copy.router, tags=["Copy"])
-app.include_router(checkout.router, tags=["Checkout"])
-app.include_router(member.router, tags=["Member"])
-
-# This would be removed in production but is useful for development
-# This will reset the database everytime you run the app. Comment as needed.
-
-print("Deleting tables.")
-delete_db_and_tables(engine)
-print("Creating the tables.")
-create_db_and_tables(engine)
-print("Inserting basic values.")
-create_authors_and_books(engine)
-create_members(engine)
-create_copies(engine)
-create_checkouts(engine)
-# if __name__ == "__main__":
+
+
+async def load_suggestions():
+    try:
+        await get_suggest_index().load(engine)
+    except (OSError, SQLAlchemyError) as e:
+        print("Failed to load the suggestions:", e)
+
+
+# Nothing is done at import time: the database is only reached once the server
+# starts, to apply the migrations (see migrations/README). Use
+# `python cli.py seed --reset` to reset the database with test values.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ping_db(engine)
+    await run_migrations(engine)
+    await warmup_pool(engine, db_settings.pool_warmup)
+    for replica in replica_engines:
+        await warmup_pool(replica, db_settings.pool_warmup)
+    # The index of /books/suggest doesn't delay the startup, see suggest.py.
+    loading = asyncio.create_task(load_suggestions())
+    yield
+    loading.cancel()
+    await engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
+
+
+def create_app() -> FastAPI:
+    # The responses are encoded with orjson, the list routes even skip the validation
+    # of their response model, see serialization.py.
+    app = FastAPI(
+        title="Shadow library API",
+        lifespan=lifespan,
+        default_response_class=ORJSONResponse,
+    )
+    app.add_middleware(ProfilingMiddleware)
+
+    app.include_router(author.router, tags=["Author"])
+    app.include_router(book.router, tags=["Book"])
+    app.include_router(book.unsecure_router, tags=["Book"])
+    app.include_router(copy.router, tags=["Copy"])
+    app.include_router(checkout.router, tags=["Checkout"])
+    app.include_router(member.router, tags=["Member"])
+    app.include_router(export.router, tags=["Export"])
+    app.include_router(metrics.router, tags=["Metrics"])
+    return app
+
+
+app = create_app()
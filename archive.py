@@ -0,0 +1,79 @@
+from datetime import date
+from typing import Iterable
+
+from sqlalchemy import delete, extract, insert, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlmodel import col
+
+from models.models import Checkout, CheckoutHistory
+
+# The checkouts returned long ago are moved to `checkouts_history`, in batches of one
+# transaction each: `checkouts` (and the routes embedding the checkouts of a member or
+# of a copy) only keep the open and recent ones, the history is read on demand with
+# `include_history`.
+ARCHIVE_BATCH_SIZE = 5000
+
+
+async def create_partitions(conn: AsyncConnection, years: Iterable[int]):
+    """Creates the yearly partitions of checkouts_history (PostgreSQL) which don't
+    exist yet."""
+    for year in years:
+        await conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS checkouts_history_{year} "
+                f"PARTITION OF checkouts_history "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+        )
+
+
+async def archive_checkouts(
+    engine: AsyncEngine, returned_before: date, batch_size: int = ARCHIVE_BATCH_SIZE
+) -> int:
+    """Moves the checkouts returned before `returned_before` to checkouts_history and
+    returns their number."""
+    columns = [column.name for column in CheckoutHistory.__table__.columns]
+    # The batches follow the index of the returned checkouts (ix_checkouts_returned),
+    # each one from where the previous one stopped.
+    order = tuple_(Checkout.returned_date, Checkout.id)
+    last = None
+    archived = 0
+    while True:
+        async with engine.begin() as conn:
+            # The rows are locked until they are moved, and the ones locked by a
+            # running transaction are left for the next run.
+            query = select(Checkout.returned_date, Checkout.id).where(
+                col(Checkout.returned_date) < returned_before
+            )
+            if last is not None:
+                query = query.where(order > tuple_(*last))
+            rows = (
+                await conn.execute(
+                    query.order_by(Checkout.returned_date, Checkout.id)
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+            if not rows:
+                break
+            last = rows[-1]
+            ids = [row.id for row in rows]
+            batch = col(Checkout.id).in_(ids)
+            if conn.dialect.name == "postgresql":
+                years = await conn.scalars(
+                    select(extract("year", Checkout.checkout_date))
+                    .where(batch)
+                    .distinct()
+                )
+                await create_partitions(conn, map(int, years))
+            await conn.execute(
+                insert(CheckoutHistory).from_select(
+                    columns,
+                    select(*(getattr(Checkout, name) for name in columns)).where(batch),
+                )
+            )
+            await conn.execute(delete(Checkout).where(batch))
+        archived += len(ids)
+        if len(ids) < batch_size:
+            break
+    return archived
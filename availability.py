@@ -0,0 +1,106 @@
+from typing import Dict, List, Tuple
+
+from sqlalchemy import bindparam, case, func, or_, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models.models import Book, Copy
+
+# `Book.total_copies` and `Book.available_copies` count the copies of a book, so that
+# the availability can be read (and searched) without loading the copies. The writers of
+# the copies and checkouts change them in their transaction with a relative UPDATE,
+# which doesn't lose the changes of concurrent transactions.
+
+MISMATCH_KEYS = [
+    "book_id",
+    "total_copies",
+    "available_copies",
+    "expected_total_copies",
+    "expected_available_copies",
+]
+
+
+async def update_copy_counters(
+    session: AsyncSession, book_id: int, total: int = 0, available: int = 0
+):
+    """Adds `total` and `available` to the counters of the book."""
+    if not total and not available:
+        return
+    await session.exec(
+        update(Book)
+        .where(col(Book.id) == book_id)
+        .values(
+            total_copies=Book.total_copies + total,
+            available_copies=Book.available_copies + available,
+        )
+    )
+
+
+# Executed with a list of parameters on the connection of the session: the ORM would
+# take a list for an UPDATE by primary key, which can't add to the counters.
+ADD_TO_COPY_COUNTERS = (
+    update(Book)
+    .where(col(Book.id) == bindparam("book_id"))
+    .values(
+        total_copies=Book.total_copies + bindparam("total"),
+        available_copies=Book.available_copies + bindparam("available"),
+    )
+)
+
+
+async def update_books_copy_counters(
+    session: AsyncSession, counters: Dict[int, Tuple[int, int]]
+):
+    """Adds the (total, available) `counters` of each book id to its counters, with
+    a single executemany UPDATE."""
+    if not counters:
+        return
+    conn = await session.connection()
+    await conn.execute(
+        ADD_TO_COPY_COUNTERS,
+        [
+            {"book_id": book_id, "total": total, "available": available}
+            for book_id, (total, available) in counters.items()
+        ],
+    )
+
+
+async def reconcile_copy_counters(engine: AsyncEngine, fix: bool = False) -> List[dict]:
+    """Compares the counters of the books with their copies and returns the books
+    whose counters are wrong. With `fix`, the counters are also corrected."""
+    copies = (
+        select(
+            Copy.book_id,
+            func.count().label("total"),
+            func.sum(case((col(Copy.is_available), 1), else_=0)).label("available"),
+        )
+        .group_by(Copy.book_id)
+        .subquery()
+    )
+    total = func.coalesce(copies.c.total, 0)
+    available = func.coalesce(copies.c.available, 0)
+    query = (
+        select(Book.id, Book.total_copies, Book.available_copies, total, available)
+        .outerjoin(copies, copies.c.book_id == Book.id)
+        .where(or_(Book.total_copies != total, Book.available_copies != available))
+        .order_by(Book.id)
+    )
+    async with engine.begin() as conn:
+        mismatches = [
+            dict(zip(MISMATCH_KEYS, row)) for row in (await conn.execute(query)).all()
+        ]
+        if fix and mismatches:
+            # Counted again in the UPDATE, so that the copies changed since the check
+            # are taken into account.
+            copies_of_book = select(func.count()).where(Copy.book_id == Book.id)
+            available_copies_of_book = copies_of_book.where(col(Copy.is_available))
+            await conn.execute(
+                update(Book)
+                .where(col(Book.id).in_([row["book_id"] for row in mismatches]))
+                .values(
+                    total_copies=copies_of_book.scalar_subquery(),
+                    available_copies=available_copies_of_book.scalar_subquery(),
+                )
+            )
+    return mismatches
@@ -0,0 +1,72 @@
+"""
+Copy ids of the barcodes scanned at the circulation desk, kept in memory so that the
+scans read and update their copy by primary key.
+
+Each worker has its own cache, the routes writing the copies drop the barcodes they
+change. An entry can still be stale after a change made through another worker: the
+statements by cached id also check the barcode, and the copy is looked up again by its
+barcode (unique index of Copy.barcode) when they find nothing.
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from sqlmodel import col
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from config import get_settings
+from models.models import Copy
+
+
+class BarcodeCache:
+    """Bounded LRU of the copy id of each barcode."""
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._ids: OrderedDict[str, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, barcode: str) -> Optional[int]:
+        copy_id = self._ids.get(barcode)
+        if copy_id is not None:
+            self._ids.move_to_end(barcode)
+        return copy_id
+
+    def set(self, barcode: str, copy_id: int):
+        self._ids[barcode] = copy_id
+        self._ids.move_to_end(barcode)
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def discard(self, barcode: str):
+        self._ids.pop(barcode, None)
+
+    async def first(self, session: AsyncSession, barcode: str, statement):
+        """First row of `statement` (a select of Copy or of columns with its id, or an
+        UPDATE of copies returning their id) filtered on the copy with `barcode`, None
+        if there is none or if the statement filters it out."""
+        copy_id = self.get(barcode)
+        if copy_id is not None:
+            row = (
+                await session.exec(
+                    statement.where(col(Copy.id) == copy_id, Copy.barcode == barcode)
+                )
+            ).first()
+            if row is not None:
+                self.hits += 1
+                return row
+            # Stale, or filtered out: the barcode index tells.
+            self.discard(barcode)
+        self.misses += 1
+        row = (await session.exec(statement.where(Copy.barcode == barcode))).first()
+        if row is not None:
+            self.set(barcode, row.id)
+        return row
+
+
+@lru_cache()
+def get_barcode_cache() -> BarcodeCache:
+    """The cache shared by the routers of the copies and the checkouts."""
+    return BarcodeCache(get_settings().barcode_cache_size)
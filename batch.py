@@ -0,0 +1,62 @@
+from typing import Generic, List, Optional, Type, TypeVar
+
+from fastapi import HTTPException, Query, Response
+from pydantic import BaseModel
+from sqlmodel import Field, SQLModel, col
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from serialization import json_response, read_rows, read_select
+
+# Maximum number of ids of a lookup: the query string is limited by the length of the
+# URLs, larger sets are posted.
+LOOKUP_MAX_IDS = 1000
+LOOKUP_MAX_POSTED_IDS = 10_000
+
+ReadModel = TypeVar("ReadModel")
+
+
+class LookupIds(SQLModel):
+    ids: List[int] = Field(max_length=LOOKUP_MAX_POSTED_IDS)
+
+
+class LookupResult(BaseModel, Generic[ReadModel]):
+    """Result of a lookup by ids. `items` are in the order of the requested ids, null
+    for the ids which weren't found, also listed in `not_found`."""
+
+    items: List[Optional[ReadModel]]
+    not_found: List[int]
+
+
+def query_ids(
+    ids: str = Query(..., description="Comma separated ids", examples=["1,2,3"])
+) -> List[int]:
+    try:
+        parsed = [int(id) for id in ids.split(",") if id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid ids {ids!r}")
+    if len(parsed) > LOOKUP_MAX_IDS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {LOOKUP_MAX_IDS} ids, post them for larger sets",
+        )
+    return parsed
+
+
+async def lookup(
+    session: AsyncSession,
+    model: Type[SQLModel],
+    read_model: Type[SQLModel],
+    ids: List[int],
+) -> Response:
+    """The rows of `model` with the `ids`, read with a single IN query and encoded
+    from the row tuples (see serialization.py)."""
+    found = {}
+    if ids:
+        query = read_select(model, read_model).where(col(model.id).in_(set(ids)))
+        rows = (await session.exec(query)).all()
+        found = {row["id"]: row for row in read_rows(read_model.model_fields, rows)}
+    result = {
+        "items": [found.get(id) for id in ids],
+        "not_found": [id for id in dict.fromkeys(ids) if id not in found],
+    }
+    return json_response(result)
@@ -0,0 +1,93 @@
+"""
+Insert rate (books/sec) of a running instance of the API, one POST /book/ per book
+compared with POST /books/bulk:
+
+    python -m benchmarks.bulk_import --url http://localhost:8000 --token "$ADMIN_TOKEN"
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+
+def make_books(count: int, author_id: int):
+    # Unique isbns, so the benchmark can be run several times on the same database.
+    prefix = uuid.uuid4().hex[:8]
+    for i in range(count):
+        yield {
+            "title": f"Imported book {i}",
+            "isbn": f"{prefix}-{i:08d}",
+            "edition": "Generated",
+            "publication_date": "2000-01-01",
+            "language": "English",
+            "authors_ids": [author_id],
+        }
+
+
+async def _post_one_by_one(client: httpx.AsyncClient, queue: asyncio.Queue):
+    while True:
+        try:
+            book = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        response = await client.post("/book/", json=book)
+        response.raise_for_status()
+
+
+async def single_rows(client: httpx.AsyncClient, books, concurrency: int):
+    queue: asyncio.Queue = asyncio.Queue()
+    for book in books:
+        queue.put_nowait(book)
+    start = time.perf_counter()
+    await asyncio.gather(*(_post_one_by_one(client, queue) for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def bulk(client: httpx.AsyncClient, books, batch_size: int):
+    start = time.perf_counter()
+    for i in range(0, len(books), batch_size):
+        response = await client.post("/books/bulk", json=books[i : i + batch_size])
+        response.raise_for_status()
+        assert not response.json()["errors"], response.json()["errors"][:3]
+    return time.perf_counter() - start
+
+
+async def main(url: str, token, books: int, batch_size: int, concurrency: int):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    async with httpx.AsyncClient(base_url=url, headers=headers, timeout=300) as client:
+        response = await client.post(
+            "/author/",
+            json={
+                "first_name": "Bulk",
+                "last_name": "Import",
+                "date_of_birth": "1970-01-01",
+                "nationality": "French",
+            },
+        )
+        response.raise_for_status()
+        author_id = response.json()["id"]
+
+        elapsed = await single_rows(
+            client, list(make_books(books, author_id)), concurrency
+        )
+        print(f"POST /book/ ({concurrency} clients): {books / elapsed:10.1f} books/s")
+        elapsed = await bulk(client, list(make_books(books, author_id)), batch_size)
+        print(
+            f"POST /books/bulk ({batch_size} per call): {books / elapsed:7.1f} books/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", default=None, help="Bearer token for admin routes")
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(
+        main(args.url, args.token, args.books, args.batch_size, args.concurrency)
+    )
@@ -0,0 +1,70 @@
+"""
+Measures the throughput (requests/sec) of a running instance of the API with 1, 16 and
+128 concurrent clients.
+
+Run it once against the server before a change and once after to compare, e.g.:
+
+    python -m benchmarks.concurrency --url http://localhost:8000 --path /books/search
+    python -m benchmarks.concurrency --path /books/ --token "$ADMIN_TOKEN"
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def _client(client: httpx.AsyncClient, path: str, queue: asyncio.Queue):
+    errors = 0
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return errors
+        try:
+            response = await client.get(path)
+        except httpx.HTTPError:
+            errors += 1
+            continue
+        if response.status_code >= 400:
+            errors += 1
+
+
+async def run(url: str, path: str, concurrency: int, requests: int, token=None):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    limits = httpx.Limits(max_connections=concurrency)
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async with httpx.AsyncClient(
+        base_url=url, headers=headers, limits=limits, timeout=10
+    ) as client:
+        start = time.perf_counter()
+        errors = await asyncio.gather(
+            *(_client(client, path, queue) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+    return requests / elapsed, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/books/search")
+    parser.add_argument("--token", default=None, help="Bearer token for admin routes")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 128])
+    args = parser.parse_args()
+
+    print(f"GET {args.url}{args.path} ({args.requests} requests per level)")
+    for concurrency in args.concurrency:
+        rps, errors = asyncio.run(
+            run(args.url, args.path, concurrency, args.requests, args.token)
+        )
+        print(f"{concurrency:>4} clients: {rps:10.1f} req/s ({errors} errors)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Fills the database configured in the environment with a synthetic library, to see how
+the API behaves at scale (see benchmarks/suite.py). The data only depends on the
+volumes and on the seed, e.g.:
+
+    python -m benchmarks.generate --reset
+    python -m benchmarks.generate --reset --scale 0.01
+
+The popularity of the books and the activity of the members and of the authors follow
+log-normal distributions: most books have a few copies and are rarely borrowed, a few
+have hundreds of copies and most of the checkouts. Most of the checkouts are returned,
+the open ones are recent and about half of them are overdue. The rows are loaded with
+COPY on PostgreSQL.
+"""
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import operator
+import random
+from array import array
+from datetime import date, timedelta
+
+from sqlalchemy import func, insert, inspect, select, text
+from sqlalchemy.schema import AddConstraint
+
+from db import delete_db_and_tables, engine, run_migrations
+from models.models import (
+    Author,
+    AuthorBookLink,
+    Book,
+    Checkout,
+    Copy,
+    Member,
+    normalize_search_text,
+)
+
+VOLUMES = {
+    "authors": 100_000,
+    "books": 1_000_000,
+    "copies": 5_000_000,
+    "members": 100_000,
+    "checkouts": 20_000_000,
+}
+BATCH_SIZE = 50_000
+# Share of the copies currently borrowed, and duration of a loan.
+OPEN_RATIO = 0.03
+LOAN_DAYS = 21
+HISTORY_DAYS = 5 * 365
+
+SYLLABLES = ["ba", "ché", "di", "fo", "gu", "la", "mé", "ni", "or", "pa", "ro", "sè"]
+FIRST_NAMES = ["Émile", "George", "Aldous", "Jane", "Victor", "Agatha", "Leïla", "Ray"]
+NATIONALITIES = [("French", 4), ("English", 4), ("American", 3), ("German", 1)]
+LANGUAGES = [("French", 5), ("English", 4), ("German", 1), ("Spanish", 1)]
+EDITIONS = ["Gallimard", "Penguin", "Folio", "Pocket", "First edition"]
+CITIES = ["Paris", "Lyon", "Marseille", "Lille", "Nantes", "Bordeaux"]
+# Number of authors of a book.
+AUTHORS_PER_BOOK = [(1, 80), (2, 15), (3, 5)]
+
+
+def rng_of(seed: int, name: str) -> random.Random:
+    # One generator per table, so that the volume of a table doesn't change the rows
+    # of the others.
+    return random.Random(f"{seed}:{name}")
+
+
+def vocabulary(seed: int, size: int = 5000):
+    """Words of the titles and of the last names, also searched by the suite."""
+    rng = rng_of(seed, "vocabulary")
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize())
+    return sorted(words)
+
+
+def _choices(rng: random.Random, values_weights):
+    values, weights = zip(*values_weights)
+    return lambda: rng.choices(values, weights)[0]
+
+
+class Library:
+    """The generated rows, as tuples in the order of the columns of `TABLES`."""
+
+    def __init__(self, volumes: dict, seed: int, today: date):
+        self.volumes = volumes
+        self.seed = seed
+        self.today = today
+        self.words = vocabulary(seed)
+        # Filled by authors() and used by books().
+        self.authors_names = []
+        self.authors_birth = array("H")
+        self._plan_copies()
+
+    def _plan_copies(self):
+        # The copies of a book have consecutive ids, from first_copy[book - 1] to
+        # first_copy[book] - 1, so a copy of a book is drawn without a list of them.
+        rng = rng_of(self.seed, "copies")
+        books = self.volumes["books"]
+        popularity = [rng.lognormvariate(0, 1.0) for _ in range(books)]
+        cum_popularity = list(itertools.accumulate(popularity))
+        self.copies_count = array("I", bytes(4 * books))
+        for start in range(0, self.volumes["copies"], BATCH_SIZE):
+            size = min(BATCH_SIZE, self.volumes["copies"] - start)
+            for book in rng.choices(range(books), cum_weights=cum_popularity, k=size):
+                self.copies_count[book] += 1
+        self.first_copy = array("I", itertools.accumulate(self.copies_count, initial=1))
+        # The copies of the popular books are borrowed more often.
+        self.demand = list(
+            itertools.accumulate(map(operator.mul, popularity, self.copies_count))
+        )
+
+        rng = rng_of(self.seed, "open checkouts")
+        open_count = min(
+            int(self.volumes["copies"] * OPEN_RATIO), self.volumes["checkouts"]
+        )
+        self.open_copies = set()
+        while len(self.open_copies) < open_count:
+            self.open_copies.add(self.random_copy(rng))
+        self.borrowed_by_book = array("I", bytes(4 * books))
+        for copy_id in self.open_copies:
+            self.borrowed_by_book[self.book_of(copy_id) - 1] += 1
+
+    def random_copy(self, rng: random.Random) -> int:
+        # The books without copies have no demand.
+        book = rng.choices(range(len(self.demand)), cum_weights=self.demand)[0]
+        return self.first_copy[book] + rng.randrange(self.copies_count[book])
+
+    def book_of(self, copy_id: int) -> int:
+        return bisect.bisect_right(self.first_copy, copy_id)
+
+    def authors(self):
+        rng = rng_of(self.seed, "authors")
+        nationality = _choices(rng, NATIONALITIES)
+        for author_id in range(1, self.volumes["authors"] + 1):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(self.words)
+            birth = date(1800, 1, 1) + timedelta(days=rng.randrange(70_000))
+            death = None
+            if birth.year < 1940 or rng.random() < 0.1:
+                death = birth + timedelta(days=rng.randint(30, 95) * 365)
+                death = death if death < self.today else None
+            self.authors_names.append(f"{first_name} {last_name}")
+            self.authors_birth.append(birth.year)
+            yield (author_id, first_name, last_name, birth, death, nationality())
+
+    def books(self):
+        """The books and the links to their authors."""
+        rng = rng_of(self.seed, "books")
+        prolific = list(
+            itertools.accumulate(
+                rng.lognormvariate(0, 1.5) for _ in range(self.volumes["authors"])
+            )
+        )
+        authors_count = _choices(rng, AUTHORS_PER_BOOK)
+        language = _choices(rng, LANGUAGES)
+        # A few words appear in many titles.
+        weights = list(
+            itertools.accumulate(1 / rank for rank in range(1, len(self.words) + 1))
+        )
+        for index in range(self.volumes["books"]):
+            book_id = index + 1
+            title = " ".join(
+                rng.choices(self.words, cum_weights=weights, k=rng.randint(1, 5))
+            )
+            authors_ids = set(
+                rng.choices(
+                    range(1, self.volumes["authors"] + 1),
+                    cum_weights=prolific,
+                    k=authors_count(),
+                )
+            )
+            names = [self.authors_names[i - 1] for i in sorted(authors_ids)]
+            year = min(
+                self.authors_birth[min(authors_ids) - 1] + rng.randint(20, 70),
+                self.today.year,
+            )
+            total = self.copies_count[index]
+            book = (
+                book_id,
+                title,
+                f"978{book_id:010d}",
+                rng.choice(EDITIONS),
+                min(date(year, 1, 1) + timedelta(days=rng.randrange(365)), self.today),
+                language(),
+                normalize_search_text(" ".join([title, *names])),
+                total,
+                total - self.borrowed_by_book[index],
+            )
+            yield book, [(book_id, author_id) for author_id in sorted(authors_ids)]
+
+    def members(self):
+        rng = rng_of(self.seed, "members")
+        for member_id in range(1, self.volumes["members"] + 1):
+            age = rng.randint(6, 90)
+            birthdate = date(self.today.year - age, 1, 1) - timedelta(
+                days=rng.randrange(365)
+            )
+            yield (
+                member_id,
+                f"auth0|generated{member_id:08d}",
+                rng.choice(FIRST_NAMES),
+                rng.choice(self.words),
+                age,
+                birthdate,
+                rng.choice(CITIES),
+                self.today + timedelta(days=rng.randint(-365, 2 * 365)),
+            )
+
+    def copies(self):
+        rng = rng_of(self.seed, "shelves")
+        for copy_id in range(1, self.volumes["copies"] + 1):
+            yield (
+                copy_id,
+                f"BC{copy_id:012d}",
+                f"Shelf {rng.randint(1, 500)}",
+                copy_id not in self.open_copies,
+                self.book_of(copy_id),
+            )
+
+    def checkouts(self):
+        """The returned checkouts, in chronological order, then the open ones."""
+        rng = rng_of(self.seed, "checkouts")
+        active = list(
+            itertools.accumulate(
+                rng.lognormvariate(0, 1.0) for _ in range(self.volumes["members"])
+            )
+        )
+        members = range(1, self.volumes["members"] + 1)
+        history = self.volumes["checkouts"] - len(self.open_copies)
+        start = self.today - timedelta(days=HISTORY_DAYS)
+        for index in range(history):
+            checkout_date = start + timedelta(days=index * HISTORY_DAYS // history)
+            returned_date = min(
+                checkout_date + timedelta(days=rng.randint(1, LOAN_DAYS + 14)),
+                self.today,
+            )
+            yield (
+                index + 1,
+                checkout_date,
+                checkout_date + timedelta(days=LOAN_DAYS),
+                rng.choices(members, cum_weights=active)[0],
+                self.random_copy(rng),
+                returned_date,
+            )
+        for index, copy_id in enumerate(sorted(self.open_copies), history + 1):
+            # Borrowed in the last 6 weeks: those older than LOAN_DAYS are overdue.
+            checkout_date = self.today - timedelta(days=rng.randint(0, 2 * LOAN_DAYS))
+            yield (
+                index,
+                checkout_date,
+                checkout_date + timedelta(days=LOAN_DAYS),
+                rng.choices(members, cum_weights=active)[0],
+                copy_id,
+                None,
+            )
+
+
+TABLES = {
+    "authors": (
+        Author,
+        ["id", "first_name", "last_name", "date_of_birth", "date_of_death"]
+        + ["nationality"],
+    ),
+    "books": (
+        Book,
+        ["id", "title", "isbn", "edition", "publication_date", "language"]
+        + ["search_text", "total_copies", "available_copies"],
+    ),
+    "authorbooklink": (AuthorBookLink, ["book_id", "author_id"]),
+    "members": (
+        Member,
+        ["id", "auth0_id", "first_name", "last_name", "age", "birthdate", "city"]
+        + ["membership_expiration"],
+    ),
+    "copies": (Copy, ["id", "barcode", "location", "is_available", "book_id"]),
+    "checkouts": (
+        Checkout,
+        ["id", "checkout_date", "expected_return_date", "member_id", "copy_id"]
+        + ["returned_date"],
+    ),
+}
+
+
+async def load(conn, name: str, rows):
+    model, columns = TABLES[name]
+    if conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            name, records=rows, columns=columns
+        )
+    else:
+        await conn.execute(insert(model), [dict(zip(columns, row)) for row in rows])
+
+
+async def load_all(engine, name: str, rows, total: int):
+    count = 0
+    for batch in iter(lambda: list(itertools.islice(rows, BATCH_SIZE)), []):
+        async with engine.begin() as conn:
+            await load(conn, name, batch)
+        count += len(batch)
+        print(f"\r{name}: {count}/{total}", end="", flush=True)
+    print()
+
+
+def _drop_foreign_keys(conn):
+    inspector = inspect(conn)
+    for name in TABLES:
+        for fk in inspector.get_foreign_keys(name):
+            constraint = fk["name"]
+            conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+
+
+def _books_and_links(library: Library, links: list):
+    for book, book_links in library.books():
+        links.extend(book_links)
+        yield book
+
+
+async def generate(engine, volumes: dict, seed: int, today: date):
+    """Inserts the library of `volumes` and `seed` in the empty tables of `engine`."""
+    library = Library(volumes, seed, today)
+    # Building the indexes once the rows are loaded is much faster than updating them
+    # for every row, the unique ones are kept to check the rows. Likewise, the foreign
+    # keys of PostgreSQL would lock the referenced row of every inserted row.
+    tables = [model.__table__ for model, _ in TABLES.values()]
+    indexes = [index for table in tables for index in table.indexes if not index.unique]
+    foreign_keys = [fk for table in tables for fk in table.foreign_key_constraints]
+    async with engine.begin() as conn:
+        for index in indexes:
+            await conn.run_sync(index.drop, checkfirst=True)
+        if conn.dialect.name == "postgresql":
+            await conn.run_sync(_drop_foreign_keys)
+
+    await load_all(engine, "authors", library.authors(), volumes["authors"])
+    # The links are inserted after their books, they are a bit more than the books.
+    links = []
+    books = _books_and_links(library, links)
+    await load_all(engine, "books", books, volumes["books"])
+    await load_all(engine, "authorbooklink", iter(links), len(links))
+    await load_all(engine, "members", library.members(), volumes["members"])
+    await load_all(engine, "copies", library.copies(), volumes["copies"])
+    await load_all(engine, "checkouts", library.checkouts(), volumes["checkouts"])
+
+    async with engine.begin() as conn:
+        for index in indexes:
+            print(f"Creating {index.name}.")
+            await conn.run_sync(index.create, checkfirst=True)
+        if conn.dialect.name == "postgresql":
+            print("Checking the foreign keys.")
+            for fk in foreign_keys:
+                await conn.execute(AddConstraint(fk))
+            # The ids were given, the next ones have to come after them.
+            for name in ["authors", "books", "members", "copies", "checkouts"]:
+                await conn.execute(
+                    text(
+                        f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                        f"(SELECT coalesce(max(id), 0) + 1 FROM {name}), false)"
+                    )
+                )
+        await conn.execute(text("ANALYZE"))
+
+
+async def main(volumes: dict, seed: int, reset: bool):
+    engine.echo = False
+    if reset:
+        await delete_db_and_tables(engine)
+    await run_migrations(engine)
+    async with engine.connect() as conn:
+        if (await conn.execute(select(func.count()).select_from(Book))).scalar():
+            raise SystemExit("The database isn't empty, use --reset to replace it.")
+    await generate(engine, volumes, seed, date.today())
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    for name, volume in VOLUMES.items():
+        parser.add_argument(f"--{name}", type=int, default=volume)
+    parser.add_argument(
+        "--scale", type=float, default=1, help="Multiplies all the volumes"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--reset", action="store_true", help="Delete all the tables and data first"
+    )
+    args = parser.parse_args()
+    volumes = {name: max(1, int(getattr(args, name) * args.scale)) for name in VOLUMES}
+    asyncio.run(main(volumes, args.seed, args.reset))
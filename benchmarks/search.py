@@ -0,0 +1,105 @@
+"""
+Latency of the book search on a generated catalogue (1M books by default), using the
+database configured in the environment. The books are only generated once.
+
+    python -m benchmarks.search --books 1000000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func, insert
+from sqlmodel import select
+
+from db import create_db_and_tables, engine
+from models.models import Book, normalize_search_text
+from search import search_books_query
+
+SYLLABLES = ["ba", "ché", "di", "fo", "gu", "la", "mé", "ni", "or", "pa", "ro", "sè"]
+FIRST_NAMES = ["Émile", "George", "Aldous", "Jane", "Victor", "Agatha", "Leïla", "Ray"]
+BATCH_SIZE = 10_000
+
+
+def make_vocabulary(rng: random.Random, size: int = 5000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize())
+    return sorted(words)
+
+
+def make_books(rng: random.Random, vocabulary, start: int, count: int):
+    # Zipf-like distribution: a few words appear in many titles.
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    for i in range(start, start + count):
+        title = " ".join(rng.choices(vocabulary, weights, k=rng.randint(1, 5)))
+        author = f"{rng.choice(FIRST_NAMES)} {rng.choice(vocabulary)}"
+        yield {
+            "title": title,
+            "isbn": f"{i:013d}",
+            "edition": "Generated",
+            "publication_date": date(1900, 1, 1) + timedelta(days=rng.randrange(45000)),
+            "language": rng.choice(["English", "French", "German"]),
+            "search_text": normalize_search_text(f"{title} {author}"),
+        }
+
+
+async def generate(books: int, rng: random.Random, vocabulary):
+    await create_db_and_tables(engine)
+    async with engine.begin() as conn:
+        existing = (await conn.execute(select(func.count()).select_from(Book))).one()[0]
+    for start in range(existing, books, BATCH_SIZE):
+        rows = list(make_books(rng, vocabulary, start, min(BATCH_SIZE, books - start)))
+        async with engine.begin() as conn:
+            await conn.execute(insert(Book), rows)
+        print(f"\r{start + len(rows)} books", end="", flush=True)
+    print()
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("ANALYZE books")
+
+
+async def measure(words: str, repeat: int):
+    query = search_books_query(select(Book.id), engine.dialect.name, words).limit(20)
+    latencies = []
+    async with engine.connect() as conn:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = (await conn.execute(query)).all()
+            latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies), max(latencies), len(rows)
+
+
+async def main(books: int, repeat: int, seed: int):
+    engine.echo = False
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    await generate(books, rng, vocabulary)
+
+    common, rare = vocabulary[0], vocabulary[-1]
+    queries = {
+        "common word": common,
+        "rare word": rare,
+        "two words": f"{common} {rare}",
+        "prefix": rare[:3],
+        "author": FIRST_NAMES[0],
+        "typo": rare[:-1] + "x",
+    }
+    for label, words in queries.items():
+        median, worst, results = await measure(words, repeat)
+        print(
+            f"{label:>12} {words!r:<24} median {median * 1000:7.2f} ms"
+            f"  max {worst * 1000:7.2f} ms  ({results} results)"
+        )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(main(args.books, args.repeat, args.seed))
@@ -0,0 +1,132 @@
+"""
+Cost of the JSON encoding of the list routes, per 10k records, without a database: the
+ORM objects validated and encoded the way FastAPI does with a `response_model`, with
+the standard JSONResponse and with ORJSONResponse, then the row tuples encoded by
+serialization.py.
+
+    python -m benchmarks.serialization --records 10000 --repeat 20
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models.models import Book, BookRead, Checkout, CheckoutRead
+from serialization import json_response, read_rows, read_select
+
+UPDATED_AT = datetime(2024, 6, 1, 12, 30)
+
+
+def make_books(rng: random.Random, count: int):
+    return [
+        Book(
+            id=i,
+            title=f"Book {rng.randrange(10**6)}",
+            isbn=f"{i:013d}",
+            edition="Generated",
+            publication_date=date(1900, 1, 1) + timedelta(days=rng.randrange(45000)),
+            language=rng.choice(["English", "French", "German"]),
+            total_copies=rng.randint(1, 10),
+            available_copies=rng.randint(0, 1),
+            updated_at=UPDATED_AT,
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def make_checkouts(rng: random.Random, count: int):
+    checkouts = []
+    for i in range(1, count + 1):
+        checkout_date = date(2020, 1, 1) + timedelta(days=rng.randrange(1500))
+        checkouts.append(
+            Checkout(
+                id=i,
+                copy_id=rng.randint(1, 10**6),
+                member_id=rng.randint(1, 10**5),
+                checkout_date=checkout_date,
+                expected_return_date=checkout_date + timedelta(days=21),
+                returned_date=checkout_date + timedelta(days=rng.randrange(30)),
+                updated_at=UPDATED_AT,
+            )
+        )
+    return checkouts
+
+
+def as_rows(objects, model, read_model):
+    # The tuples the database returns for read_select(model, read_model).
+    names = [column.key for column in read_select(model, read_model).selected_columns]
+    return [tuple(getattr(obj, name) for name in names) for obj in objects]
+
+
+def fastapi_response(response_class, read_model):
+    field = create_response_field(name="Response", type_=List[read_model])
+
+    def encode(objects):
+        content = asyncio.run(serialize_response(field=field, response_content=objects))
+        return response_class(content).body
+
+    return encode
+
+
+def measure(encode, records, repeat: int):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(records)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), min(durations)
+
+
+def main(records: int, repeat: int, seed: int):
+    rng = random.Random(seed)
+    for model, read_model, objects in [
+        (Book, BookRead, make_books(rng, records)),
+        (Checkout, CheckoutRead, make_checkouts(rng, records)),
+    ]:
+        rows = as_rows(objects, model, read_model)
+        print(f"{read_model.__name__}, {records} records:")
+        for name, encode, data in [
+            (
+                "response_model + JSONResponse",
+                fastapi_response(JSONResponse, read_model),
+                objects,
+            ),
+            (
+                "response_model + ORJSONResponse",
+                fastapi_response(ORJSONResponse, read_model),
+                objects,
+            ),
+            (
+                "row tuples + json_response",
+                lambda rows: json_response(
+                    read_rows(read_model.model_fields, rows)
+                ).body,
+                rows,
+            ),
+        ]:
+            median, best = measure(encode, data, repeat)
+            per_10k = 10_000 / records
+            print(
+                f"  {name:>32}  {median * per_10k * 1000:8.2f} ms / 10k"
+                f"  (best {best * per_10k * 1000:.2f} ms)"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--records", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    main(args.records, args.repeat, args.seed)
@@ -0,0 +1,59 @@
+"""
+Measures the cold start of the API: the time between launching uvicorn (which imports
+`app.py` and runs the lifespan hooks) and the first successful response.
+
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def first_request_latency(port: int, path: str, timeout: float) -> float:
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}{path}").status_code < 500:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            if server.poll() is not None:
+                raise RuntimeError("The server exited before answering")
+            time.sleep(0.01)
+        raise TimeoutError(f"No response after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default="/openapi.json")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    latencies = [
+        first_request_latency(args.port, args.path, args.timeout)
+        for _ in range(args.runs)
+    ]
+    print(
+        f"import to first request: median {statistics.median(latencies) * 1000:.0f} ms"
+        f", min {min(latencies) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
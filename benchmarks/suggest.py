@@ -0,0 +1,62 @@
+"""
+Loading time and memory of the suggestion index (see suggest.py) on the database
+configured in the environment, e.g. the one of `benchmarks.generate`, then latency of
+the suggestions for prefixes of random titles and author names.
+
+    python -m benchmarks.suggest --lookups 10000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+
+from db import engine
+from suggest import SuggestIndex
+
+
+def percentile(durations, fraction: float) -> float:
+    return sorted(durations)[int(fraction * (len(durations) - 1))]
+
+
+async def main(lookups: int, limit: int, seed: int):
+    index = SuggestIndex()
+    tracemalloc.start()
+    start = time.perf_counter()
+    await index.load(engine)
+    duration = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await engine.dispose()
+    print(
+        f"Loaded {len(index._texts)} books and authors ({len(index._keys)} keys)"
+        f" in {duration:.2f} s, {memory / 2**20:.0f} MiB"
+    )
+
+    rng = random.Random(seed)
+    texts = rng.choices(list(index._texts.values()), k=lookups)
+    durations = []
+    for text in texts:
+        prefix = text[: rng.randint(1, max(1, len(text)))]
+        start = time.perf_counter()
+        index.suggest(prefix, limit)
+        durations.append(time.perf_counter() - start)
+    print(
+        f"{lookups} suggestions: median {statistics.median(durations) * 1e6:.1f} µs,"
+        f" p99 {percentile(durations, 0.99) * 1e6:.1f} µs,"
+        f" max {max(durations) * 1e6:.1f} µs"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.lookups, args.limit, args.seed))
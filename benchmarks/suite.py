@@ -0,0 +1,192 @@
+"""
+Latency (p50/p95/p99) and throughput of the read routes of every router, on a running
+instance of the API filled by benchmarks/generate.py. The requests only depend on the
+seed and on the volumes, and the results are written to a JSON file to compare two
+commits:
+
+    python -m benchmarks.suite --token "$ADMIN_TOKEN" --output before.json
+    python -m benchmarks.suite --token "$ADMIN_TOKEN" --output after.json \\
+        --compare before.json
+
+Use the volumes (or --scale) given to the generator, and restart the server before each
+run: the response cache (cache.py) would otherwise answer the requests of the previous
+one.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.generate import VOLUMES, rng_of, vocabulary
+
+# Routes and their parameters, drawn for every request. The ids are those of the
+# generated rows.
+SCENARIOS = {
+    "authors list": "/authors/?after={author}",
+    "author": "/author/{author}",
+    "books list": "/books/?after={book}",
+    "book": "/book/{book}",
+    "books search": "/books/search?q={word}",
+    "books search filters": "/books/search?publication_year={year}&available=true",
+    "copies list": "/copies/?after={copy}",
+    "copy": "/copy/{copy}",
+    "members list": "/members/?after={member}",
+    "member": "/member/{member}",
+    "checkouts list": "/checkouts/?after={checkout}",
+    "checkout": "/checkout/{checkout}",
+    "overdue checkouts": "/checkouts/overdue?after={checkout}&limit=20",
+    "overdue members": "/checkouts/overdue/members?after={member}&limit=20",
+    "incremental export": "/export/checkouts?format=ndjson&updated_since={now}",
+    "db metrics": "/metrics/db",
+}
+
+
+def make_paths(template: str, volumes: dict, rng: random.Random, words, count: int):
+    now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    for _ in range(count):
+        yield template.format(
+            author=rng.randint(1, volumes["authors"]),
+            book=rng.randint(1, volumes["books"]),
+            copy=rng.randint(1, volumes["copies"]),
+            member=rng.randint(1, volumes["members"]),
+            checkout=rng.randint(1, volumes["checkouts"]),
+            word=rng.choice(words[:500]),
+            year=rng.randint(1900, 2020),
+            now=now,
+        )
+
+
+async def _client(client: httpx.AsyncClient, paths, latencies: list, errors: list):
+    for path in paths:
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            await response.aread()
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        if failed:
+            errors.append(path)
+        else:
+            latencies.append(time.perf_counter() - start)
+
+
+async def run_scenario(client: httpx.AsyncClient, paths, concurrency: int) -> dict:
+    # The clients share the iterator, each takes the next path when it's done.
+    paths = iter(paths)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(_client(client, paths, latencies, errors) for _ in range(concurrency))
+    )
+    elapsed = time.perf_counter() - start
+    result = {"requests": len(latencies) + len(errors), "errors": len(errors)}
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        result.update(
+            throughput_rps=round(len(latencies) / elapsed, 1),
+            p50_ms=round(percentiles[49] * 1000, 2),
+            p95_ms=round(percentiles[94] * 1000, 2),
+            p99_ms=round(percentiles[98] * 1000, 2),
+            max_ms=round(max(latencies) * 1000, 2),
+        )
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\nCompared with {baseline['commit']} ({baseline['date']}):")
+    for name, result in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before or "p50_ms" not in before or "p50_ms" not in result:
+            continue
+        changes = "  ".join(
+            f"{key} {100 * (result[key] / before[key] - 1):+6.1f}%"
+            for key in ["p50_ms", "p99_ms", "throughput_rps"]
+            if before[key]
+        )
+        print(f"{name:>22}  {changes}")
+
+
+async def main(args, volumes: dict):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    words = vocabulary(args.seed)
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "url": args.url,
+        "python": platform.python_version(),
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "volumes": volumes,
+        "seed": args.seed,
+        "scenarios": {},
+    }
+    async with httpx.AsyncClient(
+        base_url=args.url, headers=headers, limits=limits, timeout=60
+    ) as client:
+        for name, template in SCENARIOS.items():
+            if args.only and name not in args.only:
+                continue
+            rng = rng_of(args.seed, name)
+            warmup = make_paths(template, volumes, rng, words, args.warmup)
+            await run_scenario(client, warmup, args.concurrency)
+            paths = make_paths(template, volumes, rng, words, args.requests)
+            result = await run_scenario(client, paths, args.concurrency)
+            results["scenarios"][name] = result
+            print(
+                f"{name:>22}  p50 {result.get('p50_ms', 0):8.2f} ms"
+                f"  p95 {result.get('p95_ms', 0):8.2f} ms"
+                f"  p99 {result.get('p99_ms', 0):8.2f} ms"
+                f"  {result.get('throughput_rps', 0):8.1f} req/s"
+                f"  ({result['errors']} errors)"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", default=None, help="Bearer token for admin routes")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="Per scenario")
+    parser.add_argument("--warmup", type=int, default=100, help="Per scenario")
+    parser.add_argument("--only", nargs="+", choices=list(SCENARIOS))
+    for name, volume in VOLUMES.items():
+        parser.add_argument(f"--{name}", type=int, default=volume)
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON file of the results")
+    parser.add_argument("--compare", help="JSON file of the results of another run")
+    args = parser.parse_args()
+    volumes = {name: max(1, int(getattr(args, name) * args.scale)) for name in VOLUMES}
+
+    results = asyncio.run(main(args, volumes))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
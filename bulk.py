@@ -0,0 +1,62 @@
+import json
+from typing import Any, Dict, List, Tuple, Type
+
+from fastapi import Body
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Maximum number of records of a bulk import request.
+BULK_MAX_ROWS = 10_000
+
+# Body of the bulk routes: the records are validated one by one, so that an invalid
+# record is reported instead of rejecting the whole request.
+BulkRows = Body(..., max_length=BULK_MAX_ROWS)
+
+
+class BulkCreated(SQLModel):
+    index: int
+    id: int
+
+
+class BulkError(SQLModel):
+    index: int
+    detail: Any
+
+
+class BulkResult(SQLModel):
+    """Result of a bulk import. `index` is the position of the record in the request."""
+
+    created: List[BulkCreated] = []
+    errors: List[BulkError] = []
+
+
+def validate_rows(
+    rows: List[Dict[str, Any]], create_model: Type[SQLModel], result: BulkResult
+) -> List[Tuple[int, SQLModel]]:
+    """Returns the valid records with their index, the others are added to the
+    errors of `result`."""
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, create_model.model_validate(row)))
+        except ValidationError as e:
+            detail = json.loads(e.json(include_url=False))
+            result.errors.append(BulkError(index=index, detail=detail))
+    return valid
+
+
+async def insert_rows(
+    session: AsyncSession, model: Type[SQLModel], rows: List[Dict[str, Any]]
+) -> List[int]:
+    """Inserts `rows` with a few multi-row INSERTs and returns their ids, in order."""
+    if not rows:
+        return []
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+    return list((await session.exec(statement, params=rows)).scalars())
+
+
+def add_created(result: BulkResult, indexes: List[int], ids: List[int]):
+    result.created.extend(BulkCreated(index=i, id=id) for i, id in zip(indexes, ids))
+    result.errors.sort(key=lambda error: error.index)
@@ -0,0 +1,159 @@
+import json
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from fastapi import Response
+from sqlmodel import SQLModel, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from config import get_settings
+from models.models import AuthorBookLink
+
+
+class MemoryBackend:
+    """In-process LRU whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[float, bytes]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    """Entries stored in Redis, shared by all the workers. `client` is a
+    `redis.asyncio.Redis` or any object with the same async methods."""
+
+    def __init__(self, client, ttl: float = 300, prefix: str = "library:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes):
+        await self.client.set(self.prefix + key, value, ex=int(self.ttl))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def clear(self):
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + "*")]
+        if keys:
+            await self.client.delete(*keys)
+
+
+class ResponseCache:
+    """Read-through cache of the JSON responses of the detail routes.
+
+    The responses are stored serialized with their headers (ETag, see etag.py), so a
+    hit costs neither a query nor the validation of the nested models. The writers
+    delete the keys of the entities they change (see `book_key` and `author_key`) once
+    their transaction is committed.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Response]:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        headers, body = value.split(b"\n", 1)
+        return Response(
+            body, headers=json.loads(headers), media_type="application/json"
+        )
+
+    async def set(
+        self,
+        key: str,
+        content: Union[SQLModel, bytes],
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """Caches the model, or the JSON already encoded, and returns its response."""
+        body = content
+        if isinstance(content, SQLModel):
+            body = content.model_dump_json().encode()
+        await self.backend.set(key, json.dumps(headers or {}).encode() + b"\n" + body)
+        return Response(body, headers=headers, media_type="application/json")
+
+    async def invalidate(self, keys: Iterable[str]):
+        await self.backend.delete(*set(keys))
+
+    async def clear(self):
+        await self.backend.clear()
+        self.hits = self.misses = 0
+
+    def metrics(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / requests, 3) if requests else None,
+        }
+
+
+def book_key(book_id: int) -> str:
+    return f"book:{book_id}"
+
+
+def author_key(author_id: int) -> str:
+    return f"author:{author_id}"
+
+
+async def books_keys(session: AsyncSession, books_ids: Iterable[int]) -> List[str]:
+    """Keys of the books and of their authors, whose responses list the books with
+    their copy counters."""
+    books_ids = set(books_ids)
+    authors_ids = (
+        await session.exec(
+            select(AuthorBookLink.author_id)
+            .where(col(AuthorBookLink.book_id).in_(books_ids))
+            .distinct()
+        )
+    ).all()
+    return [*map(book_key, books_ids), *map(author_key, authors_ids)]
+
+
+@lru_cache()
+def get_cache() -> ResponseCache:
+    """The cache shared by every router. Redis is used if CACHE_URL is set."""
+    settings = get_settings()
+    if settings.cache_url:
+        import redis.asyncio as redis
+
+        client = redis.from_url(settings.cache_url)
+        return ResponseCache(RedisBackend(client, settings.cache_ttl))
+    return ResponseCache(MemoryBackend(settings.cache_size, settings.cache_ttl))
@@ -0,0 +1,169 @@
+"""
+Administration commands of the library API, e.g.:
+
+    python cli.py seed --reset
+    python cli.py migrate
+    python cli.py token
+    python cli.py export books --format csv --updated-since 2024-01-01 > books.csv.gz
+    python cli.py reconcile --fix
+    python cli.py overdue --members > overdue_members.ndjson
+    python cli.py archive --after-days 365
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import date, datetime, timedelta
+
+from archive import ARCHIVE_BATCH_SIZE, archive_checkouts
+from availability import reconcile_copy_counters
+from config import get_settings
+from db import delete_db_and_tables, engine, run_migrations
+from export import EXPORTS, export_gzip
+from overdue import scan_overdue
+from setup import (
+    create_authors_and_books,
+    create_checkouts,
+    create_copies,
+    create_members,
+)
+from utils import get_token
+
+
+async def seed(reset: bool):
+    if reset:
+        print("Deleting tables.")
+        await delete_db_and_tables(engine)
+    print("Creating the tables.")
+    await run_migrations(engine)
+    print("Inserting basic values.")
+    async with engine.begin() as conn:
+        await conn.run_sync(create_authors_and_books)
+        await conn.run_sync(create_members)
+        await conn.run_sync(create_copies)
+        await conn.run_sync(create_checkouts)
+    await engine.dispose()
+
+
+async def migrate(revision: str):
+    await run_migrations(engine, revision)
+    await engine.dispose()
+
+
+async def export(name: str, format: str, updated_since, output):
+    engine.echo = False
+    async for chunk in export_gzip(engine, name, format, updated_since):
+        output.write(chunk)
+    await engine.dispose()
+
+
+async def reconcile(fix: bool):
+    engine.echo = False
+    mismatches = await reconcile_copy_counters(engine, fix)
+    for mismatch in mismatches:
+        print(mismatch)
+    action = "fixed" if fix else "found"
+    print(f"{len(mismatches)} books with wrong copy counters {action}.")
+    await engine.dispose()
+    return mismatches
+
+
+async def overdue(members: bool, output):
+    engine.echo = False
+    async for lines in scan_overdue(engine, date.today(), members):
+        output.write("".join(line + "\n" for line in lines))
+    await engine.dispose()
+
+
+async def archive(after_days: int, batch_size: int):
+    engine.echo = False
+    returned_before = date.today() - timedelta(days=after_days)
+    archived = await archive_checkouts(engine, returned_before, batch_size)
+    print(f"{archived} checkouts returned before {returned_before} archived.")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shadow library API administration")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="Insert the test values")
+    seed_parser.add_argument(
+        "--reset", action="store_true", help="Delete all the tables and data first"
+    )
+    migrate_parser = commands.add_parser(
+        "migrate", help="Apply the migrations of the schema"
+    )
+    migrate_parser.add_argument(
+        "revision", nargs="?", default="head", help="Target revision, head by default"
+    )
+    commands.add_parser("token", help="Print an admin access token from Auth0")
+    export_parser = commands.add_parser(
+        "export", help="Export a table, gzip compressed"
+    )
+    export_parser.add_argument("name", choices=list(EXPORTS))
+    export_parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    export_parser.add_argument(
+        "--updated-since",
+        type=datetime.fromisoformat,
+        help="Only the rows created or updated since this date",
+    )
+    export_parser.add_argument(
+        "-o", "--output", help="Output file, the standard output by default"
+    )
+
+    reconcile_parser = commands.add_parser(
+        "reconcile", help="Check the copy counters of the books against the copies"
+    )
+    reconcile_parser.add_argument(
+        "--fix", action="store_true", help="Correct the wrong counters"
+    )
+
+    overdue_parser = commands.add_parser(
+        "overdue",
+        help="Print the overdue checkouts as JSON lines, e.g. from a cron job",
+    )
+    overdue_parser.add_argument(
+        "--members", action="store_true", help="One summary per member instead"
+    )
+
+    archive_parser = commands.add_parser(
+        "archive",
+        help="Move the long returned checkouts to the history, e.g. from a cron job",
+    )
+    archive_parser.add_argument(
+        "--after-days",
+        type=int,
+        default=get_settings().archive_after_days,
+        help="Days since their return, ARCHIVE_AFTER_DAYS (365) by default",
+    )
+    archive_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=ARCHIVE_BATCH_SIZE,
+        help="Checkouts moved per transaction",
+    )
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        asyncio.run(seed(args.reset))
+    elif args.command == "migrate":
+        asyncio.run(migrate(args.revision))
+    elif args.command == "token":
+        print(get_token())
+    elif args.command == "export":
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        with output:
+            asyncio.run(export(args.name, args.format, args.updated_since, output))
+    elif args.command == "overdue":
+        asyncio.run(overdue(args.members, sys.stdout))
+    elif args.command == "archive":
+        asyncio.run(archive(args.after_days, args.batch_size))
+    elif args.command == "reconcile":
+        # A non zero exit code lets a scheduled check report the mismatches.
+        mismatches = asyncio.run(reconcile(args.fix))
+        sys.exit(1 if mismatches and not args.fix else 0)
+
+
+if __name__ == "__main__":
+    main()
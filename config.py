@@ -10,6 +10,19 @@ class Settings:
         self.auth0_algorithms: str = os.getenv("AUTH0_ALGORITHMS")
         self.client_id: str = os.getenv("CLIENT_ID")
         self.client_secret: str = os.getenv("CLIENT_SECRET")
+        # Number of verified tokens kept in memory, see utils.VerifiedTokenCache.
+        self.token_cache_size: int = int(os.getenv("TOKEN_CACHE_SIZE") or 1024)
+        # Cache of the book and author detail responses, see cache.py. Setting
+        # CACHE_URL (e.g. redis://redis:6379/0) requires the redis package.
+        self.cache_url: str = os.getenv("CACHE_URL")
+        self.cache_ttl: int = int(os.getenv("CACHE_TTL") or 300)
+        self.cache_size: int = int(os.getenv("CACHE_SIZE") or 1024)
+        # Checkouts returned for more days than this are archived, see archive.py.
+        self.archive_after_days: int = int(os.getenv("ARCHIVE_AFTER_DAYS") or 365)
+        # Loan period of the checkouts made by scanning a copy at the desk.
+        self.loan_days: int = int(os.getenv("LOAN_DAYS") or 21)
+        # Number of copy ids kept in memory by barcode, see barcodes.py.
+        self.barcode_cache_size: int = int(os.getenv("BARCODE_CACHE_SIZE") or 100_000)
 
 
 class Db_Settings:
@@ -19,10 +32,40 @@ class Db_Settings:
         self.db_host = os.getenv("POSTGRES_HOST")
         self.db_port = "5432"
         self.db_name = os.getenv("POSTGRES_DB")
+        # Connection pool, to be sized with the checkout wait time and saturation
+        # returned by the /metrics/db route.
+        self.pool_size = int(os.getenv("POSTGRES_POOL_SIZE") or 5)
+        self.max_overflow = int(os.getenv("POSTGRES_MAX_OVERFLOW") or 10)
+        self.pool_recycle = int(os.getenv("POSTGRES_POOL_RECYCLE") or 1800)
+        self.pool_pre_ping = os.getenv("POSTGRES_POOL_PRE_PING", "true") == "true"
+        self.pool_timeout = float(os.getenv("POSTGRES_POOL_TIMEOUT") or 30)
+        # Number of connections opened when the app starts.
+        self.pool_warmup = int(os.getenv("POSTGRES_POOL_WARMUP") or self.pool_size)
+        # Logs every statement, synchronously: for debugging only. Their number and
+        # duration per route are in the Server-Timing header and GET /metrics.
+        self.echo = os.getenv("POSTGRES_ECHO", "false") == "true"
+        # Read replicas, comma separated URIs (postgresql+asyncpg://...). The read-only
+        # routes use them, in turn or the fastest one first ("latency"), see db.py.
+        self.replica_uris = [
+            uri.strip()
+            for uri in os.getenv("POSTGRES_REPLICA_URIS", "").split(",")
+            if uri.strip()
+        ]
+        self.replica_strategy = os.getenv("POSTGRES_REPLICA_STRATEGY", "round_robin")
+        # After a write, the client reads the primary for this many seconds, so that
+        # it sees its writes even if the replicas lag behind.
+        self.read_your_writes_seconds = float(
+            os.getenv("POSTGRES_READ_YOUR_WRITES_SECONDS") or 5
+        )
+        # A replica which can't be reached or fails a statement is left aside for
+        # this many seconds.
+        self.replica_cool_off_seconds = float(
+            os.getenv("POSTGRES_REPLICA_COOL_OFF_SECONDS") or 30
+        )
 
     def get_db_uri(self):
         uri = (
-            f"postgresql://{self.db_user}:{self.db_password}"
+            f"postgresql+asyncpg://{self.db_user}:{self.db_password}"
             f"@{self.db_host}:{self.db_port}/{self.db_name}"
         )
         return uri
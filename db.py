@@ -1,32 +1,335 @@
+import asyncio
+import itertools
+import math
+import os
+import time
+from typing import List, Optional
+
+from alembic import command
+from alembic.config import Config
 from dotenv import load_dotenv
-from psycopg2 import OperationalError
-from sqlmodel import Session, SQLModel, create_engine
+from fastapi import Request, Response
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError, OperationalError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from config import Db_Settings
 
 load_dotenv()
 
+
+class PoolMetrics:
+    """Time spent by the requests waiting for a connection of the pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def observe(self, wait: float):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long each checkout had to wait for a connection."""
+
+    def __init__(self, *args, pool_size=5, max_overflow=10, **kwargs):
+        super().__init__(
+            *args, pool_size=pool_size, max_overflow=max_overflow, **kwargs
+        )
+        self.metrics = PoolMetrics()
+        # max_overflow=-1 means that the pool is never saturated.
+        self.capacity = pool_size + max_overflow if max_overflow >= 0 else None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        self.metrics.observe(time.perf_counter() - start)
+        return connection
+
+
+# Cookie of the clients which wrote recently: their reads go to the primary.
+READ_PRIMARY_COOKIE = "read_primary_until"
+# Weight of the last statement in the average latency of a replica.
+LATENCY_EWMA_WEIGHT = 0.2
+
+
+class ReplicaRouter:
+    """Chooses the engine of the read-only sessions: the replicas in turn, or the one
+    with the lowest average statement latency with `strategy="latency"`. Everything
+    goes to the primary when there is no replica.
+
+    A write request sets a cookie (see `wrote`) so that the reads of its client go to
+    the primary for `read_your_writes_seconds`, the time for the replicas to catch up.
+
+    A replica which can't be connected to, or loses its connection or fails a
+    statement with an operational error, is down for `cool_off_seconds`: the others
+    are chosen meanwhile, the primary if none is left.
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: List[AsyncEngine],
+        strategy: str = "round_robin",
+        read_your_writes_seconds: float = 5,
+        cool_off_seconds: float = 30,
+    ):
+        if strategy not in ("round_robin", "latency"):
+            raise ValueError(f"Unknown replica strategy {strategy!r}")
+        self.primary = primary
+        self.replicas = replicas
+        self.strategy = strategy
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.cool_off_seconds = cool_off_seconds
+        self.latencies: List[Optional[float]] = [None] * len(replicas)
+        self.down_until = [0.0] * len(replicas)
+        self._turns = itertools.count()
+        for index, replica in enumerate(replicas):
+            self._measure(index, replica)
+
+    def _measure(self, index: int, replica: AsyncEngine):
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info["replica_query_start"] = time.perf_counter()
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            self.observe(index, time.perf_counter() - conn.info["replica_query_start"])
+
+        def error(context):
+            if context.is_disconnect or isinstance(
+                context.sqlalchemy_exception, OperationalError
+            ):
+                self.mark_down(replica)
+
+        event.listen(replica.sync_engine, "before_cursor_execute", before)
+        event.listen(replica.sync_engine, "after_cursor_execute", after)
+        event.listen(replica.sync_engine, "handle_error", error)
+
+    def mark_down(self, replica: AsyncEngine):
+        index = self.replicas.index(replica)
+        self.down_until[index] = time.monotonic() + self.cool_off_seconds
+
+    def observe(self, index: int, seconds: float):
+        latency = self.latencies[index]
+        if latency is None:
+            self.latencies[index] = seconds
+        else:
+            self.latencies[index] = latency + LATENCY_EWMA_WEIGHT * (seconds - latency)
+
+    def up(self) -> List[int]:
+        """Indexes of the replicas which aren't down."""
+        now = time.monotonic()
+        return [i for i, until in enumerate(self.down_until) if until <= now]
+
+    def choose(self) -> AsyncEngine:
+        up = self.up()
+        if not up:
+            return self.primary
+        if self.strategy == "latency":
+            # The replicas which weren't measured yet come first.
+            index = min(
+                up,
+                key=lambda i: (self.latencies[i] is not None, self.latencies[i] or 0),
+            )
+        else:
+            index = up[next(self._turns) % len(up)]
+        return self.replicas[index]
+
+    def wrote_recently(self, request: Request) -> bool:
+        try:
+            until = float(request.cookies.get(READ_PRIMARY_COOKIE, 0))
+        except ValueError:
+            until = 0
+        return until > time.time()
+
+    def metrics(self) -> List[dict]:
+        up = self.up()
+        return [
+            {
+                **get_pool_metrics(replica),
+                "latency_avg_ms": None if latency is None else 1000 * latency,
+                "up": index in up,
+            }
+            for index, (replica, latency) in enumerate(
+                zip(self.replicas, self.latencies)
+            )
+        ]
+
+    def wrote(self, response: Response):
+        if self.replicas and self.read_your_writes_seconds > 0:
+            until = time.time() + self.read_your_writes_seconds
+            response.set_cookie(
+                READ_PRIMARY_COOKIE,
+                f"{until:.3f}",
+                max_age=math.ceil(self.read_your_writes_seconds),
+                httponly=True,
+                samesite="lax",
+            )
+
+
+def make_engine(uri: str) -> AsyncEngine:
+    return create_async_engine(
+        url=uri,
+        echo=db_settings.echo,
+        poolclass=MonitoredPool,
+        pool_size=db_settings.pool_size,
+        max_overflow=db_settings.max_overflow,
+        pool_recycle=db_settings.pool_recycle,
+        pool_pre_ping=db_settings.pool_pre_ping,
+        pool_timeout=db_settings.pool_timeout,
+    )
+
+
 db_settings = Db_Settings()
 uri = db_settings.get_db_uri()
-engine = create_engine(url=uri, echo=True)
-try:
-    # Ping the database
-    engine.connect()
-    print("Connected to the database.")
-except OperationalError as e:
-    print("Failed to connect to the database:", e)
+engine = make_engine(uri)
+replica_engines = [make_engine(replica_uri) for replica_uri in db_settings.replica_uris]
+replica_router = ReplicaRouter(
+    engine,
+    replica_engines,
+    db_settings.replica_strategy,
+    db_settings.read_your_writes_seconds,
+    db_settings.replica_cool_off_seconds,
+)
 
 # Penser à fermer le engine après utilisation
 
 
-def get_db():
-    with Session(engine) as session:
+async def ping_db(engine):
+    try:
+        # Ping the database, the connection goes back to the pool afterwards.
+        async with engine.connect():
+            print("Connected to the database.")
+    except (OSError, SQLAlchemyError) as e:
+        print("Failed to connect to the database:", e)
+
+
+async def warmup_pool(engine, size: int):
+    """Opens `size` connections at once so the first requests don't have to."""
+    results = await asyncio.gather(
+        *(engine.connect() for _ in range(size)), return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    for result in results:
+        if not isinstance(result, Exception):
+            # Closing the connection gives it back to the pool, still open.
+            await result.close()
+    if errors:
+        print("Failed to warm up the connection pool:", errors[0])
+    else:
+        print(f"Opened {size} connections to the database.")
+
+
+def get_pool_metrics(engine) -> dict:
+    pool = engine.pool
+    metrics = pool.metrics
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "saturation": checked_out / pool.capacity if pool.capacity else 0.0,
+        "checkouts": metrics.checkouts,
+        "timeouts": metrics.timeouts,
+        "wait_avg_ms": (
+            1000 * metrics.total_wait / metrics.checkouts if metrics.checkouts else 0.0
+        ),
+        "wait_max_ms": 1000 * metrics.max_wait,
+    }
+
+
+async def get_db(request: Request, response: Response):
+    # A request which may write sends its client to the primary for a while, see
+    # ReplicaRouter.
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        replica_router.wrote(response)
+    # expire_on_commit=False so that the objects returned by the routes can still be
+    # serialized after the commit without triggering a (forbidden) lazy refresh.
+    async with AsyncSession(replica_router.primary, expire_on_commit=False) as session:
+        yield session
+
+
+async def get_read_db(request: Request):
+    """Session of the read-only routes, on a replica if there are some, on the primary
+    if the client wrote recently."""
+    read_your_writes = replica_router.wrote_recently(request)
+    read_engine = (
+        replica_router.primary if read_your_writes else replica_router.choose()
+    )
+    session = AsyncSession(read_engine, expire_on_commit=False)
+    if read_engine is not replica_router.primary:
+        try:
+            # Connected now, so that the request can still go to the primary.
+            await session.connection()
+        except (DBAPIError, OSError):
+            await session.close()
+            replica_router.mark_down(read_engine)
+            read_engine = replica_router.primary
+            session = AsyncSession(read_engine, expire_on_commit=False)
+    async with session:
+        # These clients skip the response cache, which may be older than their writes,
+        # and what a lagging replica returns isn't stored in it (see
+        # Fieldset.detail_response).
+        session.info["read_your_writes"] = read_your_writes
+        session.info["replica"] = read_engine is not replica_router.primary
         yield session
 
 
-def delete_db_and_tables(engine):
-    SQLModel.metadata.drop_all(bind=engine)
+async def delete_db_and_tables(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        # The tables are created again by all the migrations.
+        await conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+
+async def create_db_and_tables(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+# Key of the PostgreSQL advisory lock taken while migrating, so that the workers
+# starting at the same time don't run the migrations twice.
+MIGRATIONS_LOCK_KEY = 4_815_162_342
+
+
+def _upgrade(connection, revision: str):
+    config = Config(ALEMBIC_INI)
+    config.attributes["connection"] = connection
+    command.upgrade(config, revision)
 
 
-def create_db_and_tables(engine):
-    SQLModel.metadata.create_all(bind=engine)
+async def run_migrations(engine, revision: str = "head"):
+    """Upgrades the schema of the database to `revision`, see migrations/README."""
+    async with engine.connect() as conn:
+        postgresql = conn.dialect.name == "postgresql"
+        if postgresql:
+            await conn.execute(
+                text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY}
+            )
+            # The lock is kept until it's released, the migrations start outside of a
+            # transaction.
+            await conn.commit()
+        try:
+            await conn.run_sync(_upgrade, revision)
+        finally:
+            if postgresql:
+                # After a failed migration, the transaction has to be ended first.
+                await conn.rollback()
+                await conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"),
+                    {"key": MIGRATIONS_LOCK_KEY},
+                )
+                await conn.commit()
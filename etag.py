@@ -0,0 +1,60 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+
+def validators(
+    versions: List[Tuple[str, int, datetime]],
+    extra: Optional[bytes] = None,
+    last_modified: bool = False,
+) -> Dict[str, str]:
+    """ETag and Last-Modified headers of a response made of rows whose versions are
+    (model name, id, updated_at).
+
+    The weak ETag is a hash of the id and `updated_at` of every row, so it is computed
+    without serializing the response and changes when a row is added, removed or
+    updated. The `extra` parts of the response which aren't rows (e.g. aggregates) are
+    hashed too.
+
+    The date of the last change misses the removed rows: Last-Modified is only sent
+    with `last_modified`, for a single row without any related rows embedded.
+    """
+    digest = hashlib.blake2b(repr(versions).encode(), digest_size=8)
+    if extra is not None:
+        digest.update(extra)
+    headers = {"ETag": f'W/"{digest.hexdigest()}"'}
+    if last_modified and versions and extra is None:
+        last_modified = max(updated_at for _, _, updated_at in versions)
+        headers["Last-Modified"] = format_datetime(
+            last_modified.replace(tzinfo=timezone.utc), usegmt=True
+        )
+    return headers
+
+
+def _matches(request: Request, headers: Dict[str, str]) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110, 13.2.2).
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+        return "*" in etags or headers["ETag"].removeprefix("W/") in etags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            return parsedate_to_datetime(headers["Last-Modified"]) <= since
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified(request: Request, headers: Dict[str, str]) -> Optional[Response]:
+    """The 304 response to return if the client already has this version."""
+    if _matches(request, headers):
+        names = [name for name in ["ETag", "Last-Modified"] if name in headers]
+        return Response(
+            status_code=304, headers={name: headers[name] for name in names}
+        )
+    return None
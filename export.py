@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from typing import AsyncIterator, Literal, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from models.models import (
+    Book,
+    BookRead,
+    Checkout,
+    CheckoutHistory,
+    CheckoutRead,
+    Copy,
+    CopyRead,
+    Member,
+    MemberRead,
+)
+from pagination import STREAM_BATCH_SIZE
+
+# Exported tables: the columns of the Read model, plus `updated_at`. The archived
+# checkouts (see archive.py) are exported on their own, they keep the `updated_at` they
+# had in `checkouts`.
+EXPORTS = {
+    "books": (Book, BookRead),
+    "copies": (Copy, CopyRead),
+    "members": (Member, MemberRead),
+    "checkouts": (Checkout, CheckoutRead),
+    "checkouts_history": (CheckoutHistory, CheckoutRead),
+}
+ExportName = Literal["books", "copies", "members", "checkouts", "checkouts_history"]
+ExportFormat = Literal["csv", "ndjson"]
+
+
+def export_query(name: str, updated_since: Optional[datetime] = None):
+    model, read_model = EXPORTS[name]
+    table = model.__table__
+    columns = [table.c[field] for field in read_model.model_fields] + [
+        table.c.updated_at
+    ]
+    query = select(*columns).order_by(table.c.id)
+    if updated_since is not None:
+        query = query.where(table.c.updated_at >= updated_since)
+    return query
+
+
+def _text(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _encode(rows, keys, format: str) -> bytes:
+    if format == "ndjson":
+        lines = (json.dumps(dict(zip(keys, map(_text, row)))) + "\n" for row in rows)
+        return "".join(lines).encode()
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_text(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def export_gzip(
+    engine: AsyncEngine,
+    name: str,
+    format: str,
+    updated_since: Optional[datetime] = None,
+) -> AsyncIterator[bytes]:
+    """Yields the gzip compressed rows of the `name` table in CSV or NDJSON.
+
+    The rows are read from a server side cursor, STREAM_BATCH_SIZE at a time, and
+    compressed as they come, so the memory used doesn't depend on the table size.
+    """
+    query = export_query(name, updated_since)
+    keys = list(query.selected_columns.keys())
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip header and trailer.
+    if format == "csv":
+        yield compressor.compress(_encode([keys], keys, format))
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for rows in result.partitions():
+            chunk = compressor.compress(_encode(rows, keys, format))
+            if chunk:
+                yield chunk
+    yield compressor.flush()
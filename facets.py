@@ -0,0 +1,213 @@
+"""
+Facet counts of the book search: the number of matching books per language,
+publication decade, author and availability, next to a page of results.
+
+They are counted by a single query over the filtered books: GROUP BY GROUPING SETS
+on PostgreSQL, which reads the books once for all the facets, a UNION ALL of GROUP BYs
+on SQLite which doesn't have grouping sets. The authors are counted on their links to
+the books, in another branch of the UNION ALL. Each facet keeps its FACET_LIMIT
+largest counts. The counts of a search are cached (see cache.py) for CACHE_TTL
+seconds: the popular searches are counted once per TTL, their counts may lag behind
+the writes.
+"""
+
+import hashlib
+import json
+from typing import Dict, List, Optional, Union
+
+import orjson
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy import (
+    Integer,
+    case,
+    cast,
+    extract,
+    func,
+    literal,
+    literal_column,
+    null,
+    tuple_,
+    union_all,
+)
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from cache import ResponseCache
+from models.models import Author, AuthorBookLink, Book, BookRead
+
+FACETS = ["language", "decade", "author", "available"]
+FACET_LIMIT = 20
+
+# A literal rather than a bind parameter: the decade expression of the SELECT has to
+# be the same as the one of the GROUP BY, and both would get their own parameter.
+TEN = literal_column("10", Integer)
+
+
+class FacetCount(BaseModel):
+    value: Union[bool, int, str, None]
+    # Name of the author.
+    label: Optional[str] = None
+    count: int
+
+
+class FacetedBooks(BaseModel):
+    """Response of the search with `facets`."""
+
+    items: List[BookRead]
+    facets: Dict[str, List[FacetCount]]
+
+
+def facet_names(
+    facets: Optional[str] = Query(
+        None, description=f"Comma separated facets to count, some of {FACETS}"
+    )
+) -> List[str]:
+    if facets is None:
+        return []
+    names = {name.strip() for name in facets.split(",") if name.strip()}
+    if unknown := names - set(FACETS):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown facets {sorted(unknown)}, expected some of {FACETS}",
+        )
+    return [name for name in FACETS if name in names]
+
+
+def _columns(name: str) -> list:
+    if name == "language":
+        return [col(Book.language)]
+    if name == "decade":
+        return [cast(extract("year", Book.publication_date), Integer) // TEN * TEN]
+    if name == "author":
+        return [col(Author.id), col(Author.first_name), col(Author.last_name)]
+    return [col(Book.available_copies) > 0]
+
+
+def _selected(columns: Dict[str, list], counted: List[str]) -> list:
+    """The labeled columns of every facet, null for the ones which aren't `counted`.
+    The nulls are typed: the branches of a UNION must have the same column types."""
+    return [
+        (c if name in counted else cast(null(), c.type)).label(f"{name}_{i}")
+        for name in FACETS
+        for i, c in enumerate(columns[name])
+    ]
+
+
+def facets_query(search, names: List[str], dialect: str):
+    """Rows (facet, language, decade, author id, first name, last name, available,
+    count) of the books matched by `search` (a select of Book), one per value of each
+    of the facet `names`. The columns of the other facets are null."""
+    # The filters and joins of the search, without its columns and order.
+    search = search.order_by(None)
+    columns = {name: _columns(name) for name in FACETS}
+    count = func.count().label("count")
+    branches = []
+
+    book_facets = [name for name in names if name != "author"]
+    if dialect == "postgresql" and book_facets:
+        facet = case(
+            *((func.grouping(columns[name][0]) == 0, name) for name in book_facets)
+        ).label("facet")
+        grouping_sets = func.grouping_sets(
+            *(tuple_(*columns[name]) for name in book_facets)
+        )
+        grouped = (
+            search.with_only_columns(facet, *_selected(columns, book_facets), count)
+            .group_by(grouping_sets)
+            .subquery()
+        )
+        rank = func.row_number().over(
+            partition_by=grouped.c.facet, order_by=grouped.c.count.desc()
+        )
+        ranked = select(*grouped.c, rank.label("rank")).subquery()
+        branches.append(
+            select(*list(ranked.c)[:-1]).where(ranked.c.rank <= FACET_LIMIT)
+        )
+    else:
+        for name in book_facets:
+            branches.append(
+                search.with_only_columns(
+                    literal(name).label("facet"), *_selected(columns, [name]), count
+                ).group_by(*columns[name])
+            )
+
+    if "author" in names:
+        # Counted on the links rather than on the books joined to their authors, a
+        # book is then counted once per author without a count(DISTINCT).
+        author_id = col(AuthorBookLink.author_id)
+        authors = (
+            search.with_only_columns(author_id, count)
+            .join_from(Book, AuthorBookLink, col(AuthorBookLink.book_id) == Book.id)
+            .group_by(author_id)
+            .order_by(count.desc(), author_id)
+            .limit(FACET_LIMIT)
+            .subquery()
+        )
+        branches.append(
+            select(
+                literal("author").label("facet"),
+                *_selected(columns, ["author"]),
+                authors.c.count,
+            ).join(authors, authors.c.author_id == Author.id)
+        )
+    return branches[0] if len(branches) == 1 else union_all(*branches)
+
+
+def _facet_value(name: str, row) -> dict:
+    _, language, decade, author_id, first_name, last_name, available, count = row
+    if name == "language":
+        return {"value": language, "count": count}
+    if name == "decade":
+        return {"value": decade, "count": count}
+    if name == "author":
+        label = None if author_id is None else f"{first_name} {last_name}"
+        return {"value": author_id, "label": label, "count": count}
+    return {"value": None if available is None else bool(available), "count": count}
+
+
+async def count_facets(
+    session: AsyncSession, search, names: List[str]
+) -> Dict[str, List[dict]]:
+    """The FACET_LIMIT most frequent values of each facet among the books matched by
+    `search`, the most frequent first."""
+    rows = (
+        await session.exec(facets_query(search, names, session.bind.dialect.name))
+    ).all()
+    facets: Dict[str, List[dict]] = {name: [] for name in names}
+    for row in rows:
+        value = _facet_value(row[0], row)
+        # The books without a language or a publication date aren't counted.
+        if value["value"] is not None:
+            facets[row[0]].append(value)
+    for values in facets.values():
+        values.sort(key=lambda value: (-value["count"], str(value["value"])))
+        del values[FACET_LIMIT:]
+    return facets
+
+
+def facets_key(names: List[str], filters: dict) -> str:
+    search = json.dumps([names, sorted(filters.items())], default=str)
+    return "facets:" + hashlib.blake2b(search.encode(), digest_size=16).hexdigest()
+
+
+async def cached_facets(
+    session: AsyncSession,
+    cache: ResponseCache,
+    search,
+    names: List[str],
+    filters: dict,
+) -> bytes:
+    """JSON of the facets of the search, read from `cache` under the key of the facet
+    `names` and of the `filters` of the search, unless the client has to read its
+    writes. Like the detail responses (see Fieldset.detail_response), the counts are
+    only stored when read from the primary."""
+    if session.info.get("read_your_writes"):
+        return orjson.dumps(await count_facets(session, search, names))
+    key = facets_key(names, filters)
+    if cached := await cache.get(key):
+        return cached.body
+    body = orjson.dumps(await count_facets(session, search, names))
+    if not session.info.get("replica"):
+        await cache.set(key, body)
+    return body
@@ -0,0 +1,260 @@
+"""
+Sparse fieldsets and expansion of the relationships: `fields=title,isbn` only selects
+(and returns) these columns besides the id, `expand=authors` embeds the authors. The
+detail routes embed all their relationships by default, the list routes none.
+
+Only the selected columns are read, as tuples encoded with orjson (see
+serialization.py). The many-to-one relationships are joined to the rows, the others
+cost one query for the whole page. The archived rows of a relationship (see archive.py)
+are only embedded with `include_history`.
+"""
+
+from collections import defaultdict
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple, Type
+
+import orjson
+from fastapi import Depends, HTTPException, Query, Request, Response
+from sqlalchemy.orm import aliased
+from sqlmodel import SQLModel, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from cache import ResponseCache
+from etag import not_modified, validators
+
+
+def _names(value: Optional[str]) -> Optional[List[str]]:
+    if value is None:
+        return None
+    return [name for name in (name.strip() for name in value.split(",")) if name]
+
+
+class FieldsParams:
+    """Query parameters selecting the fields and the relationships of a response."""
+
+    def __init__(
+        self,
+        fields: Optional[str] = Query(
+            None, description="Comma separated fields, all of them by default"
+        ),
+        expand: Optional[str] = Query(
+            None, description="Comma separated relationships to embed"
+        ),
+    ):
+        self.fields = _names(fields)
+        self.expand = _names(expand)
+
+
+class Fieldset:
+    """Columns of `model` and relationships of a response. The related rows of the
+    many-to-one relationships are joined to the rows, the others are loaded with a
+    query per relationship."""
+
+    def __init__(
+        self,
+        model: Type[SQLModel],
+        fields: List[str],
+        relations: Dict[str, Type[SQLModel]],
+        complete: bool,
+        archives: Optional[Dict[str, Type[SQLModel]]] = None,
+    ):
+        self.model = model
+        self.fields = fields
+        self.relations = relations
+        # Tables of the archived rows of the relationships, if any.
+        self.archives = archives or {}
+        self.joined = {
+            name: read_model
+            for name, read_model in relations.items()
+            if not getattr(model, name).property.uselist
+        }
+        # True for the response without `fields` or `expand`, the one cached.
+        self.complete = complete
+
+    def _related(self, relation: str) -> Type[SQLModel]:
+        return getattr(self.model, relation).property.mapper.class_
+
+    def select(self):
+        """Select of the fields and of the joined relationships, each followed by the
+        `updated_at` of its row (ETag)."""
+        columns = [getattr(self.model, name) for name in self.fields]
+        columns.append(self.model.updated_at)
+        joins = []
+        for name, read_model in self.joined.items():
+            relationship = getattr(self.model, name)
+            related = aliased(self._related(name), name=name)
+            columns += [
+                getattr(related, field).label(f"{name}_{field}")
+                for field in [*read_model.model_fields, "updated_at"]
+            ]
+            joins.append(relationship.of_type(related))
+        query = select(*columns)
+        for join in joins:
+            query = query.outerjoin(join)
+        return query
+
+    def read_rows(self, rows) -> Tuple[List[dict], list]:
+        """The rows of `select` as dicts, and their versions for the ETag."""
+        name = self.model.__name__
+        items, versions = [], []
+        for row in rows:
+            item = dict(zip(self.fields, row))
+            versions.append((name, row.id, row.updated_at))
+            # The columns of each joined row follow, then its updated_at.
+            start = len(self.fields) + 1
+            for relation, read_model in self.joined.items():
+                fields = list(read_model.model_fields)
+                end = start + len(fields)
+                related = dict(zip(fields, row[start:end]))
+                if related["id"] is None:
+                    item[relation] = None
+                else:
+                    item[relation] = related
+                    related_name = self._related(relation).__name__
+                    versions.append((related_name, related["id"], row[end]))
+                start = end + 1
+            items.append(item)
+        return items, versions
+
+    def _archived_select(self, relation: str, fields: List[str], ids: List[int]):
+        archive = self.archives[relation]
+        # The archive has the foreign key of the related table, e.g. member_id.
+        ((_, foreign_key),) = getattr(self.model, relation).property.local_remote_pairs
+        parent_id = getattr(archive, foreign_key.name)
+        return select(
+            col(parent_id).label("parent_id"),
+            *(getattr(archive, field) for field in fields),
+            archive.updated_at,
+        ).where(col(parent_id).in_(ids))
+
+    async def expand(
+        self, session: AsyncSession, items: List[dict], include_history: bool = False
+    ) -> list:
+        """Embeds the other relationships in the `items`, a query per relationship
+        (and per archive with `include_history`), and returns the versions of the
+        related rows."""
+        versions = []
+        ids = [item["id"] for item in items]
+        for name, read_model in self.relations.items():
+            if name in self.joined:
+                continue
+            relationship = getattr(self.model, name)
+            related = self._related(name)
+            fields = list(read_model.model_fields)
+            queries = [
+                select(
+                    col(self.model.id).label("parent_id"),
+                    *(getattr(related, field) for field in fields),
+                    related.updated_at,
+                )
+                .join(relationship)
+                .where(col(self.model.id).in_(ids))
+                .order_by(related.id)
+            ]
+            if include_history and name in self.archives:
+                queries.append(self._archived_select(name, fields, ids))
+            embedded = defaultdict(list)
+            for query in queries:
+                for row in (await session.exec(query)).all():
+                    embedded[row.parent_id].append(dict(zip(fields, row[1:])))
+                    versions.append((related.__name__, row.id, row.updated_at))
+            for item in items:
+                item[name] = embedded.get(item["id"], [])
+                if len(queries) > 1:
+                    item[name].sort(key=itemgetter("id"))
+        return versions
+
+    async def one(
+        self, session: AsyncSession, id: int, include_history: bool = False
+    ) -> Tuple[bytes, dict]:
+        """JSON and validators of the row `id`, 404 if it doesn't exist."""
+        query = self.select().where(col(self.model.id) == id)
+        row = (await session.exec(query)).first()
+        if row is None:
+            raise HTTPException(
+                status_code=404, detail=f"{self.model.__name__} id {id} not found"
+            )
+        return await self.dump(session, row, include_history)
+
+    async def dump(
+        self, session: AsyncSession, row, include_history: bool = False
+    ) -> Tuple[bytes, dict]:
+        """JSON and validators of a `row` of `select`."""
+        items, versions = self.read_rows([row])
+        versions += await self.expand(session, items, include_history)
+        headers = validators(versions, last_modified=not self.relations)
+        return orjson.dumps(items[0]), headers
+
+    async def detail_response(
+        self,
+        session: AsyncSession,
+        id: int,
+        request: Request,
+        cache: Optional[ResponseCache] = None,
+        key: Optional[str] = None,
+        include_history: bool = False,
+    ) -> Response:
+        """Response of the row `id`. The complete one is read from `cache` under `key`
+        if given, unless the client has to read its writes, and stored in it when read
+        from the primary: a lagging replica would keep an old row there until the
+        entry expires."""
+        if not self.complete or include_history or session.info.get("read_your_writes"):
+            cache = None
+        if cache is not None and (cached := await cache.get(key)):
+            return not_modified(request, cached.headers) or cached
+        body, headers = await self.one(session, id, include_history)
+        if response := not_modified(request, headers):
+            return response
+        if cache is not None and not session.info.get("replica"):
+            return await cache.set(key, body, headers)
+        return Response(body, headers=headers, media_type="application/json")
+
+
+class Fieldsets:
+    """Fieldsets of the responses of `model`: the fields of `read_model`, and the
+    `relations` which can be embedded, with the read model of the related rows.
+    `archives` gives the table of the archived rows of some relationships."""
+
+    def __init__(
+        self,
+        model: Type[SQLModel],
+        read_model: Type[SQLModel],
+        archives: Optional[Dict[str, Type[SQLModel]]] = None,
+        **relations: Type[SQLModel],
+    ):
+        self.model = model
+        self.read_model = read_model
+        self.archives = archives
+        self.relations = relations
+
+    def fieldset(self, params: FieldsParams, expand_all: bool) -> Fieldset:
+        fields = list(self.read_model.model_fields)
+        if params.fields is not None:
+            if unknown := set(params.fields) - set(fields):
+                raise HTTPException(
+                    status_code=422, detail=f"Unknown fields {sorted(unknown)}"
+                )
+            # The id is always returned, the pages and the ETags need it.
+            fields = [name for name in fields if name == "id" or name in params.fields]
+        if params.expand is None:
+            expand = list(self.relations) if expand_all else []
+        else:
+            if unknown := set(params.expand) - self.relations.keys():
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Unknown relationships {sorted(unknown)}, "
+                    f"expected some of {sorted(self.relations)}",
+                )
+            expand = [name for name in self.relations if name in params.expand]
+        complete = params.fields is None and params.expand is None
+        relations = {name: self.relations[name] for name in expand}
+        return Fieldset(self.model, fields, relations, complete, self.archives)
+
+    def detail(self, params: FieldsParams = Depends()) -> Fieldset:
+        """Dependency of the detail routes, which embed every relationship by
+        default."""
+        return self.fieldset(params, expand_all=True)
+
+    def listing(self, params: FieldsParams = Depends()) -> Fieldset:
+        """Dependency of the list routes, which embed none by default."""
+        return self.fieldset(params, expand_all=False)
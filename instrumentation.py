@@ -0,0 +1,258 @@
+"""
+Timings of the requests: latency per route, number and duration of the SQL statements
+and serialization time. They are returned in the Server-Timing header of every response
+and aggregated for the GET /metrics route (Prometheus text format).
+
+`?profile=1` on an admin route samples the stack of the event loop while the request is
+handled, and returns it instead of the response, folded for flamegraph.pl or speedscope.
+"""
+
+import asyncio
+import bisect
+import functools
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the buckets of the latency histogram, in seconds.
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+PROFILE_INTERVAL = 0.001
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.route: Optional[str] = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.endpoint_end: Optional[float] = None
+
+    def server_timing(self) -> str:
+        total = time.perf_counter() - self.start
+        return ", ".join(
+            [
+                f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+                f"serialize;dur={self.serialize_time * 1000:.2f}",
+                f"total;dur={total * 1000:.2f}",
+            ]
+        )
+
+
+# Timings of the request being handled. The statements are run in greenlets which
+# share the context of the request (see sqlalchemy.util._concurrency_py3k).
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "current_timings", default=None
+)
+
+
+# The start of a statement is kept on its execution context, which goes away with it:
+# a statement which fails has no after_cursor_execute.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "query_start", None)
+    timings = current_timings.get()
+    if timings is not None and start is not None:
+        timings.queries += 1
+        timings.db_time += time.perf_counter() - start
+
+
+class RouteMetrics:
+    """Totals of the requests per (method, route, status), as Prometheus counters."""
+
+    def __init__(self):
+        self.requests: Counter = Counter()
+        self.latency_buckets: Dict[Tuple[str, str], List[int]] = defaultdict(
+            lambda: [0] * len(LATENCY_BUCKETS)
+        )
+        self.latency_sum: Counter = Counter()
+        self.latency_count: Counter = Counter()
+        self.queries: Counter = Counter()
+        self.db_time: Counter = Counter()
+        self.serialize_time: Counter = Counter()
+
+    def observe(self, method: str, status: int, timings: RequestTimings):
+        key = (method, timings.route)
+        latency = time.perf_counter() - timings.start
+        self.requests[(method, timings.route, status)] += 1
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+        if bucket < len(LATENCY_BUCKETS):
+            self.latency_buckets[key][bucket] += 1
+        self.latency_sum[key] += latency
+        self.latency_count[key] += 1
+        self.queries[key] += timings.queries
+        self.db_time[key] += timings.db_time
+        self.serialize_time[key] += timings.serialize_time
+
+    def clear(self):
+        self.__init__()
+
+    def prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        lines = [
+            "# TYPE library_http_requests_total counter",
+            *(
+                f'library_http_requests_total{{method="{method}",route="{route}",'
+                f'status="{status}"}} {count}'
+                for (method, route, status), count in sorted(self.requests.items())
+            ),
+            "# TYPE library_http_request_duration_seconds histogram",
+        ]
+        for (method, route), buckets in sorted(self.latency_buckets.items()):
+            labels = f'method="{method}",route="{route}"'
+            count = self.latency_count[(method, route)]
+            cumulated = 0
+            for bound, n in zip(LATENCY_BUCKETS, buckets):
+                cumulated += n
+                lines.append(
+                    f"library_http_request_duration_seconds_bucket"
+                    f'{{{labels},le="{bound}"}} {cumulated}'
+                )
+            lines += [
+                f'library_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                f"{count}",
+                f"library_http_request_duration_seconds_sum{{{labels}}} "
+                f"{self.latency_sum[(method, route)]:.6f}",
+                f"library_http_request_duration_seconds_count{{{labels}}} {count}",
+            ]
+        for name, counter, kind in [
+            ("library_db_queries_total", self.queries, "counter"),
+            ("library_db_seconds_total", self.db_time, "counter"),
+            ("library_serialization_seconds_total", self.serialize_time, "counter"),
+        ]:
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [
+                f'{name}{{method="{method}",route="{route}"}} {value:g}'
+                for (method, route), value in sorted(counter.items())
+            ]
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+
+route_metrics = RouteMetrics()
+
+
+class ProfilingMiddleware:
+    """Times every request, adds the Server-Timing header and counts the request in
+    `route_metrics` (only the requests of a route, the others have no route label)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [*message.get("headers", [])]
+                headers.append((b"server-timing", timings.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timings.reset(token)
+            if timings.route is not None:
+                route_metrics.observe(scope["method"], status, timings)
+
+
+class StackSampler:
+    """Samples the stack of the thread `thread_id` every `interval` seconds, from a
+    thread of its own. The samples are counted folded: "root;...;leaf"."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def _requires_admin(route: APIRoute) -> bool:
+    return any(
+        "admin" in dependency.security_scopes
+        for dependency in route.dependant.dependencies
+    )
+
+
+class TimedRoute(APIRoute):
+    """Route recording its path and serialization time in the timings of the request,
+    and profiling the request with `?profile=1` if it's an admin route (the
+    dependencies, so the token, are checked before the profile is returned)."""
+
+    def get_route_handler(self) -> Callable:
+        endpoint = self.dependant.call
+        if asyncio.iscoroutinefunction(endpoint):
+
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    timings = current_timings.get()
+                    if timings is not None:
+                        timings.endpoint_end = time.perf_counter()
+
+            self.dependant.call = timed_endpoint
+
+        handler = super().get_route_handler()
+        profilable = _requires_admin(self)
+
+        async def timed_handler(request: Request) -> Response:
+            timings = current_timings.get()
+            if timings is not None:
+                timings.route = self.path
+            if profilable and request.query_params.get("profile") == "1":
+                with StackSampler(threading.get_ident()) as sampler:
+                    await handler(request)
+                return PlainTextResponse(sampler.folded())
+            response = await handler(request)
+            # The response model was validated and encoded after the endpoint.
+            if timings is not None and timings.endpoint_end is not None:
+                timings.serialize_time += time.perf_counter() - timings.endpoint_end
+            return response
+
+        return timed_handler
@@ -0,0 +1,43 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel
+
+import models.models  # noqa: F401, registers the tables in the metadata
+from config import Db_Settings
+
+config = context.config
+target_metadata = SQLModel.metadata
+
+
+def do_run_migrations(connection):
+    # One transaction per revision: the ones creating indexes concurrently commit the
+    # previous ones before leaving the transaction (see migrations/README).
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        transaction_per_migration=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations():
+    engine = create_async_engine(Db_Settings().get_db_uri(), poolclass=NullPool)
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+# The app and cli.py give their connection (see db.run_migrations), the alembic
+# command connects to the database of the environment variables.
+connection = config.attributes.get("connection")
+if connection is not None:
+    do_run_migrations(connection)
+else:
+    if config.config_file_name is not None:
+        fileConfig(config.config_file_name)
+    asyncio.run(run_async_migrations())
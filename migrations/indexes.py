@@ -0,0 +1,46 @@
+"""
+Indexes created by the revisions on tables which may already be big: concurrently on
+PostgreSQL, outside of a transaction, so that the tables can still be written while
+they are built.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def _drop_invalid_index(name: str):
+    # A CREATE INDEX CONCURRENTLY that failed (e.g. the app was stopped) leaves an
+    # invalid index, which IF NOT EXISTS would keep.
+    invalid = op.get_bind().scalar(
+        sa.text(
+            "SELECT NOT indisvalid FROM pg_index "
+            "WHERE indexrelid = to_regclass(:name)"
+        ),
+        {"name": name},
+    )
+    if invalid:
+        op.drop_index(name, postgresql_concurrently=True)
+
+
+def create_indexes(indexes):
+    """Creates the missing `indexes`, (name, table, columns[, options]) tuples."""
+    with op.get_context().autocommit_block():
+        for name, table, columns, *options in indexes:
+            if op.get_bind().dialect.name == "postgresql":
+                _drop_invalid_index(name)
+            op.create_index(
+                name,
+                table,
+                columns,
+                if_not_exists=True,
+                postgresql_concurrently=True,
+                **(options[0] if options else {}),
+            )
+
+
+def drop_indexes(indexes):
+    with op.get_context().autocommit_block():
+        for name, table, *_ in indexes:
+            op.drop_index(
+                name, table_name=table, if_exists=True, postgresql_concurrently=True
+            )
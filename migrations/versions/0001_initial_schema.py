@@ -0,0 +1,100 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+The tables of the first version of the app, which created them with
+`SQLModel.metadata.create_all` when it started: on these databases the tables already
+exist and nothing is done. The columns and indexes added to the models since then are
+added by the following revisions, which check whether create_all already made them.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("books"):
+        return
+    op.create_table(
+        "authors",
+        sa.Column("first_name", sa.String(), nullable=False),
+        sa.Column("last_name", sa.String(), nullable=False),
+        sa.Column("date_of_birth", sa.Date(), nullable=False),
+        sa.Column("date_of_death", sa.Date(), nullable=True),
+        sa.Column("nationality", sa.String(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "books",
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("isbn", sa.String(), nullable=False),
+        sa.Column("edition", sa.String(), nullable=False),
+        sa.Column("publication_date", sa.Date(), nullable=False),
+        sa.Column("language", sa.String(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("isbn"),
+    )
+    op.create_table(
+        "members",
+        sa.Column("auth0_id", sa.String(), nullable=False),
+        sa.Column("first_name", sa.String(), nullable=False),
+        sa.Column("last_name", sa.String(), nullable=False),
+        sa.Column("age", sa.Integer(), nullable=False),
+        sa.Column("birthdate", sa.Date(), nullable=False),
+        sa.Column("city", sa.String(), nullable=False),
+        sa.Column("membership_expiration", sa.Date(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "authorbooklink",
+        sa.Column("book_id", sa.Integer(), nullable=False),
+        sa.Column("author_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["author_id"], ["authors.id"]),
+        sa.ForeignKeyConstraint(["book_id"], ["books.id"]),
+        sa.PrimaryKeyConstraint("book_id", "author_id"),
+    )
+    op.create_table(
+        "copies",
+        sa.Column("barcode", sa.String(), nullable=False),
+        sa.Column("location", sa.String(), nullable=False),
+        sa.Column("is_available", sa.Boolean(), nullable=False),
+        sa.Column("book_id", sa.Integer(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["book_id"], ["books.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("barcode"),
+    )
+    op.create_table(
+        "checkouts",
+        sa.Column("checkout_date", sa.Date(), nullable=False),
+        sa.Column("expected_return_date", sa.Date(), nullable=False),
+        sa.Column("member_id", sa.Integer(), nullable=False),
+        sa.Column("copy_id", sa.Integer(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("returned_date", sa.Date(), nullable=True),
+        sa.ForeignKeyConstraint(["copy_id"], ["copies.id"]),
+        sa.ForeignKeyConstraint(["member_id"], ["members.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade():
+    for table in [
+        "checkouts",
+        "copies",
+        "authorbooklink",
+        "members",
+        "books",
+        "authors",
+    ]:
+        op.drop_table(table)
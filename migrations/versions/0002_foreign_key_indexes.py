@@ -0,0 +1,45 @@
+"""Indexes of the foreign keys and of the searched columns
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+Without them every relationship load (the copies of a book, the checkouts of a member
+or of a copy, the books of an author) and the member lookup by auth0 id scan the
+whole table. The partial index of the overdue checkouts was only created by
+`create_all` so far. They are created concurrently, see migrations/indexes.py.
+"""
+
+import sqlalchemy as sa
+
+from migrations.indexes import create_indexes, drop_indexes
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+OPEN_CHECKOUTS = sa.text("returned_date IS NULL")
+INDEXES = [
+    ("ix_copies_book_id", "copies", ["book_id"]),
+    ("ix_checkouts_member_id", "checkouts", ["member_id"]),
+    ("ix_checkouts_copy_id", "checkouts", ["copy_id"]),
+    ("ix_authorbooklink_author_id", "authorbooklink", ["author_id"]),
+    ("ix_members_auth0_id", "members", ["auth0_id"]),
+    ("ix_books_publication_date", "books", ["publication_date"]),
+    # Open checkouts only, see overdue.py.
+    (
+        "ix_checkouts_overdue",
+        "checkouts",
+        ["id", "expected_return_date"],
+        {"postgresql_where": OPEN_CHECKOUTS, "sqlite_where": OPEN_CHECKOUTS},
+    ),
+]
+
+
+def upgrade():
+    create_indexes(INDEXES)
+
+
+def downgrade():
+    drop_indexes(INDEXES)
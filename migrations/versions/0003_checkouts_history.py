@@ -0,0 +1,72 @@
+"""History of the returned checkouts
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+`checkouts_history` receives the checkouts returned long ago (see archive.py), so that
+`checkouts` only keeps the open and recent ones. On PostgreSQL it is partitioned by
+range of checkout_date, the yearly partitions are created by the archival. The
+`checkouts` table itself isn't partitioned: its unique index of the open checkouts
+(`ux_checkouts_open_copy`) couldn't exist without the partition key.
+
+The table is new and empty, its indexes don't have to be built concurrently. It
+already has the `updated_at` of the rows, added to the other tables by 0004.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+UTCNOW = {
+    "postgresql": "TIMEZONE('utc', CURRENT_TIMESTAMP)",
+    "sqlite": "(STRFTIME('%Y-%m-%d %H:%M:%f', 'now'))",
+}
+COLUMNS = [
+    "expected_return_date",
+    "member_id",
+    "copy_id",
+    "id",
+    "checkout_date",
+    "returned_date",
+]
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("checkouts_history"):
+        return
+    utcnow = UTCNOW[op.get_bind().dialect.name]
+    op.create_table(
+        "checkouts_history",
+        sa.Column("expected_return_date", sa.Date(), nullable=False),
+        sa.Column("member_id", sa.Integer(), nullable=False),
+        sa.Column("copy_id", sa.Integer(), nullable=False),
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("checkout_date", sa.Date(), nullable=False),
+        sa.Column("returned_date", sa.Date(), nullable=True),
+        sa.Column(
+            "updated_at", sa.DateTime(), server_default=sa.text(utcnow), nullable=False
+        ),
+        sa.ForeignKeyConstraint(["copy_id"], ["copies.id"]),
+        sa.ForeignKeyConstraint(["member_id"], ["members.id"]),
+        sa.PrimaryKeyConstraint("id", "checkout_date"),
+        postgresql_partition_by="RANGE (checkout_date)",
+    )
+    for column in ["copy_id", "member_id", "updated_at"]:
+        op.create_index(f"ix_checkouts_history_{column}", "checkouts_history", [column])
+
+
+def downgrade():
+    # The archived checkouts go back to `checkouts` rather than being lost.
+    if sa.inspect(op.get_bind()).has_table("checkouts_history"):
+        columns = ", ".join(COLUMNS)
+        op.execute(
+            f"INSERT INTO checkouts ({columns}) "
+            f"SELECT {columns} FROM checkouts_history"
+        )
+        op.drop_table("checkouts_history")
@@ -0,0 +1,58 @@
+"""Date of the last change of the rows
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+`updated_at` (UTC) is set by the database when a row is inserted and by the app when
+it is updated. The incremental exports read the rows changed since a date, the ETags
+hash it. The existing rows get the date of the migration.
+
+SQLite can't add a column whose default isn't a constant: the table is copied with the
+new column (batch mode), its indexes are created again. The search triggers of the
+books disappear with the old table, 0006 creates them again.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.indexes import create_indexes, drop_indexes
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+UTCNOW = {
+    "postgresql": "TIMEZONE('utc', CURRENT_TIMESTAMP)",
+    "sqlite": "(STRFTIME('%Y-%m-%d %H:%M:%f', 'now'))",
+}
+TABLES = ["authors", "books", "copies", "checkouts", "members"]
+INDEXES = [(f"ix_{table}_updated_at", table, ["updated_at"]) for table in TABLES]
+
+
+def upgrade():
+    bind = op.get_bind()
+    utcnow = UTCNOW[bind.dialect.name]
+    inspector = sa.inspect(bind)
+    for table in TABLES:
+        if "updated_at" in {column["name"] for column in inspector.get_columns(table)}:
+            continue
+        recreate = "always" if bind.dialect.name == "sqlite" else "never"
+        with op.batch_alter_table(table, recreate=recreate) as batch:
+            batch.add_column(
+                sa.Column(
+                    "updated_at",
+                    sa.DateTime(),
+                    server_default=sa.text(utcnow),
+                    nullable=False,
+                )
+            )
+    create_indexes(INDEXES)
+
+
+def downgrade():
+    drop_indexes(INDEXES)
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("updated_at")
@@ -0,0 +1,46 @@
+"""Counters of the copies of the books
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+`total_copies` and `available_copies` are kept up to date by the routes writing the
+copies and the checkouts (see availability.py). They are counted once here, with a
+single UPDATE of the books.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+COUNTERS = ["total_copies", "available_copies"]
+
+
+def upgrade():
+    columns = {
+        column["name"] for column in sa.inspect(op.get_bind()).get_columns("books")
+    }
+    if set(COUNTERS) <= columns:
+        return
+    for name in COUNTERS:
+        if name not in columns:
+            op.add_column(
+                "books",
+                sa.Column(name, sa.Integer(), server_default="0", nullable=False),
+            )
+    op.execute(
+        "UPDATE books SET "
+        "total_copies = (SELECT count(*) FROM copies WHERE copies.book_id = books.id), "
+        "available_copies = (SELECT count(*) FROM copies "
+        "WHERE copies.book_id = books.id AND copies.is_available)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("books") as batch:
+        for name in COUNTERS:
+            batch.drop_column(name)
@@ -0,0 +1,124 @@
+"""Full-text search of the books
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+`search_text` is the normalized title and author names of a book (see the Search
+section of models/models.py), computed here for the existing books. On PostgreSQL the
+generated `search_vector` column and the GIN and trigram indexes are added, on SQLite
+the FTS5 table and the triggers keeping it up to date, which is then filled.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.indexes import create_indexes, drop_indexes
+from models.models import book_search_text
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+PG_INDEXES = [
+    ("ix_books_search_vector", "books", ["search_vector"], {"postgresql_using": "gin"}),
+    (
+        "ix_books_search_text_trgm",
+        "books",
+        ["search_text"],
+        {"postgresql_using": "gin", "postgresql_ops": {"search_text": "gin_trgm_ops"}},
+    ),
+]
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "search_text, content='books', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update "
+    "AFTER UPDATE OF search_text ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO books_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+]
+
+books = sa.table("books", sa.column("id"), sa.column("title"), sa.column("search_text"))
+authors = sa.table(
+    "authors", sa.column("id"), sa.column("first_name"), sa.column("last_name")
+)
+links = sa.table("authorbooklink", sa.column("book_id"), sa.column("author_id"))
+
+
+def _fill_search_text():
+    bind = op.get_bind()
+    update = (
+        books.update()
+        .where(books.c.id == sa.bindparam("book_id"))
+        .values(search_text=sa.bindparam("text"))
+    )
+    after = 0
+    while rows := bind.execute(
+        sa.select(books.c.id, books.c.title)
+        .where(books.c.id > after)
+        .order_by(books.c.id)
+        .limit(BATCH_SIZE)
+    ).all():
+        names = {id: [] for id, _ in rows}
+        for link in bind.execute(
+            sa.select(links.c.book_id, authors.c.first_name, authors.c.last_name)
+            .join(authors, authors.c.id == links.c.author_id)
+            .where(links.c.book_id.in_(names))
+        ):
+            names[link.book_id].append(link)
+        bind.execute(
+            update,
+            [
+                {"book_id": id, "text": book_search_text(title, names[id])}
+                for id, title in rows
+            ],
+        )
+        after = rows[-1].id
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = {column["name"] for column in inspector.get_columns("books")}
+    if "search_text" not in columns:
+        op.add_column(
+            "books",
+            sa.Column("search_text", sa.String(), server_default="", nullable=False),
+        )
+        _fill_search_text()
+
+    if bind.dialect.name == "postgresql":
+        indexes = {index["name"] for index in inspector.get_indexes("books")}
+        if "ix_books_search_text_trgm" not in indexes:
+            op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(
+            "ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, search_text)) STORED"
+        )
+        create_indexes(PG_INDEXES)
+    else:
+        for statement in SQLITE_DDL:
+            op.execute(statement)
+        # The FTS5 table may be new, or have missed the changes while the triggers
+        # were missing (see 0004).
+        op.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        drop_indexes(PG_INDEXES)
+        op.execute("ALTER TABLE books DROP COLUMN IF EXISTS search_vector")
+    else:
+        for name in ["insert", "delete", "update"]:
+            op.execute(f"DROP TRIGGER IF EXISTS books_fts_{name}")
+        op.execute("DROP TABLE IF EXISTS books_fts")
+    with op.batch_alter_table("books") as batch:
+        batch.drop_column("search_text")
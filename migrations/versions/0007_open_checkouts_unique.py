@@ -0,0 +1,57 @@
+"""One open checkout per copy
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+The unique partial index `ux_checkouts_open_copy` refuses a second open checkout of a
+copy, even when two requests claim it at the same time (see create_checkout). It
+can't be created while a copy has several open checkouts: they are listed in the
+error, to be returned (or deleted) before migrating again.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.indexes import create_indexes, drop_indexes
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+OPEN_CHECKOUTS = sa.text("returned_date IS NULL")
+INDEXES = [
+    (
+        "ux_checkouts_open_copy",
+        "checkouts",
+        ["copy_id"],
+        {
+            "unique": True,
+            "postgresql_where": OPEN_CHECKOUTS,
+            "sqlite_where": OPEN_CHECKOUTS,
+        },
+    )
+]
+
+
+def upgrade():
+    copies = (
+        op.get_bind()
+        .scalars(
+            sa.text(
+                "SELECT copy_id FROM checkouts WHERE returned_date IS NULL "
+                "GROUP BY copy_id HAVING count(*) > 1 ORDER BY copy_id"
+            )
+        )
+        .all()
+    )
+    if copies:
+        raise RuntimeError(
+            f"The copies {copies} have several open checkouts, return all but one"
+        )
+    create_indexes(INDEXES)
+
+
+def downgrade():
+    drop_indexes(INDEXES)
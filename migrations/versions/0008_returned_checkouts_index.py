@@ -0,0 +1,38 @@
+"""Index of the returned checkouts
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+
+archive.py moves the checkouts returned before a date in batches, in the order of
+`returned_date` and id. Without this partial index each batch walked the primary key
+from the start, over the open loans and the rows just archived. It is created
+concurrently, see migrations/indexes.py.
+"""
+
+import sqlalchemy as sa
+
+from migrations.indexes import create_indexes, drop_indexes
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+RETURNED_CHECKOUTS = sa.text("returned_date IS NOT NULL")
+INDEXES = [
+    (
+        "ix_checkouts_returned",
+        "checkouts",
+        ["returned_date", "id"],
+        {"postgresql_where": RETURNED_CHECKOUTS, "sqlite_where": RETURNED_CHECKOUTS},
+    )
+]
+
+
+def upgrade():
+    create_indexes(INDEXES)
+
+
+def downgrade():
+    drop_indexes(INDEXES)
@@ -1,6 +1,12 @@
-from datetime import date
-from typing import List, Optional
-
+import re
+import unicodedata
+from datetime import date, datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import DDL, DateTime, Index, event, inspect, literal_column, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
 from sqlmodel import Field, Relationship, SQLModel
 
 """
@@ -15,12 +21,42 @@ https://sqlmodel.tiangolo.com/
 # separate files, I just put all the models in the same file.
 
 
+class utcnow(FunctionElement):
+    """Current UTC date with sub-second precision (CURRENT_TIMESTAMP of SQLite only has
+    seconds, two changes in the same second would get the same ETag)."""
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, "sqlite")
+def _sqlite_utcnow(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def updated_at_field():
+    """Date (UTC) of the last change of a row, set by the database. Used by the
+    incremental exports and the ETags, it is not part of the Read models."""
+    return Field(
+        default=None,
+        nullable=False,
+        index=True,
+        sa_column_kwargs={"server_default": utcnow(), "onupdate": utcnow()},
+    )
+
+
 class AuthorBookLink(SQLModel, table=True):  # type: ignore
     book_id: Optional[int] = Field(
         default=None, foreign_key="books.id", primary_key=True
     )
+    # The primary key starts with book_id, the books of an author need their own index.
     author_id: Optional[int] = Field(
-        default=None, foreign_key="authors.id", primary_key=True
+        default=None, foreign_key="authors.id", primary_key=True, index=True
     )
 
 
@@ -31,14 +67,28 @@ class BookBase(SQLModel):
     title: str
     isbn: str = Field(unique=True, nullable=False)
     edition: str
-    publication_date: date
+    publication_date: date = Field(index=True)
     language: str
 
 
 class Book(BookBase, table=True):  # type: ignore
     __tablename__ = "books"
+    __table_args__ = (
+        Index(
+            "ix_books_search_text_trgm",
+            "search_text",
+            postgresql_using="gin",
+            postgresql_ops={"search_text": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
+    # Normalized title and author names, indexed for the search, see below.
+    search_text: str = Field(default="")
+    # Counters of the copies of the book, updated with them, see availability.py.
+    total_copies: int = Field(default=0)
+    available_copies: int = Field(default=0)
+    updated_at: Optional[datetime] = updated_at_field()
 
     copies: Optional[List["Copy"]] = Relationship(back_populates="book")
     authors: List["Author"] = Relationship(
@@ -52,6 +102,8 @@ class BookCreate(BookBase):
 
 class BookRead(BookBase):
     id: int
+    total_copies: int = 0
+    available_copies: int = 0
 
 
 class BookUpdate(SQLModel):
@@ -83,6 +135,7 @@ class Author(AuthorBase, table=True):  # type: ignore
     __tablename__ = "authors"
 
     id: Optional[int] = Field(default=None, primary_key=True)
+    updated_at: Optional[datetime] = updated_at_field()
 
     books: List["Book"] = Relationship(
         back_populates="authors", link_model=AuthorBookLink
@@ -116,12 +169,13 @@ class CopyBase(SQLModel):
     barcode: str = Field(unique=True)
     location: str
     is_available: bool
-    book_id: int = Field(foreign_key="books.id", nullable=False)
+    book_id: int = Field(foreign_key="books.id", nullable=False, index=True)
 
 
 class Copy(CopyBase, table=True):  # type: ignore
     __tablename__ = "copies"
     id: Optional[int] = Field(default=None, primary_key=True)
+    updated_at: Optional[datetime] = updated_at_field()
 
     book: "Book" = Relationship(back_populates="copies")
     checkouts: Optional[List["Checkout"]] = Relationship(back_populates="copy_item")
@@ -153,19 +207,61 @@ class CheckoutBase(SQLModel):
     checkout_date: date
     expected_return_date: date
 
-    member_id: int = Field(foreign_key="members.id", nullable=False)
-    copy_id: int = Field(foreign_key="copies.id", nullable=False)
+    member_id: int = Field(foreign_key="members.id", nullable=False, index=True)
+    copy_id: int = Field(foreign_key="copies.id", nullable=False, index=True)
 
 
 class Checkout(CheckoutBase, table=True):  # type: ignore
     __tablename__ = "checkouts"
+    # A copy can't have two open checkouts, even if `Copy.is_available` is wrong.
+    __table_args__ = (
+        Index(
+            "ux_checkouts_open_copy",
+            "copy_id",
+            unique=True,
+            postgresql_where=text("returned_date IS NULL"),
+            sqlite_where=text("returned_date IS NULL"),
+        ),
+        # Only the open checkouts are indexed, the overdue ones are found without
+        # reading the history (see overdue.py). The id comes first for their pages.
+        Index(
+            "ix_checkouts_overdue",
+            "id",
+            "expected_return_date",
+            postgresql_where=text("returned_date IS NULL"),
+            sqlite_where=text("returned_date IS NULL"),
+        ),
+        # The returned checkouts in the order they are archived (see archive.py).
+        Index(
+            "ix_checkouts_returned",
+            "returned_date",
+            "id",
+            postgresql_where=text("returned_date IS NOT NULL"),
+            sqlite_where=text("returned_date IS NOT NULL"),
+        ),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     returned_date: Optional[date] = None
+    updated_at: Optional[datetime] = updated_at_field()
     current_owner: "Member" = Relationship(back_populates="member_checkouts")
     copy_item: "Copy" = Relationship(back_populates="checkouts")
 
 
+class CheckoutHistory(CheckoutBase, table=True):  # type: ignore
+    """Returned checkouts moved out of `checkouts` by archive.py. On PostgreSQL the
+    table is partitioned by year of checkout_date, the partition key has to be part of
+    the primary key."""
+
+    __tablename__ = "checkouts_history"
+    __table_args__ = {"postgresql_partition_by": "RANGE (checkout_date)"}
+
+    id: int = Field(primary_key=True)
+    checkout_date: date = Field(primary_key=True)
+    returned_date: Optional[date] = None
+    updated_at: Optional[datetime] = updated_at_field()
+
+
 class CheckoutCreate(CheckoutBase):
     pass
 
@@ -181,16 +277,32 @@ class CheckoutUpdate(SQLModel):
     returned_date: Optional[date] = None
 
 
+class CheckoutScan(SQLModel):
+    barcode: str
+    # The copy is returned without a member.
+    member_id: Optional[int] = None
+    expected_return_date: Optional[date] = None
+
+
 class CheckoutReadWithDetails(CheckoutRead):
     current_owner: "MemberRead"
     copy_item: "CopyRead"
 
 
+class OverdueMemberSummary(SQLModel):
+    member_id: int
+    first_name: str
+    last_name: str
+    overdue_checkouts: int
+    oldest_expected_return_date: date
+    days_overdue: int
+
+
 # ========= Member =========
 
 
 class MemberBase(SQLModel):
-    auth0_id: str
+    auth0_id: str = Field(index=True)
     first_name: str
     last_name: str
     age: int
@@ -203,6 +315,7 @@ class Member(MemberBase, table=True):  # type: ignore
     __tablename__ = "members"
 
     id: Optional[int] = Field(default=None, primary_key=True)
+    updated_at: Optional[datetime] = updated_at_field()
 
     member_checkouts: Optional[List["Checkout"]] = Relationship(
         back_populates="current_owner"
@@ -229,3 +342,88 @@ class MemberUpdate(SQLModel):
 
 class MemberReadWithCheckouts(MemberRead):
     member_checkouts: Optional[List["CheckoutRead"]] = []
+
+
+# ========= Search =========
+
+# Books are searched on `search_text`: the title and the names of the authors without
+# accents, in lower case. On PostgreSQL a generated `search_vector` column stores its
+# tsvector (so the ranking doesn't parse the text of every match again) with a GIN
+# index, and a trigram index finds the typos. SQLite uses an FTS5 table kept up to date
+# by triggers. See search.py for the queries.
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+
+event.listen(
+    SQLModel.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+for statement in [
+    "ALTER TABLE books ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    "(to_tsvector('simple'::regconfig, search_text)) STORED",
+    "CREATE INDEX ix_books_search_vector ON books USING gin (search_vector)",
+]:
+    event.listen(
+        Book.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql")
+    )
+for statement in [
+    "CREATE VIRTUAL TABLE books_fts USING fts5("
+    "search_text, content='books', content_rowid='id')",
+    "CREATE TRIGGER books_fts_insert AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER books_fts_delete AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER books_fts_update AFTER UPDATE OF search_text ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO books_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+]:
+    event.listen(
+        Book.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+event.listen(
+    Book.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS books_fts").execute_if(dialect="sqlite"),
+)
+
+
+def normalize_search_text(value: str) -> str:
+    """Lower case words without accents: "Émile  Zola!" -> "emile zola"."""
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(char for char in value if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[^\W_]+", value.casefold()))
+
+
+def book_search_text(title: str, authors: Iterable["Author"]) -> str:
+    names = [f"{author.first_name} {author.last_name}" for author in authors]
+    return normalize_search_text(" ".join([title, *names]))
+
+
+@event.listens_for(Session, "before_flush")
+def _update_search_text(session, flush_context, instances):
+    # Models are not hashable, so the books are kept by identity.
+    books = {}
+    for obj in session.new | session.dirty:
+        state = inspect(obj)
+        if isinstance(obj, Book) and (
+            obj in session.new
+            or state.attrs.title.history.has_changes()
+            or state.attrs.authors.history.has_changes()
+        ):
+            books[id(obj)] = obj
+        elif isinstance(obj, Author) and (
+            state.attrs.first_name.history.has_changes()
+            or state.attrs.last_name.history.has_changes()
+        ):
+            books.update((id(book), book) for book in obj.books)
+    for obj in session.deleted:
+        if isinstance(obj, Author):
+            books.update((id(book), book) for book in obj.books)
+
+    for book in books.values():
+        if book in session.deleted:
+            continue
+        authors = [author for author in book.authors if author not in session.deleted]
+        book.search_text = book_search_text(book.title, authors)
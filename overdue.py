@@ -0,0 +1,84 @@
+from datetime import date
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import col, select
+
+from models.models import Checkout, CheckoutRead, Member, OverdueMemberSummary
+from pagination import STREAM_BATCH_SIZE
+
+# The overdue checkouts are the open ones whose expected return date is past. Both
+# conditions match the partial index `ix_checkouts_overdue`, which only holds the open
+# checkouts: the queries read the overdue rows and never the returned ones, however
+# long the history is.
+
+
+def overdue_condition(today: date):
+    return (
+        col(Checkout.returned_date).is_(None),
+        col(Checkout.expected_return_date) < today,
+    )
+
+
+def overdue_query(today: date):
+    return select(Checkout).where(*overdue_condition(today))
+
+
+def overdue_members_query(today: date, after: Optional[int] = None):
+    """Number of overdue checkouts and oldest expected return date of each member,
+    after the member `after`.
+
+    The overdue checkouts are grouped before the join, and `after` filters their
+    member_id: filtering `Member.id` instead let PostgreSQL walk the checkouts of all
+    the members, history included, along ix_checkouts_member_id."""
+    overdue = select(
+        col(Checkout.member_id).label("member_id"),
+        func.count(col(Checkout.id)).label("overdue_checkouts"),
+        func.min(Checkout.expected_return_date).label("oldest"),
+    ).where(*overdue_condition(today))
+    if after is not None:
+        overdue = overdue.where(col(Checkout.member_id) > after)
+    overdue = overdue.group_by(col(Checkout.member_id)).subquery()
+    return (
+        select(
+            Member.id,
+            Member.first_name,
+            Member.last_name,
+            overdue.c.overdue_checkouts,
+            overdue.c.oldest,
+        )
+        .join(overdue, overdue.c.member_id == Member.id)
+        .order_by(Member.id)
+    )
+
+
+def member_summary(row, today: date) -> OverdueMemberSummary:
+    member_id, first_name, last_name, overdue_checkouts, oldest = row
+    return OverdueMemberSummary(
+        member_id=member_id,
+        first_name=first_name,
+        last_name=last_name,
+        overdue_checkouts=overdue_checkouts,
+        oldest_expected_return_date=oldest,
+        days_overdue=(today - oldest).days,
+    )
+
+
+async def scan_overdue(
+    engine: AsyncEngine, today: date, members: bool = False
+) -> AsyncIterator[List[str]]:
+    """Yields the overdue checkouts (or the summaries of their members) as JSON,
+    STREAM_BATCH_SIZE at a time, read from a server side cursor."""
+    if members:
+        query = overdue_members_query(today)
+    else:
+        query = overdue_query(today).order_by(Checkout.id)
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for rows in result.partitions():
+            if members:
+                models = [member_summary(row, today) for row in rows]
+            else:
+                models = [CheckoutRead.model_validate(row._mapping) for row in rows]
+            yield [model.model_dump_json() for model in models]
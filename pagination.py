@@ -0,0 +1,85 @@
+from typing import AsyncIterator, Literal, Optional
+
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from etag import not_modified, validators
+from fieldsets import Fieldset
+from serialization import json_response, ndjson_lines
+
+# Number of rows fetched at once from the server side cursor when streaming.
+STREAM_BATCH_SIZE = 1000
+
+
+class PageParams:
+    """Query parameters of the list routes, paginated on the id (keyset pagination).
+
+    Unlike an OFFSET, `after` lets the database start right at the next row using the
+    primary key index, so the last page is as fast as the first one.
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(100, ge=1, le=1000),
+        after: Optional[int] = Query(None, description="Last id of the previous page"),
+        format: Literal["json", "ndjson"] = Query(
+            "json", description="ndjson streams every row after `after`, one per line"
+        ),
+    ):
+        self.limit = limit
+        self.after = after
+        self.format = format
+
+
+async def _stream_ndjson(bind, query, fieldset: Fieldset) -> AsyncIterator[bytes]:
+    # The session of the route is closed before the response is sent, so the rows are
+    # streamed with their own session on the same engine.
+    async with AsyncSession(bind) as session:
+        result = await session.stream(
+            query.execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            items, _ = fieldset.read_rows(rows)
+            yield ndjson_lines(items)
+
+
+async def paginate(
+    session: AsyncSession,
+    fieldset: Fieldset,
+    page: PageParams,
+    request: Request,
+    *where,
+):
+    """Returns the page of the rows of `fieldset.model` (matching the `where`
+    conditions) after `page.after`, with a `Link` header pointing to the next page if
+    there is one and the ETag of the page (304 if it didn't change).
+
+    Only the fields and the relationships of the `fieldset` are read, see
+    fieldsets.py."""
+    model = fieldset.model
+    query = fieldset.select().where(*where).order_by(model.id)
+    if page.after is not None:
+        query = query.where(model.id > page.after)
+
+    if page.format == "ndjson":
+        if set(fieldset.relations) - set(fieldset.joined):
+            raise HTTPException(
+                status_code=422,
+                detail=f"Only {sorted(fieldset.joined)} can be expanded with ndjson",
+            )
+        return StreamingResponse(
+            _stream_ndjson(session.bind, query, fieldset),
+            media_type="application/x-ndjson",
+        )
+
+    rows = (await session.exec(query.limit(page.limit))).all()
+    items, versions = fieldset.read_rows(rows)
+    versions += await fieldset.expand(session, items)
+    headers = validators(versions)
+    if len(rows) == page.limit:
+        next_url = request.url.include_query_params(after=rows[-1].id)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    if not_modified_response := not_modified(request, headers):
+        return not_modified_response
+    return json_response(items, headers)
@@ -1,21 +1,38 @@
-from typing import List
-
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlmodel import Session, select
-
-from db import get_db
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Security
+from sqlalchemy.orm import selectinload
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from batch import LookupIds, LookupResult, lookup, query_ids
+from bulk import BulkResult, BulkRows, add_created, insert_rows, validate_rows
+from cache import author_key, book_key, get_cache
+from db import get_db, get_read_db
+from fieldsets import Fieldset, Fieldsets
+from instrumentation import TimedRoute
 from models.models import (
     Author,
     AuthorCreate,
     AuthorRead,
     AuthorReadWithBooks,
     AuthorUpdate,
+    BookRead,
 )
-from utils import VerifyToken
+from pagination import PageParams, paginate
+from suggest import get_suggest_index
+from utils import get_verifier
 
-auth = VerifyToken()
+auth = get_verifier()
+cache = get_cache()
+suggestions = get_suggest_index()
 
-router = APIRouter(dependencies=[Security(auth.verify, scopes=["admin"])])
+router = APIRouter(
+    route_class=TimedRoute, dependencies=[Security(auth.verify, scopes=["admin"])]
+)
+
+# Fields and relationships of the responses: get_author embeds the books by default,
+# loaded with a 2nd query, see fieldsets.py.
+AUTHOR_FIELDSETS = Fieldsets(Author, AuthorRead, books=BookRead)
 
 # Example of a route that requires a valid access token
 # @router.get("/api/private")
@@ -34,49 +51,100 @@ router = APIRouter(dependencies=[Security(auth.verify, scopes=["admin"])])
 
 
 @router.get("/authors/", response_model=List[AuthorRead])
-async def get_all_authors(session: Session = Depends(get_db)):
-    all_authors = session.exec(select(Author)).all()
-    return all_authors
+async def get_all_authors(
+    request: Request,
+    page: PageParams = Depends(),
+    fieldset: Fieldset = Depends(AUTHOR_FIELDSETS.listing),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await paginate(session, fieldset, page, request)
+
+
+@router.get("/authors/lookup", response_model=LookupResult[AuthorRead])
+async def get_authors_by_ids(
+    ids: List[int] = Depends(query_ids), session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Author, AuthorRead, ids)
+
+
+@router.post("/authors/lookup", response_model=LookupResult[AuthorRead])
+async def post_authors_by_ids(
+    body: LookupIds, session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Author, AuthorRead, body.ids)
 
 
 @router.get("/author/{author_id}", response_model=AuthorReadWithBooks)
-async def get_author(author_id: int, session: Session = Depends(get_db)):
-    db_author = session.get(Author, author_id)
-    if not db_author:
-        raise HTTPException(status_code=404, detail=f"Author id {author_id} not found")
-    return db_author
+async def get_author(
+    author_id: int,
+    request: Request,
+    fieldset: Fieldset = Depends(AUTHOR_FIELDSETS.detail),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await fieldset.detail_response(
+        session, author_id, request, cache, author_key(author_id)
+    )
 
 
 @router.post("/author/", response_model=AuthorRead)
-async def create_author(author: AuthorCreate, session: Session = Depends(get_db)):
+async def create_author(author: AuthorCreate, session: AsyncSession = Depends(get_db)):
     db_author = Author.model_validate(author)
     session.add(db_author)
-    session.commit()
-    session.refresh(db_author)
+    await session.commit()
+    suggestions.add_author(db_author.id, db_author.first_name, db_author.last_name)
+    await session.refresh(db_author)
     return db_author
 
 
+@router.post("/authors/bulk", response_model=BulkResult)
+async def create_authors(
+    rows: List[Dict[str, Any]] = BulkRows, session: AsyncSession = Depends(get_db)
+):
+    result = BulkResult()
+    authors = validate_rows(rows, AuthorCreate, result)
+    ids = await insert_rows(
+        session, Author, [author.model_dump() for _, author in authors]
+    )
+    await session.commit()
+    for author_id, (_, author) in zip(ids, authors):
+        suggestions.add_author(author_id, author.first_name, author.last_name)
+    add_created(result, [index for index, _ in authors], ids)
+    return result
+
+
 @router.put("/author/{author_id}", response_model=AuthorRead)
 async def update_author(
-    author_id: int, author: AuthorUpdate, session: Session = Depends(get_db)
+    author_id: int, author: AuthorUpdate, session: AsyncSession = Depends(get_db)
 ):
-    db_author = session.get(Author, author_id)
+    # The books of the author are loaded to invalidate them, they list their authors.
+    db_author = await session.get(
+        Author, author_id, options=[selectinload(Author.books)]
+    )
     if not db_author:
         raise HTTPException(status_code=404, detail=f"Author id {author_id} not found")
     author_data = author.model_dump(exclude_unset=True)
     for key, value in author_data.items():
         setattr(db_author, key, value)
     session.add(db_author)
-    session.commit()
-    session.refresh(db_author)
+    await session.commit()
+    await cache.invalidate(
+        [author_key(author_id), *(book_key(book.id) for book in db_author.books)]
+    )
+    suggestions.add_author(author_id, db_author.first_name, db_author.last_name)
+    await session.refresh(db_author)
     return db_author
 
 
 @router.delete("/author/{author_id}", response_model=dict)
-async def delete_author(author_id: int, session: Session = Depends(get_db)):
-    db_author = session.get(Author, author_id)
+async def delete_author(author_id: int, session: AsyncSession = Depends(get_db)):
+    db_author = await session.get(
+        Author, author_id, options=[selectinload(Author.books)]
+    )
     if not db_author:
         raise HTTPException(status_code=404, detail=f"Author id {author_id} not found")
-    session.delete(db_author)
-    session.commit()
+    books_ids = [book.id for book in db_author.books]
+    await session.delete(db_author)
+    await session.commit()
+    await cache.invalidate([author_key(author_id), *map(book_key, books_ids)])
+    suggestions.remove_author(author_id)
     return {"message": f"Author id {db_author.id} deleted successfully"}
@@ -1,39 +1,107 @@
-from typing import List, Optional
+from datetime import date
+from typing import Any, Dict, List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlmodel import Session, col, extract, select
+import orjson
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    Security,
+)
+from sqlalchemy import insert
+from sqlalchemy.orm import selectinload
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from db import get_db
+from batch import LookupIds, LookupResult, lookup, query_ids
+from bulk import (
+    BulkError,
+    BulkResult,
+    BulkRows,
+    add_created,
+    insert_rows,
+    validate_rows,
+)
+from cache import author_key, book_key, get_cache
+from db import get_db, get_read_db
+from etag import not_modified, validators
+from facets import FacetedBooks, cached_facets, facet_names
+from fieldsets import Fieldset, Fieldsets
+from instrumentation import TimedRoute
 from models.models import (
     Author,
+    AuthorBookLink,
+    AuthorRead,
     Book,
     BookCreate,
     BookRead,
     BookReadWithAuthors,
     BookUpdate,
+    CopyRead,
+    book_search_text,
+    normalize_search_text,
+)
+from pagination import PageParams, paginate
+from search import search_books_query
+from serialization import json_response
+from suggest import Suggestion, get_suggest_index
+from utils import get_verifier
+
+auth = get_verifier()
+cache = get_cache()
+suggestions = get_suggest_index()
+router = APIRouter(
+    route_class=TimedRoute, dependencies=[Security(auth.verify, scopes=["admin"])]
 )
-from utils import VerifyToken
 
-auth = VerifyToken()
-router = APIRouter(dependencies=[Security(auth.verify, scopes=["admin"])])
+# Fields and relationships of the responses: get_book embeds the authors and the copies
+# by default, with one query for each, see fieldsets.py.
+BOOK_FIELDSETS = Fieldsets(Book, BookRead, authors=AuthorRead, copies=CopyRead)
 
 
 @router.get("/books/", response_model=List[BookRead])
-async def get_all_books(session: Session = Depends(get_db)):
-    all_books = session.exec(select(Book)).all()
-    return all_books
+async def get_all_books(
+    request: Request,
+    page: PageParams = Depends(),
+    fieldset: Fieldset = Depends(BOOK_FIELDSETS.listing),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await paginate(session, fieldset, page, request)
+
+
+@router.get("/books/lookup", response_model=LookupResult[BookRead])
+async def get_books_by_ids(
+    ids: List[int] = Depends(query_ids), session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Book, BookRead, ids)
+
+
+@router.post("/books/lookup", response_model=LookupResult[BookRead])
+async def post_books_by_ids(
+    body: LookupIds, session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Book, BookRead, body.ids)
 
 
 @router.get("/book/{book_id}", response_model=BookReadWithAuthors)
-async def get_book(book_id: int, session: Session = Depends(get_db)):
-    db_book = session.get(Book, book_id)
-    if not db_book:
-        raise HTTPException(status_code=404, detail=f"Book id {book_id} not found")
-    return db_book
+async def get_book(
+    book_id: int,
+    request: Request,
+    fieldset: Fieldset = Depends(BOOK_FIELDSETS.detail),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await fieldset.detail_response(
+        session, book_id, request, cache, book_key(book_id)
+    )
 
 
-def _get_authors(session: Session, authors_ids: List[int]):
-    authors = session.exec(select(Author).filter(col(Author.id).in_(authors_ids))).all()
+async def _get_authors(session: AsyncSession, authors_ids: List[int]):
+    authors = (
+        await session.exec(select(Author).filter(col(Author.id).in_(authors_ids)))
+    ).all()
 
     # utilise la len originale de authors_ids.
     # Faire un count sur authors_ids puis comparer avec len(authors_ids).
@@ -51,70 +119,200 @@ def _get_authors(session: Session, authors_ids: List[int]):
 # I think it can be a good idea to force the user to provide the authors when creating a
 # book since a book always has at least one author.
 @router.post("/book/", response_model=BookRead)
-async def create_book(book: BookCreate, session: Session = Depends(get_db)):
-    authors = _get_authors(session, book.authors_ids)
+async def create_book(book: BookCreate, session: AsyncSession = Depends(get_db)):
+    authors = await _get_authors(session, book.authors_ids)
     db_book = Book.model_validate(book)
     db_book.authors = authors
     session.add(db_book)
-    session.commit()
-    session.refresh(db_book)
+    await session.commit()
+    await cache.invalidate(map(author_key, book.authors_ids))
+    suggestions.add_book(db_book.id, db_book.title)
+    await session.refresh(db_book)
     return db_book
 
 
+@router.post("/books/bulk", response_model=BulkResult)
+async def create_books(
+    rows: List[Dict[str, Any]] = BulkRows, session: AsyncSession = Depends(get_db)
+):
+    result = BulkResult()
+    books = validate_rows(rows, BookCreate, result)
+
+    # The authors and the existing isbns of the whole batch are fetched at once.
+    authors_ids = {author_id for _, book in books for author_id in book.authors_ids}
+    authors = {
+        author.id: author
+        for author in (
+            await session.exec(select(Author).filter(col(Author.id).in_(authors_ids)))
+        ).all()
+    }
+    isbns = set(
+        (
+            await session.exec(
+                select(Book.isbn).filter(col(Book.isbn).in_([b.isbn for _, b in books]))
+            )
+        ).all()
+    )
+
+    indexes, book_rows, books_authors = [], [], []
+    for index, book in books:
+        missing_authors_ids = set(book.authors_ids) - authors.keys()
+        if missing_authors_ids:
+            detail = f"No author with ids {missing_authors_ids} found"
+        elif book.isbn in isbns:
+            detail = f"Book with isbn {book.isbn} already exists"
+        else:
+            isbns.add(book.isbn)
+            book_authors = [authors[author_id] for author_id in book.authors_ids]
+            indexes.append(index)
+            book_rows.append(
+                book.model_dump(exclude={"authors_ids"})
+                # Bulk inserts skip the session events, see models.py.
+                | {"search_text": book_search_text(book.title, book_authors)}
+            )
+            books_authors.append(set(book.authors_ids))
+            continue
+        result.errors.append(BulkError(index=index, detail=detail))
+
+    books_ids = await insert_rows(session, Book, book_rows)
+    link_rows = [
+        {"book_id": book_id, "author_id": author_id}
+        for book_id, authors_ids in zip(books_ids, books_authors)
+        for author_id in authors_ids
+    ]
+    if link_rows:
+        await session.exec(insert(AuthorBookLink), params=link_rows)
+    await session.commit()
+    await cache.invalidate(map(author_key, {row["author_id"] for row in link_rows}))
+    for book_id, row in zip(books_ids, book_rows):
+        suggestions.add_book(book_id, row["title"])
+    add_created(result, indexes, books_ids)
+    return result
+
+
 @router.put("/book/{book_id}", response_model=BookRead)
 async def update_book(
-    book_id: int, book: BookUpdate, session: Session = Depends(get_db)
+    book_id: int, book: BookUpdate, session: AsyncSession = Depends(get_db)
 ):
-    db_book = session.get(Book, book_id)
+    db_book = await session.get(Book, book_id, options=[selectinload(Book.authors)])
     if db_book is None:
         raise HTTPException(status_code=404, detail=f"Book id {book_id} not found")
+    # The authors list their books: the previous and new authors are invalidated.
+    authors_ids = {author.id for author in db_book.authors}
     if book.authors_ids:
-        authors = _get_authors(session, book.authors_ids)
+        authors = await _get_authors(session, book.authors_ids)
         db_book.authors = authors
     book_data = book.model_dump(exclude_unset=True, exclude={"authors_ids"})
     for key, value in book_data.items():
         setattr(db_book, key, value)
     session.add(db_book)
-    session.commit()
-    session.refresh(db_book)
+    await session.commit()
+    authors_ids |= {author.id for author in db_book.authors}
+    await cache.invalidate([book_key(book_id), *map(author_key, authors_ids)])
+    suggestions.add_book(book_id, db_book.title)
+    await session.refresh(db_book)
     return db_book
 
 
 @router.delete("/book/{book_id}", response_model=dict)
-async def delete_book(book_id: int, session: Session = Depends(get_db)):
-    db_book = session.get(Book, book_id)
+async def delete_book(book_id: int, session: AsyncSession = Depends(get_db)):
+    db_book = await session.get(Book, book_id, options=[selectinload(Book.authors)])
     if not db_book:
         raise HTTPException(status_code=404, detail=f"Book id {book_id} not found")
-    session.delete(db_book)
-    session.commit()
+    authors_ids = [author.id for author in db_book.authors]
+    await session.delete(db_book)
+    await session.commit()
+    await cache.invalidate([book_key(book_id), *map(author_key, authors_ids)])
+    suggestions.remove_book(book_id)
     return {"message": f"Book id {db_book.id} deleted successfully"}
 
 
-unsecure_router = APIRouter()
+unsecure_router = APIRouter(route_class=TimedRoute)
 
 
-@unsecure_router.get("/books/search", response_model=List[BookRead])
+@unsecure_router.get(
+    "/books/search", response_model=Union[List[BookRead], FacetedBooks]
+)
 async def search_books(
-    title: Optional[str] = None,
+    request: Request,
+    q: Optional[str] = Query(None, description="Words of the title or author names"),
+    title: Optional[str] = Query(None, description="Searched like `q`"),
     publication_year: Optional[int] = None,
     isbn: Optional[str] = None,
     language: Optional[str] = None,
-    author_name: Optional[str] = None,
-    session: Session = Depends(get_db),
+    author_name: Optional[str] = Query(None, description="Searched like `q`"),
+    available: Optional[bool] = Query(
+        None, description="Only the books with (or without) an available copy"
+    ),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    fieldset: Fieldset = Depends(BOOK_FIELDSETS.listing),
+    facets: List[str] = Depends(facet_names),
+    session: AsyncSession = Depends(get_read_db),
 ):
-    query = select(Book)
-    if title:
-        query = query.filter(col(Book.title).ilike(f"%{title}%"))
+    """The books matching the filters. With `facets`, the response is an object with
+    the books in `items` and the counts of the facets of all the matching books in
+    `facets`, see facets.py."""
+    query = fieldset.select()
+    # The title and the author names share the same index, see search.py.
+    words = " ".join(filter(None, [q, title, author_name]))
+    query = search_books_query(query, session.bind.dialect.name, words)
     if publication_year:
-        query = query.filter(extract("year", Book.publication_date) == publication_year)
+        # A range on the date itself, unlike extract("year", ...), can use an index.
+        query = query.filter(
+            col(Book.publication_date).between(
+                date(publication_year, 1, 1), date(publication_year, 12, 31)
+            )
+        )
     if isbn:
         query = query.filter(Book.isbn == isbn)
     if language:
         query = query.filter(col(Book.language).ilike(f"%{language}%"))
-    if author_name:
-        query = query.join(Book.authors).filter(
-            (col(Author.first_name).ilike(f"%{author_name}%"))
-            | (col(Author.last_name).ilike(f"%{author_name}%"))
+    if available is not None:
+        available_copies = col(Book.available_copies)
+        query = query.filter(
+            available_copies > 0 if available else available_copies == 0
         )
-    books = session.exec(query).all()
-    return books
+    rows = (await session.exec(query.offset(offset).limit(limit))).all()
+    books, versions = fieldset.read_rows(rows)
+    versions += await fieldset.expand(session, books)
+    facets_body = None
+    if facets:
+        filters = {
+            "words": words,
+            "publication_year": publication_year,
+            "isbn": isbn,
+            "language": language,
+            "available": available,
+        }
+        facets_body = await cached_facets(session, cache, query, facets, filters)
+    headers = validators(versions, facets_body)
+    if len(rows) == limit:
+        next_url = request.url.include_query_params(offset=offset + limit)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    if not_modified_response := not_modified(request, headers):
+        return not_modified_response
+    if facets_body is not None:
+        body = b'{"items":' + orjson.dumps(books) + b',"facets":' + facets_body + b"}"
+        return Response(body, headers=headers, media_type="application/json")
+    return json_response(books, headers)
+
+
+@unsecure_router.get("/books/suggest", response_model=List[Suggestion])
+async def suggest_books(
+    q: str = Query(..., description="Beginning of a title or of an author name"),
+    limit: int = Query(10, ge=1, le=50),
+    session: AsyncSession = Depends(get_read_db),
+):
+    """Titles and author names for the search box, from the index in memory of
+    suggest.py, without a query."""
+    if suggestions.ready or not normalize_search_text(q):
+        return json_response(suggestions.suggest(q, limit))
+    # The index is still loading, the titles come from the search meanwhile.
+    query = search_books_query(
+        select(Book.id, Book.title), session.bind.dialect.name, q
+    )
+    rows = (await session.exec(query.limit(limit))).all()
+    return json_response(
+        [{"kind": "book", "id": id, "text": title} for id, title in rows]
+    )
@@ -1,53 +1,131 @@
-from datetime import date
-from typing import List
+from datetime import date, timedelta
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlmodel import Session, select
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    Security,
+)
+from sqlalchemy import not_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from db import get_db
+from availability import update_copy_counters
+from barcodes import get_barcode_cache
+from batch import LookupIds, LookupResult, lookup, query_ids
+from cache import books_keys, get_cache
+from config import get_settings
+from db import get_db, get_read_db
+from fieldsets import Fieldset, Fieldsets
+from instrumentation import TimedRoute
 from models.models import (
     Checkout,
     CheckoutCreate,
     CheckoutRead,
     CheckoutReadWithDetails,
+    CheckoutScan,
     CheckoutUpdate,
     Copy,
+    CopyRead,
     Member,
+    MemberRead,
+    OverdueMemberSummary,
+)
+from overdue import member_summary, overdue_condition, overdue_members_query
+from pagination import PageParams, paginate
+from utils import get_verifier
+
+auth = get_verifier()
+cache = get_cache()
+barcodes = get_barcode_cache()
+router = APIRouter(
+    route_class=TimedRoute, dependencies=[Security(auth.verify, scopes=["admin"])]
 )
-from utils import VerifyToken
 
-auth = VerifyToken()
-router = APIRouter(dependencies=[Security(auth.verify, scopes=["admin"])])
+# Fields and relationships of the responses: get_checkout embeds the member and the
+# copy by default, joined to the checkout so the response is built with a single query,
+# see fieldsets.py.
+CHECKOUT_FIELDSETS = Fieldsets(
+    Checkout, CheckoutRead, current_owner=MemberRead, copy_item=CopyRead
+)
 
 
 @router.get("/checkouts/", response_model=List[CheckoutRead])
-async def get_all_checkouts(session: Session = Depends(get_db)):
-    all_checkouts = session.exec(select(Checkout)).all()
-    return all_checkouts
+async def get_all_checkouts(
+    request: Request,
+    page: PageParams = Depends(),
+    fieldset: Fieldset = Depends(CHECKOUT_FIELDSETS.listing),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await paginate(session, fieldset, page, request)
+
+
+@router.get("/checkouts/lookup", response_model=LookupResult[CheckoutRead])
+async def get_checkouts_by_ids(
+    ids: List[int] = Depends(query_ids), session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Checkout, CheckoutRead, ids)
+
+
+@router.post("/checkouts/lookup", response_model=LookupResult[CheckoutRead])
+async def post_checkouts_by_ids(
+    body: LookupIds, session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Checkout, CheckoutRead, body.ids)
+
+
+@router.get("/checkouts/overdue", response_model=List[CheckoutRead])
+async def get_overdue_checkouts(
+    request: Request,
+    page: PageParams = Depends(),
+    fieldset: Fieldset = Depends(CHECKOUT_FIELDSETS.listing),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await paginate(
+        session, fieldset, page, request, *overdue_condition(date.today())
+    )
+
+
+@router.get("/checkouts/overdue/members", response_model=List[OverdueMemberSummary])
+async def get_overdue_members(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[int] = Query(
+        None, description="Last member id of the previous page"
+    ),
+    session: AsyncSession = Depends(get_read_db),
+):
+    today = date.today()
+    query = overdue_members_query(today, after)
+    rows = (await session.exec(query.limit(limit))).all()
+    if len(rows) == limit:
+        next_url = request.url.include_query_params(after=rows[-1][0])
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return [member_summary(row, today) for row in rows]
 
 
 @router.get("/checkout/{checkout_id}", response_model=CheckoutReadWithDetails)
-async def get_checkout(checkout_id: int, session: Session = Depends(get_db)):
-    db_checkout = session.get(Checkout, checkout_id)
-    if not db_checkout:
-        raise HTTPException(
-            status_code=404, detail=f"Checkout id {checkout_id} not found"
-        )
-    return db_checkout
+async def get_checkout(
+    checkout_id: int,
+    request: Request,
+    fieldset: Fieldset = Depends(CHECKOUT_FIELDSETS.detail),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await fieldset.detail_response(session, checkout_id, request)
 
 
-@router.post("/checkout/", response_model=CheckoutRead)
-async def create_checkout(checkout: CheckoutCreate, session: Session = Depends(get_db)):
-    copy_item = session.get(Copy, checkout.copy_id)
-    if not copy_item:
-        raise HTTPException(
-            status_code=404, detail=f"Copy id {checkout.copy_id} not found"
-        )
-    if not copy_item.is_available:
-        raise HTTPException(
-            status_code=404, detail=f"Copy id {checkout.copy_id} is not available"
-        )
-    member = session.get(Member, checkout.member_id)
+async def _checkout(
+    session: AsyncSession, checkout: CheckoutCreate, book_id: int
+) -> Checkout:
+    """Creates the checkout of a copy of `book_id` just claimed by the caller."""
+    member = await session.get(Member, checkout.member_id)
     if not member:
         raise HTTPException(
             status_code=404, detail=f"Member id {checkout.member_id} not found"
@@ -57,43 +135,165 @@ async def create_checkout(checkout: CheckoutCreate, session: Session = Depends(g
             status_code=404,
             detail=f"Member id {checkout.member_id} membership expired",
         )
+    await update_copy_counters(session, book_id, available=-1)
     db_checkout = Checkout.model_validate(checkout)
-    copy_item.is_available = False
-    db_checkout.copy_item = copy_item
-    db_checkout.current_owner = member
     session.add(db_checkout)
-    session.commit()
-    session.refresh(db_checkout)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # Another checkout of the copy is still open (see Checkout.__table_args__).
+        await session.rollback()
+        raise HTTPException(
+            status_code=404, detail=f"Copy id {checkout.copy_id} is not available"
+        )
+    # The book lists its copies and whether they are available.
+    await cache.invalidate(await books_keys(session, [book_id]))
+    await session.refresh(db_checkout)
     return db_checkout
 
 
+# The copy is claimed with a conditional UPDATE: of two concurrent checkouts of the
+# same copy, only one can switch it from available to unavailable. The row stays
+# locked until the end of the transaction, which is rolled back if the member can't
+# borrow it.
+CLAIM_COPY = (
+    update(Copy)
+    .where(col(Copy.is_available))
+    .values(is_available=False)
+    .returning(Copy.id, Copy.book_id)
+)
+
+
+@router.post("/checkout/", response_model=CheckoutRead)
+async def create_checkout(
+    checkout: CheckoutCreate, session: AsyncSession = Depends(get_db)
+):
+    claimed_copy = (
+        await session.exec(CLAIM_COPY.where(col(Copy.id) == checkout.copy_id))
+    ).first()
+    if claimed_copy is None:
+        if not await session.get(Copy, checkout.copy_id):
+            raise HTTPException(
+                status_code=404, detail=f"Copy id {checkout.copy_id} not found"
+            )
+        raise HTTPException(
+            status_code=404, detail=f"Copy id {checkout.copy_id} is not available"
+        )
+    return await _checkout(session, checkout, claimed_copy.book_id)
+
+
+@router.post("/checkout/scan", response_model=CheckoutRead)
+async def scan_copy(scan: CheckoutScan, session: AsyncSession = Depends(get_db)):
+    """Checks out the copy with the scanned barcode to `member_id` for LOAN_DAYS (or
+    until `expected_return_date`), or returns it without `member_id`."""
+    if scan.member_id is None:
+        return await _return_copy(session, scan.barcode)
+    claimed_copy = await barcodes.first(session, scan.barcode, CLAIM_COPY)
+    if claimed_copy is None:
+        if await barcodes.first(session, scan.barcode, select(Copy)) is None:
+            raise HTTPException(
+                status_code=404, detail=f"Copy with barcode {scan.barcode} not found"
+            )
+        raise HTTPException(
+            status_code=404,
+            detail=f"Copy with barcode {scan.barcode} is not available",
+        )
+    today = date.today()
+    checkout = CheckoutCreate(
+        checkout_date=today,
+        expected_return_date=scan.expected_return_date
+        or today + timedelta(days=get_settings().loan_days),
+        member_id=scan.member_id,
+        copy_id=claimed_copy.id,
+    )
+    return await _checkout(session, checkout, claimed_copy.book_id)
+
+
+# A loan is ended, and its copy made available again, by conditional UPDATEs as well:
+# of two concurrent returns of the same copy, only one ends the checkout and counts the
+# copy in the available copies of its book.
+END_CHECKOUT = (
+    update(Checkout)
+    .where(col(Checkout.returned_date).is_(None))
+    .returning(Checkout.id, Checkout.copy_id)
+)
+RELEASE_COPY = (
+    update(Copy)
+    .where(not_(col(Copy.is_available)))
+    .values(is_available=True)
+    .returning(Copy.id, Copy.book_id)
+)
+
+
+async def _end_checkout(session: AsyncSession, condition, returned_date: date):
+    """Ends the open checkout matching `condition` and releases its copy. Returns the
+    id and copy id of the checkout, None if no open checkout matches."""
+    ended = (
+        await session.exec(
+            END_CHECKOUT.where(condition).values(returned_date=returned_date)
+        )
+    ).first()
+    if ended is None:
+        return None
+    released = (
+        await session.exec(RELEASE_COPY.where(col(Copy.id) == ended.copy_id))
+    ).first()
+    if released is not None:
+        await update_copy_counters(session, released.book_id, available=1)
+    return ended
+
+
+async def _return_copy(session: AsyncSession, barcode: str) -> Checkout:
+    copy = await barcodes.first(session, barcode, select(Copy))
+    if copy is None:
+        raise HTTPException(
+            status_code=404, detail=f"Copy with barcode {barcode} not found"
+        )
+    # A copy has a single open checkout (see Checkout.__table_args__).
+    ended = await _end_checkout(session, Checkout.copy_id == copy.id, date.today())
+    if ended is None:
+        raise HTTPException(
+            status_code=404, detail=f"Copy with barcode {barcode} is not checked out"
+        )
+    await session.commit()
+    await cache.invalidate(await books_keys(session, [copy.book_id]))
+    return await session.get(Checkout, ended.id)
+
+
 # Patch pour update partiellement une ressource au lieu de PUT.
 # Layout flat et layout src.
 
 
 @router.put("/checkout/{checkout_id}", response_model=CheckoutRead)
 async def update_checkout(
-    checkout_id: int, checkout: CheckoutUpdate, session: Session = Depends(get_db)
+    checkout_id: int, checkout: CheckoutUpdate, session: AsyncSession = Depends(get_db)
 ):
-    db_checkout = session.get(Checkout, checkout_id)
+    db_checkout = await session.get(
+        Checkout, checkout_id, options=[joinedload(Checkout.copy_item)]
+    )
     if not db_checkout:
         raise HTTPException(
             status_code=404, detail=f"Checkout id {checkout_id} not found"
         )
+    if checkout.returned_date and checkout.returned_date <= date.today():
+        # Only the request which ends the loan releases the copy, see _end_checkout.
+        await _end_checkout(
+            session, col(Checkout.id) == checkout_id, checkout.returned_date
+        )
     checkout_data = checkout.model_dump(exclude_unset=True)
     for key, value in checkout_data.items():
         setattr(db_checkout, key, value)
-    if checkout.returned_date and checkout.returned_date <= date.today():
-        db_checkout.copy_item.is_available = True
+    copy_item = db_checkout.copy_item
     session.add(db_checkout)
-    session.commit()
-    session.refresh(db_checkout)
+    await session.commit()
+    await cache.invalidate(await books_keys(session, [copy_item.book_id]))
+    await session.refresh(db_checkout)
     return db_checkout
 
 
 @router.delete("/checkout/{checkout_id}", response_model=dict)
-async def delete_checkout(checkout_id: int, session: Session = Depends(get_db)):
-    db_checkout = session.get(Checkout, checkout_id)
+async def delete_checkout(checkout_id: int, session: AsyncSession = Depends(get_db)):
+    db_checkout = await session.get(Checkout, checkout_id)
     if not db_checkout:
         raise HTTPException(
             status_code=404, detail=f"Checkout id {checkout_id} not found"
@@ -106,6 +306,6 @@ async def delete_checkout(checkout_id: int, session: Session = Depends(get_db)):
                 f"Please make sure the book was returned before deleting the checkout"
             ),
         )
-    session.delete(db_checkout)
-    session.commit()
+    await session.delete(db_checkout)
+    await session.commit()
     return {"message": f"Checkout id {db_checkout.id} deleted successfully"}
@@ -1,76 +1,238 @@
-from typing import List
+from collections import Counter
+from typing import Any, Dict, List
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlmodel import Session, select
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    Security,
+)
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from db import get_db
+from availability import update_books_copy_counters, update_copy_counters
+from barcodes import get_barcode_cache
+from batch import LookupIds, LookupResult, lookup, query_ids
+from bulk import (
+    BulkError,
+    BulkResult,
+    BulkRows,
+    add_created,
+    insert_rows,
+    validate_rows,
+)
+from cache import books_keys, get_cache
+from db import get_db, get_read_db
+from etag import not_modified
+from fieldsets import Fieldset, Fieldsets
+from instrumentation import TimedRoute
 from models.models import (
     Book,
+    CheckoutHistory,
+    CheckoutRead,
     Copy,
     CopyCreate,
     CopyRead,
     CopyReadWithCheckouts,
     CopyUpdate,
 )
-from utils import VerifyToken
+from pagination import PageParams, paginate
+from utils import get_verifier
 
-auth = VerifyToken()
-router = APIRouter(dependencies=[Security(auth.verify, scopes=["admin"])])
+auth = get_verifier()
+cache = get_cache()
+barcodes = get_barcode_cache()
+router = APIRouter(
+    route_class=TimedRoute, dependencies=[Security(auth.verify, scopes=["admin"])]
+)
+
+# Fields and relationships of the responses: get_copy embeds the checkouts by default,
+# loaded with a 2nd query, and the archived ones with include_history, see fieldsets.py.
+COPY_FIELDSETS = Fieldsets(
+    Copy, CopyRead, archives={"checkouts": CheckoutHistory}, checkouts=CheckoutRead
+)
 
 
 @router.get("/copies/", response_model=List[CopyRead])
-async def get_all_copys(session: Session = Depends(get_db)):
-    all_copys = session.exec(select(Copy)).all()
-    return all_copys
+async def get_all_copys(
+    request: Request,
+    page: PageParams = Depends(),
+    fieldset: Fieldset = Depends(COPY_FIELDSETS.listing),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await paginate(session, fieldset, page, request)
+
+
+@router.get("/copies/lookup", response_model=LookupResult[CopyRead])
+async def get_copies_by_ids(
+    ids: List[int] = Depends(query_ids), session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Copy, CopyRead, ids)
+
+
+@router.post("/copies/lookup", response_model=LookupResult[CopyRead])
+async def post_copies_by_ids(
+    body: LookupIds, session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Copy, CopyRead, body.ids)
 
 
 @router.get("/copy/{copy_id}", response_model=CopyReadWithCheckouts)
-async def get_copy(copy_id: int, session: Session = Depends(get_db)):
-    db_copy = session.get(Copy, copy_id)
-    if not db_copy:
-        raise HTTPException(status_code=404, detail=f"Copy id {copy_id} not found")
-    return db_copy
+async def get_copy(
+    copy_id: int,
+    request: Request,
+    include_history: bool = Query(False, description="Also the archived checkouts"),
+    fieldset: Fieldset = Depends(COPY_FIELDSETS.detail),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await fieldset.detail_response(
+        session, copy_id, request, include_history=include_history
+    )
+
+
+@router.get("/copy/by-barcode/{barcode}", response_model=CopyReadWithCheckouts)
+async def get_copy_by_barcode(
+    barcode: str,
+    request: Request,
+    include_history: bool = Query(False, description="Also the archived checkouts"),
+    fieldset: Fieldset = Depends(COPY_FIELDSETS.detail),
+    session: AsyncSession = Depends(get_read_db),
+):
+    """The copy with the scanned `barcode`, see barcodes.py."""
+    row = await barcodes.first(session, barcode, fieldset.select())
+    if row is None:
+        raise HTTPException(
+            status_code=404, detail=f"Copy with barcode {barcode} not found"
+        )
+    body, headers = await fieldset.dump(session, row, include_history)
+    if response := not_modified(request, headers):
+        return response
+    return Response(body, headers=headers, media_type="application/json")
 
 
-def _get_book(session: Session, book_id: int):
-    book = session.get(Book, book_id)
+async def _get_book(session: AsyncSession, book_id: int):
+    book = await session.get(Book, book_id)
     if not book:
         raise HTTPException(status_code=404, detail=f"Book id {book_id} not found")
     return book
 
 
 @router.post("/copy/", response_model=CopyRead)
-async def create_copy(copy: CopyCreate, session: Session = Depends(get_db)):
-    book = _get_book(session, copy.book_id)
+async def create_copy(copy: CopyCreate, session: AsyncSession = Depends(get_db)):
+    book = await _get_book(session, copy.book_id)
     db_copy = Copy.model_validate(copy)
     db_copy.book = book
     session.add(db_copy)
-    session.commit()
-    session.refresh(db_copy)
+    await update_copy_counters(
+        session, copy.book_id, total=1, available=int(copy.is_available)
+    )
+    await session.commit()
+    await cache.invalidate(await books_keys(session, [copy.book_id]))
+    await session.refresh(db_copy)
     return db_copy
 
 
+@router.post("/copies/bulk", response_model=BulkResult)
+async def create_copies(
+    rows: List[Dict[str, Any]] = BulkRows, session: AsyncSession = Depends(get_db)
+):
+    result = BulkResult()
+    copies = validate_rows(rows, CopyCreate, result)
+
+    # The books and the existing barcodes of the whole batch are fetched at once.
+    books_ids = set(
+        (
+            await session.exec(
+                select(Book.id).filter(
+                    col(Book.id).in_({copy.book_id for _, copy in copies})
+                )
+            )
+        ).all()
+    )
+    barcodes = set(
+        (
+            await session.exec(
+                select(Copy.barcode).filter(
+                    col(Copy.barcode).in_([copy.barcode for _, copy in copies])
+                )
+            )
+        ).all()
+    )
+
+    indexes, copy_rows = [], []
+    for index, copy in copies:
+        if copy.book_id not in books_ids:
+            detail = f"Book id {copy.book_id} not found"
+        elif copy.barcode in barcodes:
+            detail = f"Copy with barcode {copy.barcode} already exists"
+        else:
+            barcodes.add(copy.barcode)
+            indexes.append(index)
+            copy_rows.append(copy.model_dump())
+            continue
+        result.errors.append(BulkError(index=index, detail=detail))
+
+    ids = await insert_rows(session, Copy, copy_rows)
+    totals = Counter(row["book_id"] for row in copy_rows)
+    availables = Counter(row["book_id"] for row in copy_rows if row["is_available"])
+    await update_books_copy_counters(
+        session,
+        {book_id: (total, availables[book_id]) for book_id, total in totals.items()},
+    )
+    await session.commit()
+    await cache.invalidate(await books_keys(session, totals))
+    add_created(result, indexes, ids)
+    return result
+
+
 @router.put("/copy/{copy_id}", response_model=CopyRead)
 async def update_copy(
-    copy_id: int, copy: CopyUpdate, session: Session = Depends(get_db)
+    copy_id: int, copy: CopyUpdate, session: AsyncSession = Depends(get_db)
 ):
-    db_copy = session.get(Copy, copy_id)
+    db_copy = await session.get(Copy, copy_id)
     if not db_copy:
         raise HTTPException(status_code=404, detail=f"Copy id {copy_id} not found")
+    previous_book_id, was_available = db_copy.book_id, db_copy.is_available
+    previous_barcode = db_copy.barcode
     copy_data = copy.model_dump(exclude_unset=True)
     for key, value in copy_data.items():
         setattr(db_copy, key, value)
     session.add(db_copy)
-    session.commit()
-    session.refresh(db_copy)
+    if db_copy.book_id == previous_book_id:
+        await update_copy_counters(
+            session,
+            db_copy.book_id,
+            available=int(db_copy.is_available) - int(was_available),
+        )
+    else:
+        await update_copy_counters(
+            session, previous_book_id, total=-1, available=-int(was_available)
+        )
+        await update_copy_counters(
+            session, db_copy.book_id, total=1, available=int(db_copy.is_available)
+        )
+    await session.commit()
+    barcodes.discard(previous_barcode)
+    await cache.invalidate(
+        await books_keys(session, {previous_book_id, db_copy.book_id})
+    )
+    await session.refresh(db_copy)
     return db_copy
 
 
 @router.delete("/copy/{copy_id}", response_model=dict)
-async def delete_copy(copy_id: int, session: Session = Depends(get_db)):
-    db_copy = session.get(Copy, copy_id)
+async def delete_copy(copy_id: int, session: AsyncSession = Depends(get_db)):
+    db_copy = await session.get(Copy, copy_id)
     if not db_copy:
         raise HTTPException(status_code=404, detail=f"Copy id {copy_id} not found")
-    session.delete(db_copy)
-    session.commit()
+    await session.delete(db_copy)
+    await update_copy_counters(
+        session, db_copy.book_id, total=-1, available=-int(db_copy.is_available)
+    )
+    await session.commit()
+    barcodes.discard(db_copy.barcode)
+    await cache.invalidate(await books_keys(session, [db_copy.book_id]))
     return {"message": f"Copy id {db_copy.id} deleted successfully"}
@@ -0,0 +1,36 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, Security
+from fastapi.responses import StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db import get_db
+from export import ExportFormat, ExportName, export_gzip
+from instrumentation import TimedRoute
+from utils import get_verifier
+
+auth = get_verifier()
+router = APIRouter(
+    route_class=TimedRoute, dependencies=[Security(auth.verify, scopes=["admin"])]
+)
+
+
+@router.get("/export/{name}", response_class=StreamingResponse)
+async def export_table(
+    name: ExportName,
+    format: ExportFormat = "csv",
+    updated_since: Optional[datetime] = Query(
+        None, description="Only the rows created or updated since this date"
+    ),
+    session: AsyncSession = Depends(get_db),
+):
+    # Read on the primary: a replica lagging behind would make the next export
+    # `updated_since` this one miss the rows it hasn't replayed yet.
+    # The session of the route is closed before the response is sent, the rows are
+    # streamed with their own connection.
+    return StreamingResponse(
+        export_gzip(session.bind, name, format, updated_since),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}.gz"'},
+    )
@@ -1,71 +1,137 @@
-from typing import List
+from typing import Any, Dict, List
 
-from fastapi import APIRouter, Depends, HTTPException, Security
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Security
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from db import get_db
+from batch import LookupIds, LookupResult, lookup, query_ids
+from bulk import BulkResult, BulkRows, add_created, insert_rows, validate_rows
+from db import get_db, get_read_db
+from fieldsets import Fieldset, Fieldsets
+from instrumentation import TimedRoute
 from models.models import (
+    CheckoutHistory,
+    CheckoutRead,
     Member,
     MemberCreate,
     MemberRead,
     MemberReadWithCheckouts,
     MemberUpdate,
 )
-from utils import VerifyToken
+from pagination import PageParams, paginate
+from utils import get_verifier
 
-auth = VerifyToken()
-router = APIRouter(dependencies=[Security(auth.verify, scopes=["admin"])])
+auth = get_verifier()
+router = APIRouter(
+    route_class=TimedRoute, dependencies=[Security(auth.verify, scopes=["admin"])]
+)
+
+# Fields and relationships of the responses: get_member embeds the checkouts by default,
+# loaded with a 2nd query, and the archived ones with include_history, see fieldsets.py.
+MEMBER_FIELDSETS = Fieldsets(
+    Member,
+    MemberRead,
+    archives={"member_checkouts": CheckoutHistory},
+    member_checkouts=CheckoutRead,
+)
 
 
 @router.get("/members/", response_model=List[MemberRead])
-async def get_all_members(session: Session = Depends(get_db)):
-    all_members = session.exec(select(Member)).all()
-    return all_members
+async def get_all_members(
+    request: Request,
+    page: PageParams = Depends(),
+    fieldset: Fieldset = Depends(MEMBER_FIELDSETS.listing),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await paginate(session, fieldset, page, request)
+
+
+@router.get("/members/lookup", response_model=LookupResult[MemberRead])
+async def get_members_by_ids(
+    ids: List[int] = Depends(query_ids), session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Member, MemberRead, ids)
+
+
+@router.post("/members/lookup", response_model=LookupResult[MemberRead])
+async def post_members_by_ids(
+    body: LookupIds, session: AsyncSession = Depends(get_read_db)
+):
+    return await lookup(session, Member, MemberRead, body.ids)
 
 
 @router.get("/member/{member_id}", response_model=MemberReadWithCheckouts)
-async def get_member(member_id: int, session: Session = Depends(get_db)):
-    db_member = session.get(Member, member_id)
-    if not db_member:
-        raise HTTPException(status_code=404, detail=f"Member id {member_id} not found")
-    return db_member
+async def get_member(
+    member_id: int,
+    request: Request,
+    include_history: bool = Query(False, description="Also the archived checkouts"),
+    fieldset: Fieldset = Depends(MEMBER_FIELDSETS.detail),
+    session: AsyncSession = Depends(get_read_db),
+):
+    return await fieldset.detail_response(
+        session, member_id, request, include_history=include_history
+    )
 
 
 @router.post("/member/", response_model=MemberRead)
-async def create_member(member: MemberCreate, session: Session = Depends(get_db)):
+async def create_member(member: MemberCreate, session: AsyncSession = Depends(get_db)):
     db_member = Member.model_validate(member)
     session.add(db_member)
-    session.commit()
-    session.refresh(db_member)
+    await session.commit()
+    await session.refresh(db_member)
     return db_member
 
 
+@router.post("/members/bulk", response_model=BulkResult)
+async def create_members(
+    rows: List[Dict[str, Any]] = BulkRows, session: AsyncSession = Depends(get_db)
+):
+    result = BulkResult()
+    members = validate_rows(rows, MemberCreate, result)
+    ids = await insert_rows(
+        session, Member, [member.model_dump() for _, member in members]
+    )
+    await session.commit()
+    add_created(result, [index for index, _ in members], ids)
+    return result
+
+
 @router.put("/member/{member_id}", response_model=MemberRead)
 async def update_member(
-    member_id: int, member: MemberUpdate, session: Session = Depends(get_db)
+    member_id: int, member: MemberUpdate, session: AsyncSession = Depends(get_db)
 ):
-    db_member = session.get(Member, member_id)
+    db_member = await session.get(Member, member_id)
     if not db_member:
         raise HTTPException(status_code=404, detail=f"Member id {member_id} not found")
     member_data = member.model_dump(exclude_unset=True)
     for key, value in member_data.items():
         setattr(db_member, key, value)
     session.add(db_member)
-    session.commit()
-    session.refresh(db_member)
+    await session.commit()
+    await session.refresh(db_member)
     return db_member
 
 
+async def _has_archived_checkouts(session: AsyncSession, member_id: int) -> bool:
+    query = select(CheckoutHistory.id).where(CheckoutHistory.member_id == member_id)
+    return (await session.exec(query.limit(1))).first() is not None
+
+
 @router.delete("/member/{member_id}", response_model=dict)
-async def delete_member(member_id: int, session: Session = Depends(get_db)):
-    db_member = session.get(Member, member_id)
-    if db_member and db_member.member_checkouts:
+async def delete_member(member_id: int, session: AsyncSession = Depends(get_db)):
+    db_member = await session.get(
+        Member, member_id, options=[selectinload(Member.member_checkouts)]
+    )
+    if db_member and (
+        db_member.member_checkouts or await _has_archived_checkouts(session, member_id)
+    ):
         raise HTTPException(
             status_code=404,
             detail="Member has checkouts. Please consider deactivating him instead.",
         )
     if not db_member:
         raise HTTPException(status_code=404, detail=f"Member id {member_id} not found")
-    session.delete(db_member)
-    session.commit()
+    await session.delete(db_member)
+    await session.commit()
     return {"message": f"Member id {db_member.id} deleted successfully"}
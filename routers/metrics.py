@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Security
+from fastapi.responses import PlainTextResponse
+
+from barcodes import get_barcode_cache
+from cache import get_cache
+from db import engine, get_pool_metrics, replica_router
+from instrumentation import TimedRoute, route_metrics
+from utils import get_verifier
+
+auth = get_verifier()
+router = APIRouter(
+    route_class=TimedRoute, dependencies=[Security(auth.verify, scopes=["admin"])]
+)
+
+
+@router.get("/metrics/db", response_model=dict)
+async def get_db_metrics():
+    return {**get_pool_metrics(engine), "replicas": replica_router.metrics()}
+
+
+@router.get("/metrics/cache", response_model=dict)
+async def get_cache_metrics():
+    return get_cache().metrics()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Requests, latency, SQL statements and serialization time per route, and the
+    state of the pool and of the caches, in the Prometheus text format."""
+    pool = get_pool_metrics(engine)
+    cache = get_cache()
+    barcodes = get_barcode_cache()
+    gauges = {
+        "library_db_pool_checked_out": pool["checked_out"],
+        "library_db_pool_saturation": pool["saturation"],
+        "library_db_pool_wait_max_seconds": pool["wait_max_ms"] / 1000,
+        "library_cache_hits": cache.hits,
+        "library_cache_misses": cache.misses,
+        "library_barcode_cache_hits": barcodes.hits,
+        "library_barcode_cache_misses": barcodes.misses,
+    }
+    return PlainTextResponse(
+        route_metrics.prometheus(gauges),
+        media_type="text/plain; version=0.0.4",
+    )
@@ -0,0 +1,39 @@
+"""
+Full-text search of the books on the `search_text` column, see the Search section of
+models/models.py for the indexes used on PostgreSQL and SQLite.
+"""
+
+from sqlalchemy import column, func, literal, literal_column, or_, table
+
+from models.models import SEARCH_CONFIG, Book, normalize_search_text
+
+# Only exists on PostgreSQL, see models/models.py.
+search_vector = literal_column("books.search_vector")
+books_fts = table("books_fts", column("rowid"), column("rank"))
+
+
+def search_books_query(query, dialect: str, words: str):
+    """Filters `query` (a select of Book) on the books matching all the `words`,
+    even partially typed or without their accents, the most relevant first. Without
+    any word (e.g. only punctuation), all the books by id."""
+    terms = normalize_search_text(words).split()
+    if not terms:
+        return query.order_by(Book.id)
+
+    if dialect == "postgresql":
+        tsquery = func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{t}:*" for t in terms))
+        # The trigram index finds the titles and names with a typo, e.g. "orwel".
+        similar = literal(" ".join(terms)).op("<%")(Book.search_text)
+        rank = func.ts_rank(search_vector, tsquery) + func.word_similarity(
+            " ".join(terms), Book.search_text
+        )
+        return query.where(or_(search_vector.op("@@")(tsquery), similar)).order_by(
+            rank.desc(), Book.id
+        )
+
+    fts_query = " ".join(f'"{term}"*' for term in terms)
+    return (
+        query.join(books_fts, books_fts.c.rowid == Book.id)
+        .where(literal_column("books_fts").op("MATCH")(fts_query))
+        .order_by(books_fts.c.rank, Book.id)
+    )
@@ -0,0 +1,39 @@
+"""
+JSON of the list routes. What a route returns is validated by FastAPI against its
+`response_model` (from the attributes of the ORM objects), converted to Python types
+and only then encoded: three passes over every row. The list routes select the columns
+of their read model instead and encode the row tuples with orjson, as dicts keyed by
+the fields of the model: the database already typed the values, and building the
+SQLModel instances, even with `model_construct`, costs as much as their validation
+(see benchmarks/serialization.py). The other routes are encoded with orjson too, see
+`create_app` in app.py.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+import orjson
+from fastapi import Response
+from sqlmodel import SQLModel, select
+
+
+def read_select(model: Type[SQLModel], read_model: Type[SQLModel], *extra):
+    """Select of the columns of `model` read by `read_model`, in the order of its
+    fields, followed by the `extra` columns (which aren't part of the response)."""
+    return select(*(getattr(model, name) for name in read_model.model_fields), *extra)
+
+
+def read_rows(fields: Iterable[str], rows: Iterable) -> List[dict]:
+    """The rows of `read_select` as dicts of their `fields`, the ones the read model
+    would be dumped to."""
+    fields = list(fields)
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def ndjson_lines(items: Iterable[dict]) -> bytes:
+    return b"".join(orjson.dumps(item) + b"\n" for item in items)
+
+
+def json_response(content: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(
+        orjson.dumps(content), headers=headers, media_type="application/json"
+    )
@@ -115,6 +115,8 @@ def create_copies(engine):
         session.add(deadpond_copy)
         session.add(rusty_man_copy)
         session.add(lonely_copy)
+        deadpond.total_copies, deadpond.available_copies = 1, 1
+        rusty_man.total_copies, rusty_man.available_copies = 2, 0
         session.commit()
 
 
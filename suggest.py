@@ -0,0 +1,199 @@
+"""
+Suggestions of the search box: the titles and the author names starting with the typed
+text, read from an index in memory instead of a search query per keystroke.
+
+The index is an array of the normalized texts (see normalize_search_text), sorted and
+searched with bisect. It is loaded in the background when the app starts, the
+suggestions come from the search query meanwhile. The routes writing the books and the
+authors then update it once their transaction is committed. Each worker has its own
+index, the changes made through another worker only appear after a restart.
+"""
+
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import SQLModel, select
+
+from models.models import Author, Book, normalize_search_text
+from pagination import STREAM_BATCH_SIZE
+
+
+@lru_cache(maxsize=100_000)
+def _normalize_word(word: str) -> str:
+    return normalize_search_text(word)
+
+
+def normalize(text: str) -> str:
+    """normalize_search_text word by word, the words repeat from a title to another
+    and the load of the index spends most of its time normalizing."""
+    return " ".join(filter(None, map(_normalize_word, text.split())))
+
+
+class Suggestion(SQLModel):
+    kind: Literal["book", "author"]
+    id: int
+    text: str
+
+
+class SuggestIndex:
+    """Sorted keys of the books (their title) and authors ("first last" and "last
+    first"), with in `_refs` the id of the book, or the opposite of the id of the
+    author. The refs of a same key are sorted too."""
+
+    def __init__(self):
+        self.ready = False
+        self._keys: List[str] = []
+        self._refs: List[int] = []
+        # Displayed text of each ref.
+        self._texts: Dict[int, str] = {}
+        self._author_keys: Dict[int, Tuple[str, ...]] = {}
+        # Changes made while the index is loaded, applied afterwards.
+        self._pending: Optional[List[Tuple[int, Optional[str], Tuple[str, ...]]]] = None
+
+    @staticmethod
+    def _author(first_name: str, last_name: str) -> Tuple[str, Tuple[str, ...]]:
+        keys = (
+            normalize(f"{first_name} {last_name}"),
+            normalize(f"{last_name} {first_name}"),
+        )
+        return f"{first_name} {last_name}", keys
+
+    def _keys_of(self, ref: int) -> Tuple[str, ...]:
+        if ref < 0:
+            return self._author_keys[ref]
+        return (normalize(self._texts[ref]),)
+
+    def _insert(self, key: str, ref: int):
+        start = bisect_left(self._keys, key)
+        end = bisect_right(self._keys, key, start)
+        index = bisect_left(self._refs, ref, start, end)
+        self._keys.insert(index, key)
+        self._refs.insert(index, ref)
+
+    def _remove(self, key: str, ref: int):
+        start = bisect_left(self._keys, key)
+        end = bisect_right(self._keys, key, start)
+        index = bisect_left(self._refs, ref, start, end)
+        if index < end and self._refs[index] == ref:
+            del self._keys[index]
+            del self._refs[index]
+
+    def _apply(self, ref: int, text: Optional[str], keys: Tuple[str, ...]):
+        if ref in self._texts:
+            for key in self._keys_of(ref):
+                self._remove(key, ref)
+            del self._texts[ref]
+            self._author_keys.pop(ref, None)
+        if text is None:
+            return
+        self._texts[ref] = text
+        if ref < 0:
+            self._author_keys[ref] = keys
+        for key in keys:
+            self._insert(key, ref)
+
+    def _change(self, ref: int, text: Optional[str], keys: Tuple[str, ...] = ()):
+        if self._pending is not None:
+            self._pending.append((ref, text, keys))
+        else:
+            self._apply(ref, text, keys)
+
+    def add_book(self, book_id: int, title: str):
+        """Adds the book, or updates its title."""
+        self._change(book_id, title, (normalize(title),))
+
+    def remove_book(self, book_id: int):
+        self._change(book_id, None)
+
+    def add_author(self, author_id: int, first_name: str, last_name: str):
+        """Adds the author, or updates their name."""
+        self._change(-author_id, *self._author(first_name, last_name))
+
+    def remove_author(self, author_id: int):
+        self._change(-author_id, None)
+
+    def _fill(self, rows: Iterable[Tuple], authors: bool, entries: list):
+        for id, *names in rows:
+            if authors:
+                text, keys = self._author(*names)
+                self._author_keys[-id] = keys
+                self._texts[-id] = text
+                entries += [(key, -id) for key in keys]
+            else:
+                self._texts[id] = names[0]
+                entries.append((normalize(names[0]), id))
+
+    def _sort(self, entries: List[Tuple[str, int]]):
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._refs = [ref for _, ref in entries]
+        self.ready = True
+
+    def build(self, books: Iterable[Tuple[int, str]], authors: Iterable[Tuple]):
+        """Replaces the index with the (id, title) of the `books` and the (id,
+        first_name, last_name) of the `authors`."""
+        self._texts, self._author_keys, entries = {}, {}, []
+        self._fill(books, False, entries)
+        self._fill(authors, True, entries)
+        self._sort(entries)
+
+    async def load(self, engine: AsyncEngine):
+        """Loads the books and authors of the database. They are read in batches,
+        the other requests are served in between."""
+        loaded = SuggestIndex()
+        entries: List[Tuple[str, int]] = []
+        self._pending = []
+        try:
+            async with engine.connect() as conn:
+                for query, authors in [
+                    (select(Book.id, Book.title), False),
+                    (select(Author.id, Author.first_name, Author.last_name), True),
+                ]:
+                    result = await conn.stream(
+                        query.execution_options(yield_per=STREAM_BATCH_SIZE)
+                    )
+                    async for rows in result.partitions():
+                        loaded._fill(rows, authors, entries)
+            loaded._sort(entries)
+            self._keys, self._refs = loaded._keys, loaded._refs
+            self._texts, self._author_keys = loaded._texts, loaded._author_keys
+            self.ready = True
+        finally:
+            pending, self._pending = self._pending, None
+            for change in pending:
+                self._apply(*change)
+
+    def suggest(self, text: str, limit: int = 10) -> List[dict]:
+        """The books and authors whose normalized text starts with the one of `text`,
+        in alphabetical order."""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        if text[-1].isspace():
+            # The last word is complete.
+            prefix += " "
+        refs: Dict[int, None] = {}
+        index = bisect_left(self._keys, prefix)
+        while (
+            len(refs) < limit
+            and index < len(self._keys)
+            and self._keys[index].startswith(prefix)
+        ):
+            refs[self._refs[index]] = None
+            index += 1
+        return [
+            {
+                "kind": "author" if ref < 0 else "book",
+                "id": abs(ref),
+                "text": self._texts[ref],
+            }
+            for ref in refs
+        ]
+
+
+@lru_cache()
+def get_suggest_index() -> SuggestIndex:
+    """The index shared by the routers, loaded by the lifespan of the app."""
+    return SuggestIndex()
@@ -0,0 +1,11 @@
+import asyncio
+
+import pytest
+
+from cache import get_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # The response cache is shared by the app of every test, see cache.py.
+    asyncio.run(get_cache().clear())
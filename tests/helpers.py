@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+@contextmanager
+def assert_max_queries(engine, max_queries: int):
+    """Fails if more than `max_queries` SQL statements are run on the (async) `engine`
+    inside the block, to catch the N+1 queries of the routes."""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count)
+    assert (
+        len(statements) <= max_queries
+    ), f"{len(statements)} queries instead of {max_queries} at most:\n" + "\n".join(
+        statements
+    )
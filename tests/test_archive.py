@@ -0,0 +1,130 @@
+import asyncio
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import app
+from archive import archive_checkouts
+from db import get_db, get_read_db
+from models.models import Checkout, CheckoutHistory
+from routers.member import auth
+from setup import (
+    create_authors_and_books,
+    create_checkouts,
+    create_copies,
+    create_members,
+)
+from tests.helpers import assert_max_queries
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+
+
+@pytest.fixture()
+def session():
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    create_authors_and_books(engine)
+    create_members(engine)
+    create_copies(engine)
+    create_checkouts(engine)
+    with Session(engine) as db:
+        # John returned the copy 1 in 2021, then borrowed and returned it again.
+        db.add(
+            Checkout(
+                checkout_date=date(2024, 5, 1),
+                expected_return_date=date(2024, 5, 15),
+                returned_date=date(2024, 5, 10),
+                member_id=1,
+                copy_id=1,
+            )
+        )
+        db.commit()
+        yield db
+
+
+@pytest.fixture()
+def client(session):
+    async def override_get_db():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[auth.verify] = lambda: True
+
+    yield TestClient(app)
+
+
+def checkout_ids(session, model):
+    return session.exec(select(model.id).order_by(model.id)).all()
+
+
+def test_archive_moves_the_returned_checkouts(session):
+    archived = asyncio.run(archive_checkouts(async_engine, date(2024, 1, 1)))
+    assert archived == 1
+    assert checkout_ids(session, Checkout) == [2, 3]
+    history = session.exec(select(CheckoutHistory)).one()
+    assert (history.id, history.checkout_date) == (1, date(2021, 1, 1))
+    assert history.returned_date == date(2021, 1, 10)
+    assert history.updated_at is not None
+
+    # Neither the open checkout nor the already archived ones are moved.
+    assert asyncio.run(archive_checkouts(async_engine, date(2030, 1, 1), 1)) == 1
+    assert checkout_ids(session, Checkout) == [2]
+    assert checkout_ids(session, CheckoutHistory) == [1, 3]
+
+
+def test_archive_batches_follow_the_returned_dates(session):
+    for day in [20, 5, 12]:
+        session.add(
+            Checkout(
+                checkout_date=date(2023, 1, 1),
+                expected_return_date=date(2023, 2, 1),
+                returned_date=date(2023, 1, day),
+                member_id=2,
+                copy_id=3,
+            )
+        )
+    session.commit()
+
+    with assert_max_queries(async_engine, 100) as statements:
+        assert asyncio.run(archive_checkouts(async_engine, date(2024, 1, 1), 1)) == 4
+    assert checkout_ids(session, Checkout) == [2, 3]
+    assert checkout_ids(session, CheckoutHistory) == [1, 4, 5, 6]
+    # Each batch starts after the last checkout of the previous one.
+    batches = [s for s in statements if "ORDER BY checkouts.returned_date" in s]
+    assert len(batches) == 5
+    assert all("(checkouts.returned_date, checkouts.id) >" in s for s in batches[1:])
+
+
+def test_detail_routes_include_the_history_on_demand(client):
+    asyncio.run(archive_checkouts(async_engine, date(2024, 1, 1)))
+
+    member = client.get("/member/1").json()
+    assert [checkout["id"] for checkout in member["member_checkouts"]] == [3]
+    member = client.get("/member/1", params={"include_history": True}).json()
+    assert [checkout["id"] for checkout in member["member_checkouts"]] == [1, 3]
+    assert member["member_checkouts"][0]["returned_date"] == "2021-01-10"
+
+    copy = client.get("/copy/1").json()
+    assert [checkout["id"] for checkout in copy["checkouts"]] == [3]
+    copy = client.get("/copy/1", params={"include_history": True}).json()
+    assert [checkout["id"] for checkout in copy["checkouts"]] == [1, 3]
+
+
+def test_member_with_archived_checkouts_cannot_be_deleted(client):
+    asyncio.run(archive_checkouts(async_engine, date(2030, 1, 1)))
+    response = client.delete("/member/1")
+    assert response.status_code == 404
+    assert "checkouts" in response.json()["detail"]
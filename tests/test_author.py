@@ -4,10 +4,13 @@ from datetime import date
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import app
-from db import get_db
+from db import get_db, get_read_db
 from models.models import Author, AuthorCreate, Book
 from routers.author import auth
 from setup import (
@@ -16,12 +19,16 @@ from setup import (
     create_copies,
     create_members,
 )
+from tests.helpers import assert_max_queries
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# The routes use an AsyncSession while the tests check the results synchronously.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
 TestingSessionLocal = Session(autocommit=False, autoflush=False, bind=engine)
 
 # conftest.py pour setup les fixtures communes à tous les tests
@@ -48,13 +55,15 @@ def session():
 def client(session):
 
     # Dependency override
-    def override_get_db():
+    async def override_get_db():
         try:
-            yield session
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                yield db
         finally:
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     app.dependency_overrides[auth.verify] = lambda: True
 
     yield TestClient(app)
@@ -78,11 +87,27 @@ def test_get_author_success(client):
                 "language": "English",
                 "publication_date": "2018-01-01",
                 "title": "Deadpond",
+                "total_copies": 1,
+                "available_copies": 1,
             },
         ],
     }
 
 
+def test_get_author_query_count(client):
+    with assert_max_queries(async_engine, 2):
+        response = client.get("/author/1")
+    assert response.status_code == 200
+    assert len(response.json()["books"]) == 1
+
+
+def test_get_author_cached(client):
+    books = client.get("/author/1").json()["books"]
+    client.put(f"/book/{books[0]['id']}", json={"title": "Animal Farm 2"})
+    response = client.get("/author/1")
+    assert "Animal Farm 2" in [book["title"] for book in response.json()["books"]]
+
+
 def test_create_author_success(client, session: Session):
     new_author = AuthorCreate(
         first_name="JK",
@@ -104,6 +129,32 @@ def test_create_author_success(client, session: Session):
     assert author.date_of_death == new_author.date_of_death
 
 
+def test_create_authors_bulk(client, session: Session):
+    author = {
+        "first_name": "JK",
+        "last_name": "Rowling",
+        "nationality": "English",
+        "date_of_birth": "1965-07-31",
+    }
+    rows = [
+        author,
+        {**author, "date_of_birth": "unknown"},
+        {**author, "first_name": "Jo"},
+    ]
+    response = client.post("/authors/bulk", json=rows)
+    assert response.status_code == 200
+    assert response.json()["created"] == [{"index": 0, "id": 3}, {"index": 2, "id": 4}]
+    assert [error["index"] for error in response.json()["errors"]] == [1]
+
+    authors = session.exec(select(Author).filter(Author.last_name == "Rowling")).all()
+    assert [author.first_name for author in authors] == ["JK", "Jo"]
+
+
+def test_create_authors_bulk_too_many_rows(client):
+    response = client.post("/authors/bulk", json=[{}] * 10_001)
+    assert response.status_code == 422
+
+
 def test_update_author_success(client, session):
     author_before_update = session.get(Author, 1)
     author_before_update = cp.deepcopy(author_before_update)
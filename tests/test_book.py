@@ -3,24 +3,32 @@ import json
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import app
-from db import get_db
+from db import get_db, get_read_db
 from models.models import Book, BookCreate
 from routers.book import auth
+from search import search_books_query
 from setup import (
     create_authors_and_books,
     create_checkouts,
     create_copies,
     create_members,
 )
+from tests.helpers import assert_max_queries
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# The routes use an AsyncSession while the tests check the results synchronously.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
 TestingSessionLocal = Session(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -45,24 +53,246 @@ def session():
 def client(session):
 
     # Dependency override
-    def override_get_db():
+    async def override_get_db():
         try:
-            yield session
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                yield db
         finally:
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     app.dependency_overrides[auth.verify] = lambda: True
 
     yield TestClient(app)
 
 
+def test_get_all_books_paginated(client):
+    response = client.get("/books/", params={"limit": 2})
+    assert response.status_code == 200
+    assert [book["id"] for book in response.json()] == [1, 2]
+    assert response.links["next"]["url"].endswith("/books/?limit=2&after=2")
+
+    response = client.get(response.links["next"]["url"])
+    assert response.status_code == 200
+    assert [book["id"] for book in response.json()] == [3]
+    assert "next" not in response.links
+
+
+def test_get_all_books_ndjson(client):
+    response = client.get("/books/", params={"after": 1, "format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    books = [json.loads(line) for line in response.text.splitlines()]
+    assert [book["id"] for book in books] == [2, 3]
+    assert books[0]["title"] == "Hero Rusty"
+
+
+def test_get_books_by_ids(client):
+    with assert_max_queries(async_engine, 1):
+        response = client.get("/books/lookup", params={"ids": "3,99,1,3"})
+    assert response.status_code == 200
+    result = response.json()
+    assert [book and book["id"] for book in result["items"]] == [3, None, 1, 3]
+    assert result["items"][2]["title"] == "Deadpond"
+    assert result["not_found"] == [99]
+
+
+def test_get_books_by_invalid_ids(client):
+    response = client.get("/books/lookup", params={"ids": "1,two"})
+    assert response.status_code == 422
+    response = client.get("/books/lookup", params={"ids": ",".join(["1"] * 1001)})
+    assert response.status_code == 422
+
+
 def test_get_book_success(client):
     response = client.get("/book/1")
     assert response.status_code == 200
     assert response.json()["title"] == "Deadpond"
 
 
+def test_get_book_query_count(client):
+    with assert_max_queries(async_engine, 3):
+        response = client.get("/book/1")
+    assert response.status_code == 200
+    assert len(response.json()["authors"]) == 2
+    assert len(response.json()["copies"]) == 1
+
+
+def test_get_book_fields(client):
+    with assert_max_queries(async_engine, 2):
+        response = client.get(
+            "/book/1", params={"fields": "title", "expand": "authors"}
+        )
+    assert response.status_code == 200
+    book = response.json()
+    assert book.keys() == {"id", "title", "authors"}
+    assert [author["id"] for author in book["authors"]] == [1, 2]
+
+    with assert_max_queries(async_engine, 1):
+        response = client.get("/book/1", params={"expand": ""})
+    assert "authors" not in response.json() and "copies" not in response.json()
+
+
+def test_get_books_expanded(client):
+    with assert_max_queries(async_engine, 2):
+        response = client.get(
+            "/books/", params={"fields": "title,isbn", "expand": "copies"}
+        )
+    assert response.status_code == 200
+    books = response.json()
+    assert books[0].keys() == {"id", "title", "isbn", "copies"}
+    assert [len(book["copies"]) for book in books] == [1, 2, 0]
+
+
+def test_get_books_unknown_fields(client):
+    response = client.get("/books/", params={"fields": "title,price"})
+    assert response.status_code == 422
+    response = client.get("/book/1", params={"expand": "members"})
+    assert response.status_code == 422
+    response = client.get("/books/", params={"expand": "copies", "format": "ndjson"})
+    assert response.status_code == 422
+
+
+def test_get_book_cached(client):
+    assert client.get("/book/1").status_code == 200
+    with assert_max_queries(async_engine, 0):
+        response = client.get("/book/1")
+    assert response.json()["title"] == "Deadpond"
+
+    # Invalidated by the writers of the book, its copies and its authors.
+    client.put("/copy/1", json={"location": "Shelf 9"})
+    assert response.json()["copies"][0]["location"] != "Shelf 9"
+    assert client.get("/book/1").json()["copies"][0]["location"] == "Shelf 9"
+    client.put("/author/1", json={"last_name": "Blair"})
+    assert "Blair" in [a["last_name"] for a in client.get("/book/1").json()["authors"]]
+    client.put("/book/1", json={"title": "Deadpond 2"})
+    assert client.get("/book/1").json()["title"] == "Deadpond 2"
+    client.delete("/author/2")
+    assert len(client.get("/book/1").json()["authors"]) == 1
+
+
+def test_get_book_not_modified(client):
+    response = client.get("/book/1")
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    # The date of the last change would miss the removed copies and authors.
+    assert "last-modified" not in response.headers
+    response = client.get("/book/1", params={"expand": ""})
+    assert response.headers["last-modified"].endswith(" GMT")
+
+    # From the cache, then from the database.
+    response = client.get("/book/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    client.put("/author/2", json={"nationality": "French"})
+    response = client.get("/book/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    etag = response.headers["etag"]
+    assert client.post("/books/bulk", json=[]).status_code == 200
+    response = client.get("/book/1", headers={"If-None-Match": f'"other", {etag}'})
+    assert response.status_code == 304
+
+
+def test_list_books_not_modified_after_a_deletion(client):
+    response = client.get("/books/")
+    assert "last-modified" not in response.headers
+    etag = response.headers["etag"]
+    assert client.delete("/book/3").status_code == 200
+    response = client.get(
+        "/books/",
+        headers={
+            "If-None-Match": etag,
+            "If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT",
+        },
+    )
+    assert response.status_code == 200
+    response = client.get(
+        "/books/", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"}
+    )
+    assert response.status_code == 200
+
+
+def test_search_books_without_words(client):
+    # Only punctuation: no word to search, all the books in order.
+    for params in [{"q": "!!!"}, {"title": " - "}, {}]:
+        response = client.get("/books/search", params=params)
+        assert [book["id"] for book in response.json()] == [1, 2, 3]
+    response = client.get("/books/search", params={"q": "!!!", "limit": 2})
+    assert [book["id"] for book in response.json()] == [1, 2]
+    assert "offset=2" in response.headers["link"]
+    query = search_books_query(select(Book.id), "postgresql", "!!!")
+    assert str(query).endswith("ORDER BY books.id")
+
+
+def test_search_books_available(client):
+    response = client.get("/books/search", params={"available": True})
+    assert [book["id"] for book in response.json()] == [1]
+    assert response.json()[0]["available_copies"] == 1
+    response = client.get("/books/search", params={"available": False})
+    assert [book["id"] for book in response.json()] == [2, 3]
+
+
+def test_search_books_not_modified(client):
+    response = client.get("/books/search", params={"q": "dead"})
+    etag = response.headers["etag"]
+    response = client.get(
+        "/books/search", params={"q": "dead"}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    client.put("/book/1", json={"edition": "Second edition"})
+    response = client.get(
+        "/books/search", params={"q": "dead"}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+
+
+def test_search_books_facets(client):
+    response = client.get(
+        "/books/search", params={"facets": "available,author,language,decade"}
+    )
+    assert response.status_code == 200
+    assert [book["id"] for book in response.json()["items"]] == [1, 2, 3]
+    assert response.json()["facets"] == {
+        "language": [{"value": "English", "count": 3}],
+        "decade": [{"value": 2010, "count": 3}],
+        # Only the 1st book has authors.
+        "author": [
+            {"value": 1, "label": "George Orwell", "count": 1},
+            {"value": 2, "label": "Aldous Huxley", "count": 1},
+        ],
+        "available": [{"value": False, "count": 2}, {"value": True, "count": 1}],
+    }
+    assert "last-modified" not in response.headers
+
+    # The facets count all the matching books, not only the page.
+    response = client.get(
+        "/books/search", params={"available": False, "limit": 1, "facets": "language"}
+    )
+    assert [book["id"] for book in response.json()["items"]] == [2]
+    assert response.json()["facets"] == {"language": [{"value": "English", "count": 2}]}
+
+    response = client.get("/books/search", params={"facets": "publisher"})
+    assert response.status_code == 422
+
+
+def test_search_books_facets_are_cached(client):
+    params = {"q": "dead", "facets": "author"}
+    response = client.get("/books/search", params=params)
+    facets = response.json()["facets"]
+    assert [value["label"] for value in facets["author"]] == [
+        "George Orwell",
+        "Aldous Huxley",
+    ]
+    hits = client.get("/metrics/cache").json()["hits"]
+    assert client.get("/books/search", params=params).json()["facets"] == facets
+    assert client.get("/metrics/cache").json()["hits"] == hits + 1
+    # Another search has its own counts.
+    response = client.get("/books/search", params={"q": "hero", "facets": "author"})
+    assert response.json()["facets"] == {"author": []}
+
+
 def test_create_book_success(client, session):
     new_book = BookCreate(
         title="New Book",
@@ -84,6 +314,43 @@ def test_create_book_success(client, session):
     assert book.language == new_book.language
 
 
+def test_create_books_bulk(client, session):
+    book = {
+        "title": "Bulk Book",
+        "isbn": "000-0000000010",
+        "edition": "First edition",
+        "publication_date": "2023-01-01",
+        "language": "English",
+        "authors_ids": [1, 2],
+    }
+    rows = [
+        book,
+        {**book, "title": None, "isbn": "000-0000000011"},
+        {**book, "isbn": "000-0000000012", "authors_ids": [1, 999]},
+        {**book, "isbn": "000-0000000002"},
+        book,
+        {**book, "title": "Second Bulk Book", "isbn": "000-0000000013"},
+    ]
+    with assert_max_queries(async_engine, 5):
+        response = client.post("/books/bulk", json=rows)
+    assert response.status_code == 200
+    assert response.json()["created"] == [{"index": 0, "id": 4}, {"index": 5, "id": 5}]
+    errors = response.json()["errors"]
+    assert [error["index"] for error in errors] == [1, 2, 3, 4]
+    assert errors[1:] == [
+        {"index": 2, "detail": "No author with ids {999} found"},
+        {"index": 3, "detail": "Book with isbn 000-0000000002 already exists"},
+        {"index": 4, "detail": "Book with isbn 000-0000000010 already exists"},
+    ]
+    assert errors[0]["detail"][0]["loc"] == ["title"]
+
+    book = session.get(Book, 5)
+    assert book.title == "Second Bulk Book"
+    assert {author.id for author in book.authors} == {1, 2}
+    response = client.get("/books/search", params={"q": "second bulk"})
+    assert [book["id"] for book in response.json()] == [5]
+
+
 def test_update_book_success(client, session):
     book_before_update = session.get(Book, 1)
     book_before_update = cp.deepcopy(book_before_update)
@@ -153,3 +420,34 @@ def test_delete_nonexistent_book(client):
     response = client.delete("/book/999")
     assert response.status_code == 404
     assert response.json() == {"detail": "Book id 999 not found"}
+
+
+def test_search_books_by_title_prefix(client):
+    response = client.get("/books/search", params={"q": "dead"})
+    assert response.status_code == 200
+    assert [book["title"] for book in response.json()] == ["Deadpond"]
+
+
+def test_search_books_by_author_without_accents(client):
+    response = client.get("/books/search", params={"author_name": "ÓRWÉLL"})
+    assert response.status_code == 200
+    assert [book["title"] for book in response.json()] == ["Deadpond"]
+
+
+def test_search_books_after_author_update(client):
+    response = client.put("/author/2", json={"last_name": "Zoëlla"})
+    assert response.status_code == 200
+    response = client.get("/books/search", params={"q": "zoella"})
+    assert [book["title"] for book in response.json()] == ["Deadpond"]
+    response = client.get("/books/search", params={"q": "huxley"})
+    assert response.json() == []
+
+
+def test_search_books_paginated(client):
+    response = client.get(
+        "/books/search", params={"publication_year": 2018, "limit": 2}
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    response = client.get(response.links["next"]["url"])
+    assert [book["id"] for book in response.json()] == [3]
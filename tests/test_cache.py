@@ -0,0 +1,80 @@
+import asyncio
+import fnmatch
+
+from cache import MemoryBackend, RedisBackend, ResponseCache
+from models.models import AuthorRead
+
+
+class FakeRedis:
+    """The subset of redis.asyncio.Redis used by RedisBackend."""
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.ttls[key] = ex
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    async def scan_iter(self, match):
+        for key in list(self.values):
+            if fnmatch.fnmatch(key, match):
+                yield key
+
+
+def test_memory_backend_evicts_least_recently_used():
+    async def scenario():
+        backend = MemoryBackend(maxsize=2)
+        await backend.set("a", b"1")
+        await backend.set("b", b"2")
+        await backend.get("a")
+        await backend.set("c", b"3")
+        return [await backend.get(key) for key in ["a", "b", "c"]]
+
+    assert asyncio.run(scenario()) == [b"1", None, b"3"]
+
+
+def test_memory_backend_expires_entries():
+    async def scenario():
+        backend = MemoryBackend(ttl=0)
+        await backend.set("a", b"1")
+        return await backend.get("a")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_response_cache_with_redis_backend():
+    redis = FakeRedis()
+    cache = ResponseCache(RedisBackend(redis, ttl=60))
+    author = AuthorRead(
+        id=1,
+        first_name="George",
+        last_name="Orwell",
+        date_of_birth="1903-06-25",
+        nationality="English",
+    )
+
+    async def scenario():
+        assert await cache.get("author:1") is None
+        await cache.set("author:1", author)
+        response = await cache.get("author:1")
+        await cache.invalidate(["author:1", "author:2"])
+        return response, await cache.get("author:1")
+
+    response, after_invalidation = asyncio.run(scenario())
+    assert response.body == author.model_dump_json().encode()
+    assert redis.ttls == {"library:author:1": 60}
+    assert after_invalidation is None
+    assert cache.metrics() == {
+        "backend": "RedisBackend",
+        "hits": 1,
+        "misses": 2,
+        "hit_ratio": 0.333,
+    }
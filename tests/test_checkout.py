@@ -1,14 +1,23 @@
+import asyncio
 import copy as cp
 import json
+from collections import Counter
 from datetime import date, timedelta
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, create_engine, select
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, col, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import app
-from db import get_db
-from models.models import Checkout, CheckoutCreate, Copy
+from availability import reconcile_copy_counters
+from db import get_db, get_read_db
+from models.models import Book, Checkout, CheckoutCreate, Copy
+from overdue import overdue_query, scan_overdue
 from routers.checkout import auth
 from setup import (
     create_authors_and_books,
@@ -16,12 +25,19 @@ from setup import (
     create_copies,
     create_members,
 )
+from tests.helpers import assert_max_queries
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# The routes use an AsyncSession while the tests check the results synchronously.
+# The concurrent checkouts wait for the sqlite write lock longer than the 5s default.
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool, connect_args={"timeout": 60}
+)
 TestingSessionLocal = Session(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -46,13 +62,15 @@ def session():
 def client(session):
 
     # Dependency override
-    def override_get_db():
+    async def override_get_db():
         try:
-            yield session
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                yield db
         finally:
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     app.dependency_overrides[auth.verify] = lambda: True
 
     yield TestClient(app)
@@ -88,6 +106,84 @@ def test_get_checkout_success(client):
     }
 
 
+def test_get_checkout_query_count(client):
+    with assert_max_queries(async_engine, 1):
+        response = client.get("/checkout/1")
+    assert response.status_code == 200
+    assert response.json()["current_owner"]["id"] == 1
+    assert response.json()["copy_item"]["id"] == 1
+
+
+def test_get_checkouts_expanded(client):
+    with assert_max_queries(async_engine, 1):
+        response = client.get(
+            "/checkouts/", params={"fields": "member_id", "expand": "current_owner"}
+        )
+    assert response.status_code == 200
+    checkout = response.json()[0]
+    assert checkout.keys() == {"id", "member_id", "current_owner"}
+    assert checkout["current_owner"]["id"] == checkout["member_id"]
+
+    response = client.get("/checkout/1", params={"expand": "copy_item"})
+    assert "current_owner" not in response.json()
+    assert response.json()["copy_item"]["id"] == 1
+
+    response = client.get(
+        "/checkouts/", params={"expand": "copy_item", "format": "ndjson"}
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["copy_item"]["id"] for line in lines] == [
+        line["copy_id"] for line in lines
+    ]
+
+
+def test_get_overdue_checkouts(client):
+    response = client.get("/checkouts/overdue")
+    assert response.status_code == 200
+    assert [checkout["id"] for checkout in response.json()] == [2]
+
+    client.put("/checkout/2", json={"returned_date": date.today().isoformat()})
+    response = client.get("/checkouts/overdue", params={"format": "ndjson"})
+    assert response.text == ""
+
+
+def test_get_overdue_members(client):
+    response = client.get("/checkouts/overdue/members")
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "member_id": 2,
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "overdue_checkouts": 1,
+            "oldest_expected_return_date": "2024-03-15",
+            "days_overdue": (date.today() - date(2024, 3, 15)).days,
+        }
+    ]
+    response = client.get("/checkouts/overdue/members", params={"after": 2})
+    assert response.json() == []
+
+
+def test_scan_overdue_members(session: Session):
+    async def scan():
+        return [lines async for lines in scan_overdue(async_engine, date.today(), True)]
+
+    batches = asyncio.run(scan())
+    assert [json.loads(line)["member_id"] for line in batches[0]] == [2]
+
+
+def test_overdue_query_uses_partial_index(session: Session):
+    # The query of a page of /checkouts/overdue only reads the open checkouts.
+    query = (
+        overdue_query(date.today())
+        .order_by(Checkout.id)
+        .limit(100)
+        .compile(engine, compile_kwargs={"literal_binds": True})
+    )
+    plan = session.exec(text(f"EXPLAIN QUERY PLAN {query}")).all()
+    assert "ix_checkouts_overdue" in str(plan)
+
+
 def test_create_checkout_success(client, session: Session):
     member_id = 2
     copy_id = 1
@@ -122,6 +218,51 @@ def test_create_checkout_success(client, session: Session):
     assert checkout.copy_item.id == new_checkout.copy_id
 
 
+def test_scan_copy_checkout_and_return(client, session: Session):
+    response = client.post(
+        "/checkout/scan", json={"barcode": "0100101010", "member_id": 2}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "checkout_date": date.today().isoformat(),
+        "expected_return_date": (date.today() + timedelta(days=21)).isoformat(),
+        "member_id": 2,
+        "copy_id": 1,
+        "id": 3,
+        "returned_date": None,
+    }
+    assert not session.get(Copy, 1).is_available
+    response = client.post(
+        "/checkout/scan", json={"barcode": "0100101010", "member_id": 2}
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Copy with barcode 0100101010 is not available"
+
+    response = client.post("/checkout/scan", json={"barcode": "0100101010"})
+    assert response.status_code == 200
+    assert response.json()["id"] == 3
+    assert response.json()["returned_date"] == date.today().isoformat()
+    session.expire_all()
+    assert session.get(Copy, 1).is_available
+    assert session.get(Book, 1).available_copies == 1
+
+
+def test_scan_copy_errors(client):
+    response = client.post("/checkout/scan", json={"barcode": "0000", "member_id": 2})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Copy with barcode 0000 not found"
+    response = client.post("/checkout/scan", json={"barcode": "0100101010"})
+    assert response.status_code == 404
+    assert (
+        response.json()["detail"] == "Copy with barcode 0100101010 is not checked out"
+    )
+    response = client.post(
+        "/checkout/scan", json={"barcode": "0100101010", "member_id": 42}
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Member id 42 not found"
+
+
 def test_update_checkout_success(client, session):
     checkout_id = 2
     checkout_before_update = session.get(Checkout, checkout_id)
@@ -163,6 +304,110 @@ def test_delete_checkout_success(client, session):
     assert checkout is None
 
 
+def test_create_checkout_invalidates_cached_book(client, session: Session):
+    book_id = session.get(Copy, 1).book_id
+    copies = client.get(f"/book/{book_id}").json()["copies"]
+    assert {"id": 1, "is_available": True}.items() <= copies[0].items()
+    new_checkout = {
+        "checkout_date": date.today().isoformat(),
+        "expected_return_date": date.today().isoformat(),
+        "member_id": 2,
+        "copy_id": 1,
+    }
+    assert client.post("/checkout/", json=new_checkout).status_code == 200
+
+    copies = client.get(f"/book/{book_id}").json()["copies"]
+    assert {"id": 1, "is_available": False}.items() <= copies[0].items()
+
+
+def test_checkouts_update_book_counters(client, session: Session):
+    book_id = session.get(Copy, 2).book_id
+    assert client.get(f"/book/{book_id}").json()["available_copies"] == 0
+    client.put("/checkout/2", json={"returned_date": date.today().isoformat()})
+    assert client.get(f"/book/{book_id}").json()["available_copies"] == 1
+    new_checkout = {
+        "checkout_date": date.today().isoformat(),
+        "expected_return_date": date.today().isoformat(),
+        "member_id": 2,
+        "copy_id": 2,
+    }
+    assert client.post("/checkout/", json=new_checkout).status_code == 200
+    assert client.get(f"/book/{book_id}").json()["available_copies"] == 0
+
+
+def test_concurrent_checkouts_never_lend_a_copy_twice(client, session: Session):
+    # Every copy is marked available, even copy 2 which has an open checkout.
+    for copy in session.exec(select(Copy)).all():
+        copy.is_available = True
+        session.add(copy)
+    session.commit()
+    asyncio.run(reconcile_copy_counters(async_engine, fix=True))
+    copy_ids = [1, 2, 3]
+
+    async def checkout_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(
+                *(
+                    ac.post(
+                        "/checkout/",
+                        json={
+                            "checkout_date": date.today().isoformat(),
+                            "expected_return_date": date.today().isoformat(),
+                            "member_id": 2,
+                            "copy_id": copy_ids[i % len(copy_ids)],
+                        },
+                    )
+                    for i in range(300)
+                )
+            )
+
+    responses = asyncio.run(checkout_all())
+    assert {response.status_code for response in responses} == {200, 404}
+    loans = Counter(r.json()["copy_id"] for r in responses if r.status_code == 200)
+    assert loans == {1: 1, 3: 1}
+
+    open_checkouts = session.exec(
+        select(Checkout).filter(col(Checkout.returned_date).is_(None))
+    ).all()
+    assert sorted(checkout.copy_id for checkout in open_checkouts) == [1, 2, 3]
+    assert asyncio.run(reconcile_copy_counters(async_engine)) == []
+
+
+def test_concurrent_returns_count_the_copy_once(client, session: Session):
+    async def return_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(
+                *(
+                    ac.post("/checkout/scan", json={"barcode": "1100101011"})
+                    for _ in range(50)
+                )
+            )
+
+    responses = asyncio.run(return_all())
+    assert Counter(response.status_code for response in responses) == {200: 1, 404: 49}
+    assert session.get(Checkout, 2).returned_date == date.today()
+    assert session.get(Copy, 2).is_available
+    assert asyncio.run(reconcile_copy_counters(async_engine)) == []
+
+
+def test_concurrent_updates_count_the_returned_copy_once(client, session: Session):
+    returned = {"returned_date": date.today().isoformat()}
+
+    async def update_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(
+                *(ac.put("/checkout/2", json=returned) for _ in range(50))
+            )
+
+    responses = asyncio.run(update_all())
+    assert {response.status_code for response in responses} == {200}
+    assert session.get(Copy, 2).is_available
+    assert asyncio.run(reconcile_copy_counters(async_engine)) == []
+
+
 def test_create_checkout_copy_not_available(client, session: Session):
     new_checkout = CheckoutCreate(
         checkout_date=date.today(),
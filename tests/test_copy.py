@@ -1,25 +1,34 @@
+import asyncio
 import copy as cp
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import app
-from db import get_db
-from models.models import Copy, CopyCreate
-from routers.copy import auth
+from availability import reconcile_copy_counters
+from db import get_db, get_read_db
+from models.models import Book, Copy, CopyCreate
+from routers.copy import auth, barcodes
 from setup import (
     create_authors_and_books,
     create_checkouts,
     create_copies,
     create_members,
 )
+from tests.helpers import assert_max_queries
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# The routes use an AsyncSession while the tests check the results synchronously.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
 TestingSessionLocal = Session(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -44,18 +53,29 @@ def session():
 def client(session):
 
     # Dependency override
-    def override_get_db():
+    async def override_get_db():
         try:
-            yield session
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                yield db
         finally:
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     app.dependency_overrides[auth.verify] = lambda: True
 
     yield TestClient(app)
 
 
+def test_get_all_copies_after(client):
+    response = client.get("/copies/", params={"after": 1})
+    assert response.status_code == 200
+    assert [copy["barcode"] for copy in response.json()] == [
+        "1100101011",
+        "1100100000",
+    ]
+
+
 def test_get_copy_success(client):
     response = client.get("/copy/1")
     assert response.status_code == 200
@@ -78,6 +98,74 @@ def test_get_copy_success(client):
     }
 
 
+def test_get_copy_query_count(client):
+    with assert_max_queries(async_engine, 2):
+        response = client.get("/copy/1")
+    assert response.status_code == 200
+    assert len(response.json()["checkouts"]) == 1
+
+
+def test_get_copy_not_modified(client):
+    response = client.get("/copy/1")
+    etag = response.headers["etag"]
+    assert "last-modified" not in response.headers
+    response = client.get("/copy/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    # Without its checkouts, the copy also has a Last-Modified.
+    response = client.get("/copy/1", params={"expand": ""})
+    last_modified = response.headers["last-modified"]
+    response = client.get(
+        "/copy/1", params={"expand": ""}, headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+    response = client.get(
+        "/copy/1",
+        params={"expand": ""},
+        headers={"If-Modified-Since": "Sat, 01 Jan 2000 00:00:00 GMT"},
+    )
+    assert response.status_code == 200
+
+    # A change of one of its checkouts changes the response of the copy.
+    client.put("/checkout/1", json={"returned_date": "2024-01-01"})
+    response = client.get("/copy/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_get_copy_by_barcode(client):
+    response = client.get("/copy/by-barcode/0100101010")
+    assert response.status_code == 200
+    assert response.json() == client.get("/copy/1").json()
+    # The copy id is now read from the cache, the barcode of the copy is checked.
+    assert barcodes.get("0100101010") == 1
+    with assert_max_queries(async_engine, 2):
+        response = client.get("/copy/by-barcode/0100101010")
+    assert response.json()["id"] == 1
+    assert client.get("/copy/by-barcode/0000").status_code == 404
+
+
+def test_get_copy_by_barcode_after_change(client):
+    client.get("/copy/by-barcode/0100101010")
+    client.put("/copy/1", json={"barcode": "0100101099"})
+    assert client.get("/copy/by-barcode/0100101010").status_code == 404
+    assert client.get("/copy/by-barcode/0100101099").json()["id"] == 1
+    # Changed through another worker: the cached id is stale.
+    barcodes.set("1100100000", 1)
+    assert client.get("/copy/by-barcode/1100100000").json()["id"] == 3
+    assert barcodes.get("1100100000") == 3
+
+
+def test_get_all_copies_not_modified(client):
+    etag = client.get("/copies/").headers["etag"]
+    response = client.get("/copies/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = client.get(
+        "/copies/", params={"after": 1}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+
+
 def test_create_copy_success(client, session: Session):
     new_copy = CopyCreate(
         barcode="0000111001011", location="Shelf 2", is_available=True, book_id=1
@@ -95,6 +183,80 @@ def test_create_copy_success(client, session: Session):
     assert copy.book_id == new_copy.book_id
 
 
+def test_create_copies_bulk(client, session: Session):
+    copy = {"barcode": "0000111001011", "location": "Shelf 2", "is_available": True}
+    rows = [
+        {**copy, "book_id": 1},
+        {**copy, "barcode": "0000111001012", "book_id": 999},
+        {**copy, "barcode": "0100101010", "book_id": 1},
+        {**copy, "book_id": 2},
+        {**copy, "barcode": "0000111001013", "book_id": 2},
+        {**copy, "barcode": "0000111001014", "book_id": 1, "is_available": False},
+    ]
+    with assert_max_queries(async_engine, 10) as statements:
+        response = client.post("/copies/bulk", json=rows)
+    assert response.status_code == 200
+    # The counters of all the books are changed by a single executemany UPDATE.
+    assert len([s for s in statements if s.startswith("UPDATE books")]) == 1
+    assert asyncio.run(reconcile_copy_counters(async_engine)) == []
+    assert response.json() == {
+        "created": [
+            {"index": 0, "id": 4},
+            {"index": 4, "id": 5},
+            {"index": 5, "id": 6},
+        ],
+        "errors": [
+            {"index": 1, "detail": "Book id 999 not found"},
+            {"index": 2, "detail": "Copy with barcode 0100101010 already exists"},
+            {"index": 3, "detail": "Copy with barcode 0000111001011 already exists"},
+        ],
+    }
+    assert session.get(Copy, 5).barcode == "0000111001013"
+
+
+def test_copy_writers_update_book_counters(client, session: Session):
+    def counters(book_id):
+        book = client.get(f"/book/{book_id}").json()
+        return book["total_copies"], book["available_copies"]
+
+    assert counters(1) == (1, 1)
+    new_copy = {"barcode": "0000111001011", "location": "Shelf 2", "is_available": True}
+    copy_id = client.post("/copy/", json={**new_copy, "book_id": 1}).json()["id"]
+    assert counters(1) == (2, 2)
+    client.put(f"/copy/{copy_id}", json={"is_available": False})
+    assert counters(1) == (2, 1)
+    client.put(f"/copy/{copy_id}", json={"book_id": 2, "is_available": True})
+    assert counters(1) == (1, 1)
+    assert counters(2) == (3, 1)
+    client.delete(f"/copy/{copy_id}")
+    assert counters(2) == (2, 0)
+    client.post("/copies/bulk", json=[{**new_copy, "book_id": 2}])
+    assert counters(2) == (3, 1)
+
+    assert asyncio.run(reconcile_copy_counters(async_engine)) == []
+
+
+def test_reconcile_copy_counters(client, session: Session):
+    book = session.get(Book, 2)
+    book.total_copies, book.available_copies = 5, 5
+    session.add(book)
+    session.commit()
+
+    mismatches = asyncio.run(reconcile_copy_counters(async_engine, fix=True))
+    assert mismatches == [
+        {
+            "book_id": 2,
+            "total_copies": 5,
+            "available_copies": 5,
+            "expected_total_copies": 2,
+            "expected_available_copies": 0,
+        }
+    ]
+    session.refresh(book)
+    assert (book.total_copies, book.available_copies) == (2, 0)
+    assert asyncio.run(reconcile_copy_counters(async_engine)) == []
+
+
 def test_update_copy_success(client, session):
     copy_before_update = session.get(Copy, 1)
     copy_before_update = cp.deepcopy(copy_before_update)
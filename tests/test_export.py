@@ -0,0 +1,137 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import app
+from archive import archive_checkouts
+from db import get_db
+from models.models import Book
+from routers.export import auth
+from setup import (
+    create_authors_and_books,
+    create_checkouts,
+    create_copies,
+    create_members,
+)
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+# The routes use an AsyncSession while the tests check the results synchronously.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+TestingSessionLocal = Session(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture()
+def session():
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    create_authors_and_books(engine)
+    create_members(engine)
+    create_copies(engine)
+    create_checkouts(engine)
+
+    db = TestingSessionLocal
+
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture()
+def client(session):
+
+    # Dependency override
+    async def override_get_db():
+        try:
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                yield db
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[auth.verify] = lambda: True
+
+    yield TestClient(app)
+
+
+def test_export_books_csv(client):
+    response = client.get("/export/books")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    assert "books.csv.gz" in response.headers["content-disposition"]
+
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode())))
+    assert [row["id"] for row in rows] == ["1", "2", "3"]
+    assert rows[0]["title"] == "Deadpond"
+    assert rows[0]["publication_date"] == "2018-01-01"
+    assert rows[0]["updated_at"]
+    assert "search_text" not in rows[0]
+
+
+def test_export_checkouts_ndjson(client):
+    response = client.get("/export/checkouts", params={"format": "ndjson"})
+    assert response.status_code == 200
+
+    lines = gzip.decompress(response.content).decode().splitlines()
+    checkouts = [json.loads(line) for line in lines]
+    assert [checkout["id"] for checkout in checkouts] == [1, 2]
+    assert checkouts[0].keys() == {
+        "id",
+        "checkout_date",
+        "expected_return_date",
+        "returned_date",
+        "member_id",
+        "copy_id",
+        "updated_at",
+    }
+
+
+def test_export_checkouts_history(client, session: Session):
+    returned = client.get("/export/checkouts", params={"format": "ndjson"}).content
+    assert asyncio.run(archive_checkouts(async_engine, date.today())) == 1
+
+    response = client.get("/export/checkouts_history", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert "checkouts_history.ndjson.gz" in response.headers["content-disposition"]
+    lines = gzip.decompress(response.content).decode().splitlines()
+    # The archived checkout, with the columns and the date it had in `checkouts`.
+    assert lines == [gzip.decompress(returned).decode().splitlines()[0]]
+    lines = gzip.decompress(
+        client.get("/export/checkouts", params={"format": "ndjson"}).content
+    ).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [2]
+
+
+def test_export_updated_since(client, session: Session):
+    last_week = datetime.now() - timedelta(days=7)
+    session.exec(update(Book).values(updated_at=last_week - timedelta(days=1)))
+    session.commit()
+    assert client.put("/book/2", json={"title": "Updated"}).status_code == 200
+
+    response = client.get(
+        "/export/books",
+        params={"format": "ndjson", "updated_since": last_week.isoformat()},
+    )
+    lines = gzip.decompress(response.content).decode().splitlines()
+    assert [json.loads(line)["title"] for line in lines] == ["Updated"]
+
+
+def test_export_unknown_table(client):
+    response = client.get("/export/authors_secrets")
+    assert response.status_code == 422
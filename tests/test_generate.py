@@ -0,0 +1,58 @@
+import asyncio
+from datetime import date
+
+from sqlalchemy import func, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from availability import reconcile_copy_counters
+from benchmarks.generate import Library, generate
+from models.models import Book, Checkout, Copy
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+
+VOLUMES = {
+    "authors": 50,
+    "books": 300,
+    "copies": 1000,
+    "members": 40,
+    "checkouts": 3000,
+}
+TODAY = date(2024, 6, 1)
+
+
+def test_generate():
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    asyncio.run(generate(async_engine, VOLUMES, 42, TODAY))
+
+    with Session(engine) as session:
+        for model, count in [(Book, 300), (Copy, 1000), (Checkout, 3000)]:
+            assert session.exec(select(func.count()).select_from(model)).one() == count
+        # 3% of the copies are borrowed, the others are available.
+        open_checkouts = select(func.count()).where(
+            col(Checkout.returned_date).is_(None)
+        )
+        assert session.exec(open_checkouts).one() == 30
+        borrowed = select(func.count()).where(col(Copy.is_available).is_(False))
+        assert session.exec(borrowed).one() == 30
+        # The generated books are found by the search.
+        assert session.exec(text("SELECT count(*) FROM books_fts")).one() == (300,)
+    assert asyncio.run(reconcile_copy_counters(async_engine)) == []
+
+
+def test_generated_rows_only_depend_on_the_seed():
+    def rows(seed):
+        library = Library(VOLUMES, seed, TODAY)
+        authors = list(library.authors())
+        return authors, list(library.books()), list(library.checkouts())
+
+    assert rows(42) == rows(42)
+    assert rows(42) != rows(43)
@@ -4,10 +4,13 @@ from datetime import date
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import Session, SQLModel, col, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app import app
-from db import get_db
+from db import get_db, get_read_db
 from models.models import Member, MemberCreate
 from routers.member import auth
 from setup import (
@@ -16,12 +19,16 @@ from setup import (
     create_copies,
     create_members,
 )
+from tests.helpers import assert_max_queries
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# The routes use an AsyncSession while the tests check the results synchronously.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
 TestingSessionLocal = Session(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -46,18 +53,31 @@ def session():
 def client(session):
 
     # Dependency override
-    def override_get_db():
+    async def override_get_db():
         try:
-            yield session
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                yield db
         finally:
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     app.dependency_overrides[auth.verify] = lambda: True
 
     yield TestClient(app)
 
 
+def test_post_members_by_ids(client: TestClient):
+    response = client.post("/members/lookup", json={"ids": [2, 1000, 1]})
+    assert response.status_code == 200
+    result = response.json()
+    assert [member and member["id"] for member in result["items"]] == [2, None, 1]
+    assert result["items"][2]["first_name"] == "John"
+    assert result["not_found"] == [1000]
+    response = client.post("/members/lookup", json={"ids": []})
+    assert response.json() == {"items": [], "not_found": []}
+
+
 def test_get_member_success(client: TestClient):
     response = client.get("/member/1")
     assert response.status_code == 200
@@ -83,6 +103,13 @@ def test_get_member_success(client: TestClient):
     }
 
 
+def test_get_member_query_count(client):
+    with assert_max_queries(async_engine, 2):
+        response = client.get("/member/1")
+    assert response.status_code == 200
+    assert len(response.json()["member_checkouts"]) == 1
+
+
 def test_create_member_success(client: TestClient, session: Session):
     new_member = MemberCreate(
         auth0_id="cc23e_ae873_a123b",
@@ -118,6 +145,27 @@ def test_create_member_success(client: TestClient, session: Session):
     assert member.membership_expiration == new_member.membership_expiration
 
 
+def test_create_members_bulk(client: TestClient, session: Session):
+    member = {
+        "auth0_id": "cc23e_ae873_a123b",
+        "first_name": "TestFirstName",
+        "last_name": "TestLastName",
+        "age": 34,
+        "birthdate": "1990-01-01",
+        "city": "Paris",
+        "membership_expiration": "2022-01-01",
+    }
+    rows = [{**member, "age": "old"}, member]
+    response = client.post("/members/bulk", json=rows)
+    assert response.status_code == 200
+    assert response.json()["created"] == [{"index": 1, "id": 4}]
+    assert response.json()["errors"][0]["index"] == 0
+    assert response.json()["errors"][0]["detail"][0]["loc"] == ["age"]
+
+    member = session.get(Member, 4)
+    assert member.auth0_id == "cc23e_ae873_a123b"
+
+
 def test_update_member_success(client: TestClient, session: Session):
     member_id = 2
     member_before_update = session.get(Member, member_id)
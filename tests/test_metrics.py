@@ -0,0 +1,182 @@
+import asyncio
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import app
+from db import MonitoredPool, get_db, get_pool_metrics, get_read_db, warmup_pool
+from instrumentation import RequestTimings, current_timings, route_metrics
+from routers.metrics import auth
+from setup import create_members
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+
+
+@pytest.fixture()
+def client():
+    app.dependency_overrides[auth.verify] = lambda: True
+    route_metrics.clear()
+
+    yield TestClient(app)
+
+
+@pytest.fixture()
+def db_client(client):
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    create_members(engine)
+
+    async def override_get_db():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+
+    yield client
+
+
+def test_get_db_metrics(client):
+    response = client.get("/metrics/db")
+    assert response.status_code == 200
+    assert {
+        "size",
+        "checked_out",
+        "saturation",
+        "checkouts",
+        "timeouts",
+        "wait_avg_ms",
+        "wait_max_ms",
+    } <= response.json().keys()
+
+
+def test_get_cache_metrics(client):
+    response = client.get("/metrics/cache")
+    assert response.status_code == 200
+    assert response.json() == {
+        "backend": "MemoryBackend",
+        "hits": 0,
+        "misses": 0,
+        "hit_ratio": None,
+    }
+
+
+def test_warmup_pool_keeps_connections_open():
+    async def warmup():
+        engine = create_async_engine(
+            ASYNC_SQLALCHEMY_DATABASE_URL,
+            poolclass=MonitoredPool,
+            pool_size=3,
+            max_overflow=1,
+        )
+        await warmup_pool(engine, 3)
+        metrics = get_pool_metrics(engine)
+        await engine.dispose()
+        return metrics
+
+    metrics = asyncio.run(warmup())
+    assert metrics["checked_in"] == 3
+    assert metrics["checked_out"] == 0
+    assert metrics["checkouts"] == 3
+    assert metrics["saturation"] == 0.0
+
+
+def test_pool_saturation():
+    async def saturate():
+        engine = create_async_engine(
+            ASYNC_SQLALCHEMY_DATABASE_URL,
+            poolclass=MonitoredPool,
+            pool_size=1,
+            max_overflow=1,
+        )
+        connection = await engine.connect()
+        metrics = get_pool_metrics(engine)
+        await connection.close()
+        await engine.dispose()
+        return metrics
+
+    metrics = asyncio.run(saturate())
+    assert metrics["checked_out"] == 1
+    assert metrics["saturation"] == 0.5
+
+
+def test_server_timing(db_client):
+    response = db_client.get("/member/1")
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert re.fullmatch(
+        r'db;dur=[\d.]+;desc="[1-9]\d* queries", serialize;dur=[\d.]+, '
+        r"total;dur=[\d.]+",
+        timing,
+    )
+
+
+def test_failed_statements_leave_nothing_on_the_connection():
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        with create_engine("sqlite://").connect() as conn:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    conn.execute(text("SELECT * FROM missing"))
+            assert conn.execute(text("SELECT 1")).scalar() == 1
+            assert "query_start" not in conn.info
+    finally:
+        current_timings.reset(token)
+    assert timings.queries == 1
+
+
+def test_prometheus_metrics(db_client):
+    db_client.get("/member/1")
+    db_client.get("/member/1")
+    db_client.get("/member/9999")
+    response = db_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    route = 'method="GET",route="/member/{member_id}"'
+    assert f'library_http_requests_total{{{route},status="200"}} 2' in lines
+    assert f'library_http_requests_total{{{route},status="404"}} 1' in lines
+    assert f"library_http_request_duration_seconds_count{{{route}}} 3" in lines
+    assert f'library_http_request_duration_seconds_bucket{{{route},le="+Inf"}} 3' in (
+        lines
+    )
+    queries = next(
+        line
+        for line in lines
+        if line.startswith(f"library_db_queries_total{{{route}}}")
+    )
+    assert int(queries.split()[-1]) >= 3
+    assert "library_db_pool_saturation 0" in lines
+    # The request to /metrics is only counted once it's answered.
+    assert 'route="/metrics"' not in response.text
+
+
+def test_profile_returns_folded_stacks(db_client):
+    response = db_client.get("/member/1", params={"profile": 1})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert stack.startswith("_bootstrap")
+
+
+def test_profile_requires_an_admin_route(db_client):
+    # The public search isn't profiled, the response is the usual one.
+    response = db_client.get("/books/search", params={"profile": 1})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
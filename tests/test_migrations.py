@@ -0,0 +1,167 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from db import run_migrations
+from models.models import AuthorBookLink, Book, Checkout, Copy, Member
+from search import search_books_query
+
+# Indexes created by the 0002 migration, see migrations/versions.
+INDEXES = {
+    "copies": "ix_copies_book_id",
+    "checkouts": "ix_checkouts_member_id",
+    "authorbooklink": "ix_authorbooklink_author_id",
+    "members": "ix_members_auth0_id",
+    "books": "ix_books_publication_date",
+}
+
+
+@pytest.fixture()
+def engines(tmp_path):
+    # A database of its own: the other tests recreate test.db with create_all.
+    path = tmp_path / "migrations.db"
+    engine = create_engine(f"sqlite:///{path}")
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", poolclass=NullPool
+    )
+    yield engine, async_engine
+    engine.dispose()
+
+
+def indexes(engine):
+    inspector = inspect(engine)
+    return {
+        index["name"]
+        for table in inspector.get_table_names()
+        for index in inspector.get_indexes(table)
+    }
+
+
+def assert_schema_of_the_models(engine):
+    inspector = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert columns == set(table.columns.keys()), table.name
+        # The trigram index only exists on PostgreSQL.
+        expected = {index.name for index in table.indexes} - {
+            "ix_books_search_text_trgm"
+        }
+        assert {index["name"] for index in inspector.get_indexes(table.name)} == (
+            expected
+        ), table.name
+
+
+def test_migrations_create_the_schema(engines):
+    engine, async_engine = engines
+    asyncio.run(run_migrations(async_engine))
+
+    assert_schema_of_the_models(engine)
+    with Session(engine) as session:
+        assert session.exec(text("SELECT version_num FROM alembic_version")).all() == [
+            ("0008",)
+        ]
+    # Nothing to do the second time.
+    asyncio.run(run_migrations(async_engine))
+
+
+def test_migrations_upgrade_the_initial_schema(engines):
+    engine, async_engine = engines
+    # Database of the first version of the app, see 0001.
+    asyncio.run(run_migrations(async_engine, "0001"))
+    with engine.begin() as conn:
+        for statement in [
+            "INSERT INTO authors VALUES ('Émile', 'Zola', '1840-04-02', NULL, 'FR', 1)",
+            "INSERT INTO books VALUES ('Germinal', '9', '1st', '1885-03-01', 'fr', 1)",
+            "INSERT INTO authorbooklink VALUES (1, 1)",
+            "INSERT INTO copies VALUES ('001', 'Shelf 1', 1, 1, 1)",
+            "INSERT INTO copies VALUES ('002', 'Shelf 1', 0, 1, 2)",
+            "INSERT INTO members VALUES "
+            "('auth0|1', 'A', 'B', 30, '1994-01-01', 'Lille', '2100-01-01', 1)",
+            "INSERT INTO checkouts VALUES ('2024-01-01', '2024-01-15', 1, 2, 1, NULL)",
+        ]:
+            conn.execute(text(statement))
+
+    asyncio.run(run_migrations(async_engine))
+    assert_schema_of_the_models(engine)
+    with Session(engine) as session:
+        book = session.get(Book, 1)
+        assert (book.total_copies, book.available_copies) == (2, 1)
+        assert book.search_text == "germinal emile zola"
+        assert book.updated_at is not None
+        for words in ["zola", "germ"]:
+            statement = search_books_query(select(Book.id), "sqlite", words)
+            assert session.exec(statement).all() == [1]
+        # A second open checkout of the copy is refused.
+        session.add(
+            Checkout(
+                checkout_date=date(2024, 1, 2),
+                expected_return_date=date(2024, 1, 16),
+                member_id=1,
+                copy_id=2,
+            )
+        )
+        with pytest.raises(IntegrityError):
+            session.commit()
+
+
+def test_migrations_refuse_several_open_checkouts_of_a_copy(engines):
+    engine, async_engine = engines
+    asyncio.run(run_migrations(async_engine, "0006"))
+    with engine.begin() as conn:
+        for id in [1, 2]:
+            conn.execute(
+                text(
+                    "INSERT INTO checkouts (id, checkout_date, expected_return_date, "
+                    "member_id, copy_id) VALUES (:id, '2024-01-01', '2024-01-15', 1, 7)"
+                ),
+                {"id": id},
+            )
+    with pytest.raises(RuntimeError, match=r"The copies \[7\] have several open"):
+        asyncio.run(run_migrations(async_engine))
+
+
+def test_migrations_add_the_indexes_to_an_existing_database(engines):
+    engine, async_engine = engines
+    # Database created by create_all before the migrations, without the indexes.
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for name in [*INDEXES.values(), "ix_checkouts_copy_id"]:
+            conn.execute(text(f"DROP INDEX {name}"))
+
+    asyncio.run(run_migrations(async_engine))
+    assert_schema_of_the_models(engine)
+
+
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        # Relationship loads, e.g. the copies of a book or the books of an author.
+        (select(Copy).where(Copy.book_id == 1), "ix_copies_book_id"),
+        (select(Checkout).where(Checkout.member_id == 1), "ix_checkouts_member_id"),
+        (select(Checkout).where(Checkout.copy_id == 1), "ix_checkouts_copy_id"),
+        (
+            select(Book).join(AuthorBookLink).where(AuthorBookLink.author_id == 1),
+            "ix_authorbooklink_author_id",
+        ),
+        (select(Member).where(Member.auth0_id == "auth0|1"), "ix_members_auth0_id"),
+        (
+            select(Book).where(
+                col(Book.publication_date).between(date(2000, 1, 1), date(2009, 12, 31))
+            ),
+            "ix_books_publication_date",
+        ),
+    ],
+)
+def test_hot_queries_use_an_index(engines, query, index):
+    engine, async_engine = engines
+    asyncio.run(run_migrations(async_engine))
+    statement = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with Session(engine) as session:
+        plan = str(session.exec(text(f"EXPLAIN QUERY PLAN {statement}")).all())
+    assert index in plan
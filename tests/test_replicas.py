@@ -0,0 +1,193 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine
+
+import db
+from app import app
+from db import READ_PRIMARY_COOKIE, ReplicaRouter, get_db, get_read_db
+from models.models import Book
+from routers.book import auth
+from setup import create_authors_and_books, create_copies, create_members
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+
+def create_library(url: str):
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    create_authors_and_books(engine)
+    create_members(engine)
+    create_copies(engine)
+    return engine
+
+
+@pytest.fixture()
+def engines(tmp_path):
+    """The primary, and a replica whose book 1 has another title, as if it lagged."""
+    create_library(SQLALCHEMY_DATABASE_URL)
+    replica_path = tmp_path / "replica.db"
+    with Session(create_library(f"sqlite:///{replica_path}")) as session:
+        book = session.get(Book, 1)
+        book.title = "Replica title"
+        session.add(book)
+        session.commit()
+    primary = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    replica = create_async_engine(
+        f"sqlite+aiosqlite:///{replica_path}", poolclass=NullPool
+    )
+    return primary, replica
+
+
+@pytest.fixture()
+def client(engines, monkeypatch):
+    primary, replica = engines
+    monkeypatch.setattr(db, "replica_router", ReplicaRouter(primary, [replica]))
+    # The routes use the sessions of db.py instead of the ones of the other tests.
+    monkeypatch.delitem(app.dependency_overrides, get_db, raising=False)
+    monkeypatch.delitem(app.dependency_overrides, get_read_db, raising=False)
+    monkeypatch.setitem(app.dependency_overrides, auth.verify, lambda: True)
+
+    yield TestClient(app)
+
+
+def test_reads_go_to_the_replica(client):
+    response = client.get("/book/1")
+    assert response.status_code == 200
+    assert response.json()["title"] == "Replica title"
+    assert READ_PRIMARY_COOKIE not in response.cookies
+
+
+def test_writes_go_to_the_primary_then_its_reads(client):
+    response = client.put("/book/2", json={"edition": "Second"})
+    assert response.status_code == 200
+    assert READ_PRIMARY_COOKIE in response.cookies
+
+    # The client reads its write, and the book 1 of the primary.
+    assert client.get("/book/2").json()["edition"] == "Second"
+    assert client.get("/book/1").json()["title"] != "Replica title"
+
+    # Once the window is over, the replica again.
+    client.cookies.clear()
+    assert client.get("/book/1").json()["title"] == "Replica title"
+
+
+def test_read_your_writes_window_expires(client, monkeypatch):
+    monkeypatch.setattr(db.time, "time", lambda: 1000.0)
+    client.put("/book/2", json={"edition": "Second"})
+    assert float(client.cookies[READ_PRIMARY_COOKIE]) == 1005.0
+
+    monkeypatch.setattr(db.time, "time", lambda: 1006.0)
+    assert client.get("/book/1").json()["title"] == "Replica title"
+
+
+def test_only_the_reads_of_the_primary_are_cached(client, engines, monkeypatch):
+    primary, replica = engines
+    assert client.get("/book/1").json()["title"] == "Replica title"
+
+    # The lagging replica's book wasn't cached, the primary's one is.
+    monkeypatch.setattr(db, "replica_router", ReplicaRouter(primary, []))
+    title = client.get("/book/1").json()["title"]
+    assert title != "Replica title"
+
+    # The replicas' reads use the cache.
+    monkeypatch.setattr(db, "replica_router", ReplicaRouter(primary, [replica]))
+    assert client.get("/book/1").json()["title"] == title
+
+
+def test_only_the_facets_of_the_primary_are_cached(client, engines, monkeypatch):
+    primary, replica = engines
+    params = {"q": "replica", "facets": "language"}
+
+    def count():
+        return client.get("/books/search", params=params).json()["facets"]
+
+    assert count() == {"language": [{"value": "English", "count": 1}]}
+    # The lagging replica's counts weren't cached, the primary's ones are.
+    monkeypatch.setattr(db, "replica_router", ReplicaRouter(primary, []))
+    assert count() == {"language": []}
+    monkeypatch.setattr(db, "replica_router", ReplicaRouter(primary, [replica]))
+    assert count() == {"language": []}
+
+    # A client which just wrote counts on the primary, without the cache.
+    assert client.put("/book/1", json={"title": "Replica 2"}).status_code == 200
+    assert count() == {"language": [{"value": "English", "count": 1}]}
+    client.cookies.clear()
+    assert count() == {"language": []}
+
+
+@pytest.mark.parametrize("strategy", ["round_robin", "latency"])
+def test_unreachable_replica_is_left_aside(client, engines, monkeypatch, strategy):
+    primary, replica = engines
+    unreachable = create_async_engine(
+        "sqlite+aiosqlite:////nonexistent/replica.db", poolclass=NullPool
+    )
+    router = ReplicaRouter(primary, [unreachable], strategy, cool_off_seconds=30)
+    monkeypatch.setattr(db, "replica_router", router)
+    monkeypatch.setattr(db.time, "monotonic", lambda: 1000.0)
+
+    # The read goes to the primary, the replica is down until the end of the cool off.
+    response = client.get("/book/1")
+    assert response.status_code == 200
+    assert response.json()["title"] != "Replica title"
+    assert router.down_until == [1030.0]
+    assert router.choose() is primary
+    assert router.up() == []
+
+    # The other replicas are still used, and the unreachable one tried again later.
+    router = ReplicaRouter(primary, [unreachable, replica], strategy)
+    router.mark_down(unreachable)
+    assert {router.choose() for _ in range(4)} == {replica}
+    monkeypatch.setattr(db.time, "monotonic", lambda: 1031.0)
+    assert unreachable in {router.choose() for _ in range(4)}
+
+
+def test_replica_failing_its_statements_is_down(engines, monkeypatch):
+    primary, replica = engines
+    router = ReplicaRouter(primary, [replica], strategy="latency")
+
+    async def read_missing_table():
+        async with replica.connect() as conn:
+            await conn.execute(text("SELECT * FROM missing"))
+
+    with pytest.raises(OperationalError):
+        asyncio.run(read_missing_table())
+    assert router.choose() is primary
+
+
+def test_round_robin(engines):
+    primary, replica = engines
+    other = create_async_engine("sqlite+aiosqlite://", poolclass=NullPool)
+    router = ReplicaRouter(primary, [replica, other])
+    assert [router.choose() for _ in range(4)] == [replica, other, replica, other]
+
+
+def test_lowest_latency(engines):
+    primary, replica = engines
+    other = create_async_engine("sqlite+aiosqlite://", poolclass=NullPool)
+    router = ReplicaRouter(primary, [replica, other], strategy="latency")
+    # Every replica is tried once.
+    router.observe(0, 0.010)
+    assert router.choose() is other
+    router.observe(1, 0.050)
+    assert router.choose() is replica
+    # The average follows the slow statements of the replica.
+    for _ in range(10):
+        router.observe(0, 0.200)
+    assert router.choose() is other
+
+
+def test_without_replicas_everything_goes_to_the_primary(engines):
+    primary, _ = engines
+    router = ReplicaRouter(primary, [])
+    assert router.choose() is primary
+
+    with pytest.raises(ValueError):
+        ReplicaRouter(primary, [], strategy="random")
@@ -0,0 +1,73 @@
+import json
+from typing import List
+
+import pytest
+from pydantic import TypeAdapter
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from models.models import (
+    Book,
+    BookRead,
+    Checkout,
+    CheckoutRead,
+    Copy,
+    CopyRead,
+    Member,
+    MemberRead,
+)
+from serialization import json_response, ndjson_lines, read_rows, read_select
+from setup import (
+    create_authors_and_books,
+    create_checkouts,
+    create_copies,
+    create_members,
+)
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+
+
+@pytest.fixture()
+def session():
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    create_authors_and_books(engine)
+    create_members(engine)
+    create_copies(engine)
+    create_checkouts(engine)
+
+    with Session(engine) as db:
+        yield db
+
+
+@pytest.mark.parametrize(
+    "model, read_model",
+    [
+        (Book, BookRead),
+        (Copy, CopyRead),
+        (Member, MemberRead),
+        (Checkout, CheckoutRead),
+    ],
+)
+def test_list_response_matches_the_response_model(session, model, read_model):
+    rows = session.exec(read_select(model, read_model).order_by(model.id)).all()
+    response = json_response(read_rows(read_model.model_fields, rows))
+
+    # What FastAPI returns for the ORM objects with `response_model=List[read_model]`.
+    objects = session.exec(select(model).order_by(model.id)).all()
+    adapter = TypeAdapter(List[read_model])
+    expected = adapter.dump_json(adapter.validate_python(objects, from_attributes=True))
+    assert objects
+    assert response.body == expected
+    assert response.headers["content-type"] == "application/json"
+
+
+def test_extra_columns_are_not_serialized(session):
+    rows = session.exec(read_select(Book, BookRead, Book.updated_at)).all()
+    assert rows[0].updated_at is not None
+    lines = ndjson_lines(read_rows(BookRead.model_fields, rows)).splitlines()
+    assert len(lines) == len(rows)
+    assert json.loads(lines[0]).keys() == BookRead.model_fields.keys()
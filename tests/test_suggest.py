@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import app
+from db import get_db, get_read_db
+from routers.book import auth, suggestions
+from setup import create_authors_and_books
+from suggest import SuggestIndex
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+
+
+@pytest.fixture()
+def index():
+    index = SuggestIndex()
+    index.build(
+        [(1, "Deadpond"), (2, "Hero Rusty"), (3, "Héros d'été"), (4, "Hero")],
+        [(1, "George", "Orwell"), (2, "Aldous", "Huxley")],
+    )
+    return index
+
+
+def texts(suggestions):
+    return [suggestion["text"] for suggestion in suggestions]
+
+
+def test_suggest_the_texts_starting_with_the_prefix(index):
+    assert texts(index.suggest("her")) == ["Hero", "Hero Rusty", "Héros d'été"]
+    assert texts(index.suggest("HÉRO ")) == ["Hero Rusty"]
+    assert texts(index.suggest("her", limit=2)) == ["Hero", "Hero Rusty"]
+    assert index.suggest("orw") == [
+        {"kind": "author", "id": 1, "text": "George Orwell"}
+    ]
+    assert texts(index.suggest("george o")) == ["George Orwell"]
+    assert index.suggest("zola") == []
+    assert index.suggest(" !") == []
+
+
+def test_changes_update_the_index(index):
+    index.add_book(5, "Heroine")
+    index.add_book(2, "Rusty")
+    index.remove_book(4)
+    index.add_author(1, "Georges", "Orwell")
+    index.remove_author(2)
+    index.remove_book(42)
+
+    assert texts(index.suggest("her")) == ["Heroine", "Héros d'été"]
+    assert texts(index.suggest("rus")) == ["Rusty"]
+    assert texts(index.suggest("orwell")) == ["Georges Orwell"]
+    assert index.suggest("huxley") == []
+
+
+def test_changes_made_while_loading_are_kept():
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    create_authors_and_books(engine)
+    index = SuggestIndex()
+
+    async def load():
+        loading = asyncio.create_task(index.load(async_engine))
+        await asyncio.sleep(0)
+        index.add_book(42, "Deadpond 2")
+        index.remove_book(1)
+        await loading
+
+    asyncio.run(load())
+    assert index.ready
+    assert texts(index.suggest("dead")) == ["Deadpond 2"]
+    assert texts(index.suggest("huxley")) == ["Aldous Huxley"]
+
+
+@pytest.fixture()
+def client():
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
+    create_authors_and_books(engine)
+    asyncio.run(suggestions.load(async_engine))
+
+    async def override_get_db():
+        async with AsyncSession(async_engine, expire_on_commit=False) as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[auth.verify] = lambda: True
+
+    yield TestClient(app)
+
+
+def test_suggest_route(client):
+    response = client.get("/books/suggest", params={"q": "dead"})
+    assert response.status_code == 200
+    assert response.json() == [{"kind": "book", "id": 1, "text": "Deadpond"}]
+    assert (
+        client.get("/books/suggest", params={"q": "x", "limit": 51}).status_code == 422
+    )
+
+
+def test_writes_update_the_suggestions(client):
+    client.put("/book/1", json={"title": "Deadpool"})
+    client.delete("/book/2")
+    client.put("/author/1", json={"last_name": "Orwel"})
+    response = client.post(
+        "/book/",
+        json={
+            "title": "Deadwood",
+            "isbn": "9999999999999",
+            "edition": "First",
+            "publication_date": "2000-01-01",
+            "language": "English",
+            "authors_ids": [2],
+        },
+    )
+    assert response.status_code == 200
+
+    def suggest(q):
+        return texts(client.get("/books/suggest", params={"q": q}).json())
+
+    assert suggest("dead") == ["Deadpool", "Deadwood"]
+    assert suggest("hero") == []
+    assert suggest("orwel") == ["George Orwel"]
+
+
+def test_suggestions_are_searched_while_the_index_loads(client, monkeypatch):
+    monkeypatch.setattr(suggestions, "ready", False)
+    response = client.get("/books/suggest", params={"q": "huxl"})
+    assert response.status_code == 200
+    assert {suggestion["kind"] for suggestion in response.json()} == {"book"}
+    assert len(response.json()) >= 1
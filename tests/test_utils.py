@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi.security import HTTPAuthorizationCredentials, SecurityScopes
+
+from config import Settings
+from utils import UnauthorizedException, VerifiedTokenCache, VerifyToken
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def make_token(kid="key-1", exp_in=3600, scope="admin"):
+    payload = {"sub": "admin", "scope": scope, "exp": int(time.time()) + exp_in}
+    return jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def verify(verifier, token, scopes=("admin",)):
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return asyncio.run(verifier.verify(SecurityScopes(list(scopes)), credentials))
+
+
+@pytest.fixture()
+def jwks_calls(monkeypatch):
+    calls = []
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": "key-1", "use": "sig"})
+
+    def fetch_data(jwks_client):
+        calls.append(jwks_client.uri)
+        return {"keys": [jwk]}
+
+    monkeypatch.setattr(jwt.PyJWKClient, "fetch_data", fetch_data)
+    return calls
+
+
+@pytest.fixture()
+def verifier():
+    config = Settings()
+    config.auth0_algorithms = "RS256"
+    config.auth0_api_audience = None
+    config.auth0_issuer = None
+    return VerifyToken(config)
+
+
+def test_verify_fetches_jwks_once(verifier, jwks_calls):
+    assert verify(verifier, make_token())["sub"] == "admin"
+    assert verify(verifier, make_token(exp_in=7200))["sub"] == "admin"
+    assert len(jwks_calls) == 1
+
+
+def test_verify_skips_decoding_of_known_tokens(verifier, jwks_calls, monkeypatch):
+    token = make_token()
+    verify(verifier, token)
+
+    def decode(*args, **kwargs):
+        raise AssertionError("The token should not be decoded again")
+
+    monkeypatch.setattr(jwt, "decode", decode)
+    assert verify(verifier, token)["sub"] == "admin"
+
+
+def test_verify_checks_scopes_of_cached_tokens(verifier, jwks_calls):
+    token = make_token(scope="member")
+    verify(verifier, token, scopes=())
+    with pytest.raises(UnauthorizedException):
+        verify(verifier, token)
+
+
+def test_verify_unknown_kid_refreshes_jwks(verifier, jwks_calls):
+    verifier.jwks_cache.min_refresh_interval = 0
+    verify(verifier, make_token())
+    with pytest.raises(UnauthorizedException):
+        verify(verifier, make_token(kid="key-2"))
+    assert len(jwks_calls) == 2
+
+
+def test_verify_unknown_kid_refresh_is_rate_limited(verifier, jwks_calls):
+    verify(verifier, make_token())
+    with pytest.raises(UnauthorizedException):
+        verify(verifier, make_token(kid="key-2"))
+    assert len(jwks_calls) == 1
+
+
+def test_verified_token_cache_expiration():
+    cache = VerifiedTokenCache()
+    cache.set("expired", {"exp": time.time() - 1})
+    cache.set("valid", {"exp": time.time() + 60})
+    cache.set("no_exp", {})
+    assert cache.get("expired") is None
+    assert cache.get("valid") is not None
+    assert cache.get("no_exp") is None
+
+
+def test_verified_token_cache_eviction():
+    cache = VerifiedTokenCache(maxsize=2)
+    cache.set("first", {"exp": time.time() + 60})
+    cache.set("second", {"exp": time.time() + 60})
+    cache.get("first")
+    cache.set("third", {"exp": time.time() + 60})
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.get("third") is not None
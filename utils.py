@@ -1,11 +1,17 @@
-from typing import Optional
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional
 
 import jwt
 import requests
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, SecurityScopes
 
-from config import get_settings
+from config import Settings, get_settings
 
 
 def get_token():
@@ -47,16 +53,94 @@ class UnauthenticatedException(HTTPException):
         )
 
 
+class JWKSCache:
+    """Signing keys of the JWKS endpoint, shared by every request of the process.
+
+    The endpoint is only called again when a token is signed with an unknown `kid`
+    (e.g. after a key rotation), from a thread so that the event loop is not blocked.
+    """
+
+    def __init__(self, jwks_url: str, min_refresh_interval: float = 30):
+        self.jwks_client = jwt.PyJWKClient(jwks_url, cache_jwk_set=False)
+        # Tokens with random kids must not make us call the endpoint for each request.
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    async def get_signing_key(self, kid: Optional[str]) -> jwt.PyJWK:
+        if kid not in self._keys:
+            await asyncio.to_thread(self._refresh, kid)
+        try:
+            return self._keys[kid]
+        except KeyError:
+            raise jwt.exceptions.PyJWKClientError(
+                f'Unable to find a signing key that matches: "{kid}"'
+            )
+
+    def _refresh(self, kid: Optional[str]):
+        # Concurrent requests with the same new kid wait for a single refresh.
+        with self._lock:
+            if kid in self._keys:
+                return
+            now = time.monotonic()
+            if (
+                self._refreshed_at is not None
+                and now - self._refreshed_at < self.min_refresh_interval
+            ):
+                return
+            self._refreshed_at = now
+            self._keys = {
+                key.key_id: key for key in self.jwks_client.get_signing_keys()
+            }
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of the payloads of already verified tokens, kept until they expire.
+
+    Tokens are stored hashed, so the cache never holds usable credentials.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._payloads: OrderedDict[str, dict] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        payload = self._payloads.get(key)
+        if payload is None:
+            return None
+        if payload["exp"] <= time.time():
+            del self._payloads[key]
+            return None
+        self._payloads.move_to_end(key)
+        return payload
+
+    def set(self, token: str, payload: dict):
+        if "exp" not in payload:
+            return
+        key = self._key(token)
+        self._payloads[key] = payload
+        self._payloads.move_to_end(key)
+        if len(self._payloads) > self.maxsize:
+            self._payloads.popitem(last=False)
+
+
 class VerifyToken:
     """Does all the token verification using PyJWT"""
 
-    def __init__(self):
-        self.config = get_settings()
+    def __init__(self, config: Optional[Settings] = None):
+        self.config = config or get_settings()
 
         # This gets the JWKS from a given URL and does processing so you can
         # use any of the keys available
         jwks_url = f"https://{self.config.auth0_domain}/.well-known/jwks.json"
-        self.jwks_client = jwt.PyJWKClient(jwks_url)
+        self.jwks_cache = JWKSCache(jwks_url)
+        self.token_cache = VerifiedTokenCache(self.config.token_cache_size)
 
     async def verify(
         self,
@@ -66,19 +150,30 @@ class VerifyToken:
         if token is None:
             raise UnauthenticatedException
 
+        # Tokens already verified by a previous request skip the signature check.
+        payload = self.token_cache.get(token.credentials)
+        if payload is None:
+            payload = await self._decode(token.credentials)
+            self.token_cache.set(token.credentials, payload)
+
+        if len(security_scopes.scopes) > 0:
+            self._check_claims(payload, "scope", security_scopes.scopes)
+
+        return payload
+
+    async def _decode(self, token: str) -> dict:
         # This gets the 'kid' from the passed token
         try:
-            signing_key = self.jwks_client.get_signing_key_from_jwt(
-                token.credentials
-            ).key
+            kid = jwt.get_unverified_header(token).get("kid")
+            signing_key = (await self.jwks_cache.get_signing_key(kid)).key
         except jwt.exceptions.PyJWKClientError as error:
             raise UnauthorizedException(str(error))
         except jwt.exceptions.DecodeError as error:
             raise UnauthorizedException(str(error))
 
         try:
-            payload = jwt.decode(
-                token.credentials,
+            return jwt.decode(
+                token,
                 signing_key,
                 algorithms=self.config.auth0_algorithms,
                 audience=self.config.auth0_api_audience,
@@ -87,11 +182,6 @@ class VerifyToken:
         except Exception as error:
             raise UnauthorizedException(str(error))
 
-        if len(security_scopes.scopes) > 0:
-            self._check_claims(payload, "scope", security_scopes.scopes)
-
-        return payload
-
     def _check_claims(self, payload, claim_name, expected_value):
         if claim_name not in payload:
             raise UnauthorizedException(
@@ -106,3 +196,9 @@ class VerifyToken:
         for value in expected_value:
             if value not in payload_claim:
                 raise UnauthorizedException(detail=f'Missing "{claim_name}" scope')
+
+
+@lru_cache()
+def get_verifier():
+    """The verifier shared by every router, so that they share the same caches."""
+    return VerifyToken()